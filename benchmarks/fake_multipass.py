@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+
+"""
+Stand-in for the multipass CLI used by the benchmarks.
+
+The instances are folders in $FAKE_MULTIPASS_ROOT and `multipass exec` runs the command locally in the instance
+folder. The latency of the real multipass is simulated with:
+    FAKE_MULTIPASS_LAUNCH_LATENCY       seconds spent by launch, clone and start (default: 0.5)
+    FAKE_MULTIPASS_TRANSFER_THROUGHPUT  bytes per second of transfer and of the exec stdin (default: 100 MiB/s)
+    FAKE_MULTIPASS_FILE_LATENCY         seconds spent by transfer on every file (default: 0.002)
+    FAKE_MULTIPASS_EXEC_OUTPUT_LINES    lines printed by every exec before running the command (default: 0)
+"""
+
+import fcntl
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+
+ROOT = os.environ.get("FAKE_MULTIPASS_ROOT", os.path.join(os.getcwd(), ".fake_multipass"))
+LAUNCH_LATENCY = float(os.environ.get("FAKE_MULTIPASS_LAUNCH_LATENCY", "0.5"))
+TRANSFER_THROUGHPUT = float(os.environ.get("FAKE_MULTIPASS_TRANSFER_THROUGHPUT", str(100 * 1024 ** 2)))
+FILE_LATENCY = float(os.environ.get("FAKE_MULTIPASS_FILE_LATENCY", "0.002"))
+EXEC_OUTPUT_LINES = int(os.environ.get("FAKE_MULTIPASS_EXEC_OUTPUT_LINES", "0"))
+
+OPTIONS_WITH_VALUE = {"--name", "-n", "--cpus", "-c", "--memory", "-m", "--disk", "-d", "--cloud-init", "--format",
+                      "--timeout", "--network", "--mount"}
+
+
+def instance_path(instance_name: str) -> str:
+    return os.path.join(ROOT, "instances", instance_name)
+
+
+def load_instances() -> dict:
+    try:
+        with open(os.path.join(ROOT, "instances.json")) as state_file:
+            return json.load(state_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_instances(instances: dict) -> None:
+    with open(os.path.join(ROOT, "instances.json"), "w") as state_file:
+        json.dump(instances, state_file)
+
+
+@contextmanager
+def instances_lock():
+    """
+    Serialize the changes to the instances of concurrent fake multipass processes
+    """
+    os.makedirs(ROOT, exist_ok=True)
+    with open(os.path.join(ROOT, "instances.lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+def fail(message: str, returncode: int = 2) -> None:
+    print(message, file=sys.stderr)
+    sys.exit(returncode)
+
+
+def split_options(arguments):
+    options, positionals = {}, []
+    index = 0
+    while index < len(arguments):
+        if arguments[index] in OPTIONS_WITH_VALUE:
+            options[arguments[index]] = arguments[index + 1]
+            index += 2
+        elif arguments[index].startswith("-"):
+            options[arguments[index]] = True
+            index += 1
+        else:
+            positionals.append(arguments[index])
+            index += 1
+
+    return options, positionals
+
+
+def throttle(size: int) -> None:
+    if TRANSFER_THROUGHPUT > 0:
+        time.sleep(size / TRANSFER_THROUGHPUT)
+
+
+def resolve(location: str) -> str:
+    """
+    Resolve INSTANCE:PATH to the local path in the instance folder
+    """
+    if ":" in location and not os.path.isabs(location):
+        instance_name, path = location.split(":", 1)
+        if instance_name not in load_instances():
+            fail(f"instance \"{instance_name}\" does not exist")
+        return os.path.join(instance_path(instance_name), path)
+
+    return location
+
+
+def tree_files(path: str) -> list:
+    if os.path.isfile(path):
+        return [path]
+    return [os.path.join(folder, file) for folder, _, files in os.walk(path) for file in files]
+
+
+def launch(arguments) -> None:
+    options, positionals = split_options(arguments)
+    instance_name = options.get("--name") or options.get("-n") or "primary"
+    if instance_name in load_instances():
+        fail(f"instance \"{instance_name}\" already exists")
+
+    time.sleep(LAUNCH_LATENCY)
+    os.makedirs(instance_path(instance_name), exist_ok=True)
+    with instances_lock():
+        instances = load_instances()
+        instances[instance_name] = {"state": "Running", "image": positionals[0] if positionals else "default",
+                                    "cpus": options.get("--cpus", "1"), "memory": options.get("--memory", "1G"),
+                                    "disk": options.get("--disk", "5G")}
+        save_instances(instances)
+    print(f"Launched: {instance_name}")
+
+
+def transfer(arguments) -> None:
+    options, positionals = split_options(arguments)
+    *sources, destination = positionals
+    destination = resolve(destination)
+
+    for source in sources:
+        source = resolve(source)
+        files = tree_files(source)
+        throttle(sum(os.path.getsize(file) for file in files))
+        time.sleep(FILE_LATENCY * len(files))
+        target = destination
+        if destination.endswith("/") or os.path.isdir(destination) or len(sources) > 1:
+            target = os.path.join(destination, os.path.basename(source.rstrip("/")))
+        if os.path.isdir(source):
+            shutil.copytree(source, target, dirs_exist_ok=True)
+        else:
+            os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+            shutil.copy2(source, target)
+
+
+def execute(arguments) -> None:
+    instance_name = arguments[0]
+    command = arguments[arguments.index("--") + 1:] if "--" in arguments else arguments[1:]
+    if instance_name not in load_instances():
+        fail(f"instance \"{instance_name}\" does not exist")
+
+    for line in range(EXEC_OUTPUT_LINES):
+        print(f"fake output line {line}")
+    sys.stdout.flush()
+
+    # Throttles the data sent to the instance (e.g. a tar stream) by relaying stdin in chunks, as soon as they
+    # arrive so an interactive shell gets its commands
+    process = subprocess.Popen(command, cwd=instance_path(instance_name), stdin=subprocess.PIPE,
+                               env={**os.environ, "HOME": instance_path(instance_name)})
+    while chunk := sys.stdin.buffer.read1(1024 * 1024):
+        throttle(len(chunk))
+        process.stdin.write(chunk)
+        process.stdin.flush()
+    process.stdin.close()
+    sys.exit(process.wait())
+
+
+def set_state(arguments, state: str) -> None:
+    _, instance_names = split_options(arguments)
+    for instance_name in instance_names:
+        instance = load_instances().get(instance_name)
+        if instance is None:
+            fail(f"instance \"{instance_name}\" does not exist")
+        if state == "Running" and instance["state"] != "Running":
+            time.sleep(LAUNCH_LATENCY)
+        with instances_lock():
+            instances = load_instances()
+            instances[instance_name]["state"] = state
+            save_instances(instances)
+
+
+def delete(arguments) -> None:
+    _, instance_names = split_options(arguments)
+    with instances_lock():
+        instances = load_instances()
+        for instance_name in instance_names:
+            instances.pop(instance_name, None)
+            shutil.rmtree(instance_path(instance_name), ignore_errors=True)
+        save_instances(instances)
+
+
+def clone(arguments) -> None:
+    options, positionals = split_options(arguments)
+    source, instance_name = positionals[0], options.get("--name") or options.get("-n")
+    time.sleep(LAUNCH_LATENCY)
+    shutil.copytree(instance_path(source), instance_path(instance_name))
+    with instances_lock():
+        instances = load_instances()
+        instances[instance_name] = {**instances[source], "state": "Stopped"}
+        save_instances(instances)
+
+
+def set_setting(arguments) -> None:
+    # local.INSTANCE.cpus=2
+    key, _, value = arguments[0].partition("=")
+    _, instance_name, setting = key.split(".", 2)
+    with instances_lock():
+        instances = load_instances()
+        if instance_name not in instances:
+            fail(f"instance \"{instance_name}\" does not exist")
+        instances[instance_name][setting] = value
+        save_instances(instances)
+
+
+def info(arguments) -> None:
+    options, instance_names = split_options(arguments)
+    instances = load_instances()
+    for instance_name in instance_names:
+        if instance_name not in instances:
+            fail(f"instance \"{instance_name}\" does not exist")
+    if options.get("--format") == "json":
+        info = {name: {"state": instances[name]["state"]} for name in instance_names}
+        print(json.dumps({"errors": [], "info": info}))
+    else:
+        for instance_name in instance_names:
+            print(f"Name: {instance_name}\nState: {instances[instance_name]['state']}")
+
+
+def list_instances(_) -> None:
+    print(json.dumps({"list": [{"name": name, "state": instance["state"], "release": instance["image"],
+                                "ipv4": []} for name, instance in load_instances().items()]}))
+
+
+def main() -> None:
+    if len(sys.argv) < 2:
+        fail("usage: multipass COMMAND")
+
+    match sys.argv[1]:
+        case "launch":
+            launch(sys.argv[2:])
+        case "transfer":
+            transfer(sys.argv[2:])
+        case "exec":
+            execute(sys.argv[2:])
+        case "start":
+            set_state(sys.argv[2:], "Running")
+        case "stop":
+            set_state(sys.argv[2:], "Stopped")
+        case "recover":
+            set_state(sys.argv[2:], "Stopped")
+        case "delete":
+            delete(sys.argv[2:])
+        case "clone":
+            clone(sys.argv[2:])
+        case "set":
+            set_setting(sys.argv[2:])
+        case "info":
+            info(sys.argv[2:])
+        case "list":
+            list_instances(sys.argv[2:])
+        case "shell" | "mount" | "umount" | "purge" | "snapshot" | "restore" | "version":
+            pass
+        case _:
+            fail(f"unknown command {sys.argv[1]}")
+
+
+if __name__ == "__main__":
+    main()
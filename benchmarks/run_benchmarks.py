@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+
+"""
+End-to-end benchmarks of the crashtest orchestration, run against the fake multipass of fake_multipass.py.
+
+    python benchmarks/run_benchmarks.py --output results.json
+    python benchmarks/run_benchmarks.py --output results.json --baseline baseline.json --threshold 0.25
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Dict, List
+from unittest.mock import patch
+
+BENCHMARKS_PATH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_PATH))
+
+from crash_test.crashtest import CrashTest, args_parser  # noqa: E402
+
+
+class Scenario:
+    def __init__(self, name: str, file_count: int, file_size: int, arguments: List[str], runs: int = 1):
+        """
+        :param name: the unique name of the scenario
+        :param file_count: the number of files of the generated project
+        :param file_size: the size in bytes of every file of the generated project
+        :param arguments: the crashtest arguments, besides --instance-name and --project
+        :param runs: the number of crashtest runs against the same instance, only the last one is measured
+        """
+        self.name = name
+        self.file_count = file_count
+        self.file_size = file_size
+        self.arguments = arguments
+        self.runs = runs
+
+
+def build_scenarios(quick: bool) -> List[Scenario]:
+    file_counts = [100, 1000] if quick else [100, 1000, 10000]
+    scenarios = []
+    for file_count in file_counts:
+        scenarios.append(Scenario(f"copy-{file_count}-files", file_count, 1024, []))
+        scenarios.append(Scenario(f"stream-{file_count}-files", file_count, 1024, ["--stream"]))
+        scenarios.append(Scenario(f"sync-rerun-{file_count}-files", file_count, 1024, ["--sync"], runs=2))
+
+    large_file_size = 16 * 1024 ** 2 if quick else 256 * 1024 ** 2
+    scenarios.append(Scenario("copy-large-file", 1, large_file_size, []))
+    scenarios.append(Scenario("stream-large-file", 1, large_file_size, ["--stream", "--compression", "none"]))
+    scenarios.append(Scenario("sync-rerun-persistent-session", 100, 1024, ["--sync", "--persistent-session"], runs=2))
+
+    for concurrency in ([1, 4] if quick else [1, 4, 8]):
+        scenarios.append(Scenario(f"matrix-8-instances-concurrency-{concurrency}", 100, 1024,
+                                  ["--matrix-count", "8", "--concurrency", str(concurrency), "--delete"]))
+
+    return scenarios
+
+
+def generate_project(project_path: str, file_count: int, file_size: int) -> None:
+    for index in range(file_count):
+        folder = os.path.join(project_path, f"package_{index // 100}")
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, f"module_{index}.py"), "wb") as file:
+            file.write(os.urandom(file_size // 2).hex().encode()[:file_size])
+
+
+def install_fake_multipass(bin_path: str) -> None:
+    os.makedirs(bin_path, exist_ok=True)
+    wrapper_path = os.path.join(bin_path, "multipass")
+    with open(wrapper_path, "w") as wrapper:
+        wrapper.write(f"#!/bin/sh\nexec \"{sys.executable}\" \"{os.path.join(BENCHMARKS_PATH, 'fake_multipass.py')}\""
+                      f" \"$@\"\n")
+    os.chmod(wrapper_path, 0o755)
+
+
+def run_crashtest(arguments: List[str]) -> int:
+    with patch.object(sys, "argv", ["crashtest", *arguments]):
+        crashtest = CrashTest(args=args_parser())
+
+    try:
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            crashtest.run()
+    except SystemExit as exit_info:
+        return exit_info.code or 0
+
+    return 0
+
+
+def run_scenario(scenario: Scenario, repeat: int) -> Dict:
+    durations = []
+    peak_memory = 0
+    returncode = 0
+
+    for iteration in range(repeat):
+        with tempfile.TemporaryDirectory() as tmp_path:
+            project_path = os.path.join(tmp_path, "bench_project")
+            generate_project(project_path, scenario.file_count, scenario.file_size)
+            install_fake_multipass(os.path.join(tmp_path, "bin"))
+
+            environment = {
+                "PATH": f"{os.path.join(tmp_path, 'bin')}{os.pathsep}{os.environ['PATH']}",
+                "FAKE_MULTIPASS_ROOT": os.path.join(tmp_path, "multipass"),
+                "CRASHTEST_HOME": os.path.join(tmp_path, "crashtest_home"),
+            }
+            arguments = ["--instance-name", "bench-instance", "--project", project_path, *scenario.arguments]
+
+            with patch.dict(os.environ, environment):
+                for _ in range(scenario.runs - 1):
+                    run_crashtest(arguments)
+                    # Changes one file between the runs against the same instance
+                    with open(os.path.join(project_path, "package_0", "module_0.py"), "ab") as file:
+                        file.write(b"# changed\n")
+
+                # Peak memory is only traced on the last iteration so it does not slow down the timed ones
+                trace_memory = iteration == repeat - 1
+                if trace_memory:
+                    tracemalloc.start()
+                start = time.perf_counter()
+                returncode = returncode or run_crashtest(arguments)
+                durations.append(time.perf_counter() - start)
+                if trace_memory:
+                    peak_memory = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+
+    return {
+        "seconds": statistics.median(durations[:-1] or durations),
+        "peak_memory_bytes": peak_memory,
+        "file_count": scenario.file_count,
+        "project_bytes": scenario.file_count * scenario.file_size,
+        "returncode": returncode,
+    }
+
+
+def compare(results: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """
+    :return: the scenarios slower than the baseline by more than the threshold
+    """
+    regressions = []
+    for name, result in results["scenarios"].items():
+        baseline_result = baseline.get("scenarios", {}).get(name)
+        if baseline_result and result["seconds"] > baseline_result["seconds"] * (1 + threshold):
+            regressions.append(f"{name}: {baseline_result['seconds']:.3f}s -> {result['seconds']:.3f}s "
+                               f"(+{(result['seconds'] / baseline_result['seconds'] - 1) * 100:.0f}%)")
+
+    return regressions
+
+
+def benchmark_args_parser():
+    parser = argparse.ArgumentParser(description="Benchmark the crashtest orchestration against a fake multipass")
+    parser.add_argument("--output", type=str, default="benchmark_results.json", help="Results JSON file")
+    parser.add_argument("--baseline", type=str, help="Results JSON file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="Slowdown ratio over the baseline reported as a regression (default: 0.25)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of every scenario (default: 3)")
+    parser.add_argument("--quick", action="store_true", help="Smaller projects and fewer scenarios")
+    parser.add_argument("--filter", type=str, default="", help="Only run the scenarios containing this string")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = benchmark_args_parser()
+    results = {"python": platform.python_version(), "platform": platform.platform(), "scenarios": {}}
+
+    for scenario in build_scenarios(quick=args.quick):
+        if args.filter in scenario.name:
+            result = run_scenario(scenario, repeat=max(args.repeat, 1))
+            results["scenarios"][scenario.name] = result
+            print(f"{scenario.name:<45}{result['seconds']:>9.3f}s{result['peak_memory_bytes'] / 1024 ** 2:>9.1f} MiB"
+                  f"{'' if result['returncode'] == 0 else '  FAILED'}")
+
+    with open(args.output, "w") as output_file:
+        json.dump(results, output_file, indent=2)
+
+    failed = [name for name, result in results["scenarios"].items() if result["returncode"] != 0]
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), threshold=args.threshold)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+
+    if failed or regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
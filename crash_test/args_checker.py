@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import os
+from typing import List
 
 import crash_test.error_codes
 from crash_test.error_logger import log_error
@@ -40,6 +41,20 @@ def project_check(project_path) -> bool:
         return False
 
 
+def matrix_options_check(options: List[str]) -> bool:
+    """
+    Check that no option the matrix runs ignore is specified
+    :param options: the options specified together with the matrix options
+    :return: Bool: False if an option is not supported by the matrix runs;
+                   True if all the options are supported.
+    """
+    if options:
+        print(f"{log_error(error_code=crash_test.error_codes.MATRIX_UNSUPPORTED_OPTIONS_ERROR)}{', '.join(options)}.")
+        return False
+    else:
+        return True
+
+
 def arguments_check(instance_name, project_path) -> bool:
     """
     Check the instance name format and project
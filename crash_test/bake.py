@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+
+import argparse
+import hashlib
+import os
+import re
+import subprocess
+import sys
+import time
+from typing import Dict, Final, List, Optional
+
+from colorama import Fore, Style
+
+from crash_test.multipass import execute_multipass_command, launch_command, instance_exists, \
+    invalidate_instances_cache
+from crash_test.utils import load_state, save_state, state_lock, parse_duration, format_duration, \
+    get_scripts_absolute_path, SCRIPT_RELATIVE_PATH
+
+# The base instances baked by crashtest bake, per image and ecosystems
+BASES_STATE_FILE: Final[str] = "bases.json"
+# A base older than this is baked again before it is used
+DEFAULT_MAX_AGE: Final[str] = "7d"
+# The installation scripts are named ECOSYSTEM_dependencies.sh
+SCRIPT_SUFFIX: Final[str] = "_dependencies.sh"
+# Makes an installation script install the toolchain only and mark it as baked in the instance
+TOOLCHAIN_ONLY_ENVIRONMENT: Final[str] = "CRASHTEST_TOOLCHAIN_ONLY=1"
+
+
+def script_ecosystem(script_path: str) -> str:
+    """
+    :return: the ecosystem installed by an installation script (e.g. python for python_dependencies.sh)
+    """
+    return os.path.basename(script_path).removesuffix(SCRIPT_SUFFIX)
+
+
+def ecosystem_scripts(scripts_path: str) -> Dict[str, str]:
+    """
+    :return: dict: {ecosystem: the path to its installation script}
+    """
+    return {script_ecosystem(file_name): os.path.join(scripts_path, file_name)
+            for file_name in sorted(os.listdir(scripts_path)) if file_name.endswith(SCRIPT_SUFFIX)}
+
+
+def base_key(ecosystems: List[str], image: Optional[str]) -> str:
+    return f"{image or 'default'}:{'+'.join(sorted(set(ecosystems)))}"
+
+
+def base_instance_name(ecosystems: List[str], image: Optional[str], version: int) -> str:
+    image_name = re.sub(r"[^a-z0-9]+", "-", (image or "default").lower()).strip("-")
+    return f"crashtest-base-{'-'.join(sorted(set(ecosystems)))}-{image_name}-v{version}"
+
+
+def toolchain_fingerprint(script_paths: List[str]) -> str:
+    """
+    Fingerprint the installation scripts, a base baked with other scripts is baked again
+    """
+    fingerprint = hashlib.sha256()
+    for script_path in sorted(script_paths):
+        with open(script_path, "rb") as script_file:
+            fingerprint.update(os.path.basename(script_path).encode())
+            fingerprint.update(hashlib.sha256(script_file.read()).digest())
+
+    return fingerprint.hexdigest()
+
+
+def find_base(ecosystems: List[str], image: Optional[str]) -> Optional[dict]:
+    """
+    Find the base instance of the ecosystems
+    :return: the base, or None if it was never baked or its instance was deleted
+    """
+    base = load_state(BASES_STATE_FILE).get(base_key(ecosystems, image))
+    if base and instance_exists(base["instance"]):
+        return base
+
+    return None
+
+
+def base_expired(base: dict, max_age: float, fingerprint: str) -> bool:
+    return time.time() - base["created"] >= max_age or base["fingerprint"] != fingerprint
+
+
+def delete_base_instance(instance_name: str) -> None:
+    subprocess.run(["multipass", "delete", "--purge", instance_name], stdout=subprocess.DEVNULL,
+                   stderr=subprocess.DEVNULL)
+    invalidate_instances_cache()
+
+
+def bake_base(ecosystems: Dict[str, str], image: Optional[str]) -> dict:
+    """
+    Launch an instance, install the toolchains of the ecosystems (apt upgrade, python3, nvm and node...) and stop it,
+    so the runs clone it instead of installing the toolchains again. The previous version of the base is deleted.
+    :param ecosystems: dict: {ecosystem: the path to its installation script}
+    :param image: the image of the base
+    :return: the base
+    """
+    key = base_key(list(ecosystems), image)
+    previous = load_state(BASES_STATE_FILE).get(key)
+    version = previous["version"] + 1 if previous else 1
+    instance_name = base_instance_name(list(ecosystems), image, version)
+
+    print(f"{Fore.GREEN}Baking {instance_name}...\n{Style.RESET_ALL}")
+    if instance_exists(instance_name):
+        # Left behind by an interrupted bake
+        delete_base_instance(instance_name)
+    try:
+        execute_multipass_command(launch_command(instance_name=instance_name, image=image))
+        for ecosystem, script_path in ecosystems.items():
+            instance_script_path = f"./bake_{os.path.basename(script_path)}"
+            execute_multipass_command(["multipass", "transfer", script_path, f"{instance_name}:{instance_script_path}"])
+            execute_multipass_command(["multipass", "exec", instance_name, "--", "env", TOOLCHAIN_ONLY_ENVIRONMENT,
+                                       "bash", instance_script_path])
+            execute_multipass_command(["multipass", "exec", instance_name, "--", "rm", instance_script_path])
+        execute_multipass_command(["multipass", "stop", instance_name])
+    except SystemExit:
+        print(f"{Fore.RED}𝙓 The base {instance_name} could not be baked.{Style.RESET_ALL}")
+        delete_base_instance(instance_name)
+        raise
+
+    base = {"instance": instance_name, "version": version, "image": image, "ecosystems": sorted(ecosystems),
+            "created": time.time(), "fingerprint": toolchain_fingerprint(list(ecosystems.values()))}
+    with state_lock(BASES_STATE_FILE):
+        state = load_state(BASES_STATE_FILE)
+        state[key] = base
+        save_state(BASES_STATE_FILE, state)
+
+    if previous and previous["instance"] != instance_name:
+        delete_base_instance(previous["instance"])
+    print(f"{Fore.GREEN}Base {instance_name} baked successfully!\n{Style.RESET_ALL}")
+
+    return base
+
+
+def ensure_base(ecosystems: Dict[str, str], image: Optional[str], max_age: float, force: bool = False) -> dict:
+    """
+    Get the base of the ecosystems, baking it if it does not exist, if it is older than max_age or if the
+    installation scripts changed
+    :param ecosystems: dict: {ecosystem: the path to its installation script}
+    :param image: the image of the base
+    :param max_age: the seconds after which the base is baked again
+    :param force: bake the base even if it is up to date
+    :return: the base
+    """
+    base = find_base(list(ecosystems), image)
+    if base and not force:
+        if not base_expired(base, max_age=max_age, fingerprint=toolchain_fingerprint(list(ecosystems.values()))):
+            return base
+        print(f"{Fore.YELLOW}The base {base['instance']} is outdated "
+              f"({format_duration(time.time() - base['created'])} old), baking it again...{Style.RESET_ALL}")
+
+    return bake_base(ecosystems, image=image)
+
+
+def restore_base(base_instance: str, instance_name: str, cpus: Optional[int] = None, memory: Optional[str] = None,
+                 disk: Optional[str] = None) -> None:
+    """
+    Clone a base into a new instance with the toolchains already installed, resized to the resources of the run
+    :param base_instance: the name of the base instance
+    :param instance_name: the name of the new instance
+    :param cpus: the number of CPUs of the instance
+    :param memory: the memory of the instance (e.g. 4G)
+    :param disk: the disk space of the instance (e.g. 20G), a disk can only grow
+    """
+    print(f"{Fore.GREEN}Cloning the base {base_instance}...\n{Style.RESET_ALL}")
+    execute_multipass_command(["multipass", "clone", base_instance, "--name", instance_name])
+    for setting, value in (("cpus", cpus), ("memory", memory), ("disk", disk)):
+        if value:
+            execute_multipass_command(["multipass", "set", f"local.{instance_name}.{setting}={value}"])
+    execute_multipass_command(["multipass", "start", instance_name])
+    print(f"{Fore.GREEN}Instance {instance_name} created from the base successfully!\n{Style.RESET_ALL}")
+
+
+def print_bases() -> None:
+    bases = load_state(BASES_STATE_FILE)
+    if not bases:
+        print(f"{Fore.YELLOW}No base baked yet.{Style.RESET_ALL}")
+        return
+
+    now = time.time()
+    print(f"{'BASE':<48}{'IMAGE':<12}{'ECOSYSTEMS':<20}{'AGE':>8}")
+    for base in bases.values():
+        print(f"{base['instance']:<48}{base['image'] or 'default':<12}{'+'.join(base['ecosystems']):<20}"
+              f"{format_duration(now - base['created']):>8}")
+
+
+def bake_args_parser(argv):
+    parser = argparse.ArgumentParser(
+        prog="crashtest bake",
+        description="Bake a base instance with the toolchains of the ecosystems already installed, cloned by "
+                    "crashtest --baked instead of installing them on every new instance"
+    )
+    parser.add_argument("-e", "--ecosystem", type=str, action="append", default=[],
+                        help="The ecosystem of the base (e.g. python, npm), can be repeated to bake several "
+                             "toolchains in the same base")
+    parser.add_argument("--image", type=str, help="The image of the base (the multipass default image if not set)")
+    parser.add_argument("--max-age", type=parse_duration, default=DEFAULT_MAX_AGE,
+                        help=f"Only bake the base again if it is older than this (default: {DEFAULT_MAX_AGE})")
+    parser.add_argument("--force", action="store_true", help="Bake the base even if it is up to date")
+    parser.add_argument("--list", action="store_true", help="List the baked bases")
+
+    return parser.parse_args(argv)
+
+
+def bake_main(argv) -> None:
+    args = bake_args_parser(argv)
+    if args.list:
+        print_bases()
+        return
+
+    scripts = ecosystem_scripts(get_scripts_absolute_path(SCRIPT_RELATIVE_PATH))
+    unknown = [ecosystem for ecosystem in args.ecosystem if ecosystem not in scripts]
+    if not args.ecosystem or unknown:
+        print(f"{Fore.RED}𝙓 Specify the ecosystems to bake with --ecosystem: {', '.join(scripts)}"
+              f"{Style.RESET_ALL}")
+        sys.exit(1)
+
+    base = ensure_base({ecosystem: scripts[ecosystem] for ecosystem in args.ecosystem}, image=args.image,
+                       max_age=args.max_age, force=args.force)
+    print(f"{Fore.GREEN}{base['instance']} is {format_duration(time.time() - base['created'])} old.{Style.RESET_ALL}")
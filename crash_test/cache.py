@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+import os
+from typing import Final, List
+
+from colorama import Fore, Style
+
+from crash_test.multipass import execute_multipass_command, is_mounted
+from crash_test.utils import get_crashtest_home
+
+# The package caches kept on the host, one folder per ecosystem
+CACHE_ECOSYSTEMS: Final[List[str]] = ["apt", "pip", "npm", "nvm"]
+GUEST_CACHE_PATH: Final[str] = "/home/ubuntu/.crashtest-cache"
+
+
+def get_cache_path() -> str:
+    """
+    Get the host package cache folder, creating the folder of every ecosystem
+    :return: the absolute path to the host cache
+    """
+    cache_path = os.path.join(get_crashtest_home(), "cache")
+    for ecosystem in CACHE_ECOSYSTEMS:
+        os.makedirs(os.path.join(cache_path, ecosystem), exist_ok=True)
+
+    return cache_path
+
+
+def mount_cache(instance_name: str) -> None:
+    """
+    Mount the host package cache in the instance so pip, npm, nvm and apt reuse the downloaded packages
+    :param instance_name: the name of the multipass instance
+    """
+    # The cache stays mounted in a reused instance
+    if is_mounted(instance_name, GUEST_CACHE_PATH):
+        return
+
+    print(f"{Fore.GREEN}Mounting the package cache...\n{Style.RESET_ALL}")
+    execute_multipass_command(mount_cache_command(instance_name))
+
+
+def mount_cache_command(instance_name: str) -> List[str]:
+    return ["multipass", "mount", get_cache_path(), f"{instance_name}:{GUEST_CACHE_PATH}"]
+
+
+def cache_environment(offline: bool = False) -> List[str]:
+    """
+    Build the environment that tells the installation scripts to use the mounted cache
+    :param offline: only install from the cache, without downloading anything
+    :return: the env command prefix
+    """
+    environment = ["env", f"CRASHTEST_CACHE={GUEST_CACHE_PATH}"]
+    if offline:
+        environment.append("CRASHTEST_OFFLINE=1")
+
+    return environment
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+
+import base64
+import json
+import os
+import shlex
+import subprocess
+from typing import Dict, Final, List, Tuple
+
+from colorama import Fore, Style
+
+from crash_test.cache import GUEST_CACHE_PATH
+from crash_test.dependencies_checker import Subproject
+from crash_test.multipass import execute_multipass_command, MultipassCommandError, TAIL_LINES
+from crash_test.retry import phase_policy
+from crash_test.utils import get_crashtest_home, format_duration
+
+GUEST_HOME_PATH: Final[str] = "/home/ubuntu"
+# The folder of the instance holding the provisioning scripts, their log and the readiness marker
+GUEST_PROVISIONING_PATH: Final[str] = "/home/ubuntu/.crashtest"
+PROVISIONING_SCRIPT: Final[str] = f"{GUEST_PROVISIONING_PATH}/provision.sh"
+PROVISIONING_LOG: Final[str] = f"{GUEST_PROVISIONING_PATH}/provision.log"
+# Written with the exit code of the provisioning once it is done
+READY_MARKER: Final[str] = f"{GUEST_PROVISIONING_PATH}/ready"
+# The seconds the provisioning waits for crashtest to mount the package cache
+CACHE_MOUNT_TIMEOUT: Final[int] = 300
+# The log of cloud-init itself, it tells why the provisioning did not start
+CLOUD_INIT_LOG: Final[str] = "/var/log/cloud-init-output.log"
+# The manifests a subproject can be installed from before its sources are transferred. The python subprojects
+# without requirements.txt are installed in editable mode, from their sources.
+BOOT_MANIFESTS: Final[Dict[str, List[str]]] = {
+    "python": ["requirements.txt"],
+    "npm": ["package.json"],
+}
+
+
+def write_file_entry(path: str, content: bytes, permissions: str = "0644") -> dict:
+    # defer: the files are written once the ubuntu user exists, so they can belong to it
+    return {"path": path, "content": base64.b64encode(content).decode(), "encoding": "b64",
+            "owner": "ubuntu:ubuntu", "permissions": permissions, "defer": True}
+
+
+def installable_at_boot(subproject: Subproject) -> bool:
+    return any(os.path.basename(manifest) in BOOT_MANIFESTS.get(subproject.project_type, [])
+               for manifest in subproject.manifests)
+
+
+def split_boot_scripts(
+        scripts: Dict[str, List[Subproject]]) -> Tuple[Dict[str, List[Subproject]], Dict[str, List[Subproject]]]:
+    """
+    Split the subprojects installed by cloud-init at the first boot from the ones installed after the transfer
+    :param scripts: the path to each installation script and the subprojects it installs
+    :return: the scripts and the subprojects installed at boot, then the ones installed after the transfer
+    """
+    boot_scripts: Dict[str, List[Subproject]] = {}
+    deferred_scripts: Dict[str, List[Subproject]] = {}
+    for script_path, subprojects in scripts.items():
+        for subproject in subprojects:
+            (boot_scripts if installable_at_boot(subproject) else deferred_scripts).setdefault(
+                script_path, []).append(subproject)
+
+    return boot_scripts, deferred_scripts
+
+
+def provisioning_script(project_name: str, scripts: Dict[str, List[Subproject]], environment: List[str]) -> str:
+    """
+    Generate the script that runs the installation scripts at the first boot and writes the readiness marker
+    :param project_name: the project name without the path
+    :param scripts: the path to each installation script and the subprojects it installs
+    :param environment: the env command prefix of the installation scripts (e.g. the package cache)
+    :return: the script
+    """
+    lines = ["#!/usr/bin/env bash", f"cd {GUEST_HOME_PATH} || exit 1", "STATUS=0"]
+
+    if any(variable.startswith("CRASHTEST_CACHE=") for variable in environment):
+        lines += [
+            "# crashtest mounts the package cache once the instance is launched",
+            f"for _ in $(seq {CACHE_MOUNT_TIMEOUT}); do mountpoint -q {GUEST_CACHE_PATH} && break; sleep 1; done",
+        ]
+
+    for script_path, subprojects in scripts.items():
+        command = environment + ["bash", f"{GUEST_PROVISIONING_PATH}/install_{os.path.basename(script_path)}",
+                                 project_name] + [subproject.path for subproject in subprojects]
+        lines.append(f"{shlex.join(command)} || STATUS=$?")
+
+    lines.append(f"echo $STATUS > {READY_MARKER}")
+
+    return "\n".join(lines) + "\n"
+
+
+def build_user_data(project_path: str, project_name: str, scripts: Dict[str, List[Subproject]],
+                    environment: List[str]) -> str:
+    """
+    Generate the cloud-init user-data that provisions the instance at its first boot: the manifests of the
+    subprojects and the installation scripts are written in the instance, then installed in the background so the
+    project can be transferred at the same time
+    :param project_path: the path to the project
+    :param project_name: the project name without the path
+    :param scripts: the path to each installation script and the subprojects it installs
+    :param environment: the env command prefix of the installation scripts (e.g. the package cache)
+    :return: the user-data
+    """
+    write_files = []
+    for script_path, subprojects in scripts.items():
+        with open(script_path, "rb") as script_file:
+            write_files.append(write_file_entry(f"{GUEST_PROVISIONING_PATH}/install_{os.path.basename(script_path)}",
+                                                script_file.read(), permissions="0755"))
+        for subproject in subprojects:
+            for manifest in subproject.manifests:
+                with open(os.path.join(project_path, manifest), "rb") as manifest_file:
+                    write_files.append(write_file_entry(f"{GUEST_HOME_PATH}/{project_name}/{manifest}",
+                                                        manifest_file.read()))
+
+    write_files.append(write_file_entry(PROVISIONING_SCRIPT,
+                                        provisioning_script(project_name, scripts, environment).encode(),
+                                        permissions="0755"))
+
+    user_data = {
+        "write_files": write_files,
+        "runcmd": [
+            # The parent folders of the written files are created by root
+            ["chown", "-R", "ubuntu:ubuntu", f"{GUEST_HOME_PATH}/{project_name}", GUEST_PROVISIONING_PATH],
+            # Detached so that multipass launch returns without waiting for the installation
+            ["su", "-", "ubuntu", "-c", f"setsid nohup bash {PROVISIONING_SCRIPT} > {PROVISIONING_LOG} 2>&1 &"],
+        ],
+    }
+
+    # JSON is valid YAML
+    return f"#cloud-config\n{json.dumps(user_data, indent=2)}\n"
+
+
+def write_user_data(instance_name: str, user_data: str) -> str:
+    """
+    Write the user-data in the crashtest home, which the snap of multipass can read unlike /tmp
+    :return: the path to the user-data file
+    """
+    cloud_init_path = os.path.join(get_crashtest_home(), "cloud-init")
+    os.makedirs(cloud_init_path, exist_ok=True)
+
+    user_data_path = os.path.join(cloud_init_path, f"{instance_name}.yaml")
+    with open(user_data_path, "w") as user_data_file:
+        user_data_file.write(user_data)
+
+    return user_data_path
+
+
+def wait_for_provisioning_command(instance_name: str) -> List[str]:
+    """
+    Build the command that prints the provisioning log as it grows and exits with the provisioning exit code once
+    the readiness marker is written
+    """
+    wait_script = (
+        f"touch {PROVISIONING_LOG}; tail -n +1 -f {PROVISIONING_LOG} & TAIL=$!; "
+        f"while [ ! -f {READY_MARKER} ]; do sleep 1; done; sleep 1; kill $TAIL; exit $(cat {READY_MARKER})"
+    )
+    return ["multipass", "exec", instance_name, "--", "bash", "-c", wait_script]
+
+
+def wait_for_provisioning(instance_name: str) -> None:
+    """
+    Wait for the provisioning started by cloud-init to finish, printing the end of the cloud-init log if it does not
+    finish within the timeout of the provisioning phase (--timeout provisioning=SECONDS, no limit by default)
+    :param instance_name: the name of the multipass instance
+    :raise MultipassCommandError: if the provisioning failed or timed out
+    """
+    policy = phase_policy("provisioning")
+    try:
+        execute_multipass_command(wait_for_provisioning_command(instance_name), policy=policy)
+    except MultipassCommandError as error:
+        if error.result.timed_out:
+            log = subprocess.run(["multipass", "exec", instance_name, "--", "tail", "-n", str(TAIL_LINES),
+                                  CLOUD_INIT_LOG], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+                                 errors="replace")
+            print(f"{Fore.YELLOW}The provisioning did not finish in {format_duration(policy.timeout)}, the end of "
+                  f"{CLOUD_INIT_LOG}:{Style.RESET_ALL}\n{log.stdout}")
+        raise
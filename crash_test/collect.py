@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import posixpath
+import subprocess
+import tarfile
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Final, List, Tuple
+
+from colorama import Fore, Style
+
+from crash_test.timings import recorder
+
+DEFAULT_COLLECT_FOLDER: Final[str] = "crashtest-artifacts"
+DEFAULT_MAX_COLLECT_SIZE: Final[str] = "500M"
+# The manifest of the collected artifacts, kept in the output folder so that a deleted folder is collected again
+COLLECT_MANIFEST_FILE: Final[str] = ".crashtest-collect.json"
+
+# Prints the size, the mtime and the path of every regular file matched by the globs passed as arguments, NUL
+# separated. The globs are relative to the home folder, ** matches nested folders and a matched folder is collected
+# with all its files.
+LIST_ARTIFACTS_SCRIPT: Final[str] = (
+    "shopt -s globstar nullglob dotglob; IFS=; "
+    "for pattern in \"$@\"; do for path in $pattern; do "
+    "[ -e \"$path\" ] && find \"$path\" -type f -printf '%s\\t%T@\\t%p\\0'; "
+    "done; done; exit 0"
+)
+# Archives the NUL separated paths read from stdin on stdout
+ARCHIVE_ARTIFACTS_COMMAND: Final[str] = "tar -c -z -f - --null -T - 2> /dev/null"
+
+
+@dataclass
+class Artifact:
+    path: str
+    size: int
+    mtime: str
+
+
+class CountingReader:
+    """
+    File-like wrapper that counts the bytes read from a stream
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.bytes_read = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.stream.read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+def list_artifacts_command(instance_name: str, patterns: List[str]) -> List[str]:
+    return ["multipass", "exec", instance_name, "--", "bash", "-c", LIST_ARTIFACTS_SCRIPT, "collect", *patterns]
+
+
+def parse_artifacts(output: bytes) -> List[Artifact]:
+    """
+    Parse the output of the listing script
+    :return: the artifacts, each path once, sorted by path
+    """
+    artifacts = {}
+    for record in output.decode(errors="surrogateescape").split("\0"):
+        parts = record.split("\t", 2)
+        if len(parts) != 3 or not parts[0].isdigit():
+            continue
+        size, mtime, path = parts
+        artifacts[posixpath.normpath(path)] = Artifact(path=posixpath.normpath(path), size=int(size), mtime=mtime)
+
+    return sorted(artifacts.values(), key=lambda artifact: artifact.path)
+
+
+def local_path(output_path: str, artifact_path: str) -> str:
+    """
+    :return: the path of an artifact in the output folder, absolute guest paths are stored relative to the root
+    """
+    return os.path.join(output_path, *artifact_path.lstrip("/").split("/"))
+
+
+def load_manifest(output_path: str) -> Dict[str, dict]:
+    try:
+        with open(os.path.join(output_path, COLLECT_MANIFEST_FILE), "r") as manifest_file:
+            return json.load(manifest_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(output_path: str, manifest: Dict[str, dict]) -> None:
+    with open(os.path.join(output_path, COLLECT_MANIFEST_FILE), "w") as manifest_file:
+        json.dump(manifest, manifest_file)
+
+
+def select_artifacts(artifacts: List[Artifact], manifest: Dict[str, dict], output_path: str,
+                     max_size: int) -> Tuple[List[Artifact], List[Artifact], List[Artifact]]:
+    """
+    Skip the artifacts that did not change since they were collected and the ones that do not fit in the size cap
+    :param artifacts: the artifacts of the instance
+    :param manifest: the artifacts collected by the previous runs
+    :param output_path: the output folder
+    :param max_size: the max bytes collected
+    :return: the artifacts to collect, the unchanged ones and the ones over the size cap
+    """
+    selected, unchanged, oversized = [], [], []
+    total_size = 0
+    for artifact in artifacts:
+        previous = manifest.get(artifact.path)
+        if (previous == {"size": artifact.size, "mtime": artifact.mtime}
+                and os.path.isfile(local_path(output_path, artifact.path))
+                and os.path.getsize(local_path(output_path, artifact.path)) == artifact.size):
+            unchanged.append(artifact)
+        elif total_size + artifact.size > max_size:
+            oversized.append(artifact)
+        else:
+            selected.append(artifact)
+            total_size += artifact.size
+
+    return selected, unchanged, oversized
+
+
+def extract_artifacts(stream, output_path: str) -> List[str]:
+    """
+    Extract the regular files of a tar.gz stream in the output folder, refusing the paths that would escape it
+    :return: the paths of the extracted files in the archive
+    """
+    output_root = os.path.realpath(output_path)
+    extracted = []
+    with tarfile.open(fileobj=stream, mode="r|gz") as archive:
+        for member in archive:
+            destination = os.path.realpath(local_path(output_path, member.name))
+            if not member.isfile() or os.path.commonpath([output_root, destination]) != output_root:
+                continue
+            if hasattr(tarfile, "data_filter"):
+                archive.extract(member, path=output_path, filter="data")
+            else:
+                archive.extract(member, path=output_path)
+            extracted.append(posixpath.normpath(member.name))
+
+    return extracted
+
+
+def write_paths(stream, artifacts: List[Artifact]) -> None:
+    try:
+        for artifact in artifacts:
+            stream.write(artifact.path.encode(errors="surrogateescape") + b"\0")
+        stream.close()
+    except BrokenPipeError:
+        # tar exited early, the archive reports the error
+        pass
+
+
+def collect_artifacts(instance_name: str, patterns: List[str], output_path: str, max_size: int) -> bool:
+    """
+    Stream the files of the instance matching the globs back to the host as a single tar.gz archive, skipping the
+    ones collected by a previous run that did not change
+    :param instance_name: the name of the multipass instance
+    :param patterns: the globs, relative to the home folder of the instance
+    :param output_path: the folder where the artifacts are extracted
+    :param max_size: the max bytes collected, the artifacts over it are skipped
+    :return: Bool: True if the artifacts were collected
+    """
+    print(f"{Fore.GREEN}Collecting {', '.join(patterns)}...\n{Style.RESET_ALL}")
+    listing = subprocess.run(list_artifacts_command(instance_name, patterns), stdin=subprocess.DEVNULL,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if listing.returncode != 0:
+        print(f"{Fore.YELLOW}The artifacts could not be listed: "
+              f"{listing.stderr.decode(errors='replace').strip()}{Style.RESET_ALL}")
+        return False
+
+    os.makedirs(output_path, exist_ok=True)
+    manifest = load_manifest(output_path)
+    selected, unchanged, oversized = select_artifacts(parse_artifacts(listing.stdout), manifest=manifest,
+                                                      output_path=output_path, max_size=max_size)
+    if oversized:
+        print(f"{Fore.YELLOW}{len(oversized)} artifact(s) skipped, they do not fit in the size cap of "
+              f"{max_size / 1024 ** 2:.0f}M: {', '.join(artifact.path for artifact in oversized[:5])}"
+              f"{'...' if len(oversized) > 5 else ''}{Style.RESET_ALL}")
+    if not selected:
+        print(f"{Fore.GREEN}No new artifact to collect ({len(unchanged)} unchanged).\n{Style.RESET_ALL}")
+        return True
+
+    start = time.perf_counter()
+    process = subprocess.Popen(["multipass", "exec", instance_name, "--", "bash", "-c", ARCHIVE_ARTIFACTS_COMMAND],
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    # tar starts archiving before it read all the paths, the archive is read while the paths are written
+    writer = threading.Thread(target=write_paths, args=(process.stdin, selected))
+    writer.start()
+
+    counting_reader = CountingReader(process.stdout)
+    try:
+        extracted = extract_artifacts(counting_reader, output_path=output_path)
+    except tarfile.TarError as error:
+        process.kill()
+        extracted = None
+        print(f"{Fore.YELLOW}The artifacts archive is corrupted: {error}{Style.RESET_ALL}")
+    writer.join()
+    returncode = process.wait()
+    process.stdout.close()
+    recorder.record(name=f"multipass exec {instance_name} -- tar -c (collect)", category="multipass",
+                    start=start, end=time.perf_counter(), returncode=returncode,
+                    bytes_out=counting_reader.bytes_read)
+    if extracted is None:
+        return False
+
+    # An artifact deleted between the listing and the archive is not in the archive
+    extracted_paths = set(extracted)
+    for artifact in selected:
+        if artifact.path.lstrip("/") in extracted_paths:
+            manifest[artifact.path] = {"size": artifact.size, "mtime": artifact.mtime}
+    save_manifest(output_path, manifest)
+
+    print(f"{Fore.GREEN}{len(extracted)} artifact(s) collected in {output_path} "
+          f"({counting_reader.bytes_read / 1024 ** 2:.2f} MiB streamed, {len(unchanged)} unchanged)\n"
+          f"{Style.RESET_ALL}")
+    return True
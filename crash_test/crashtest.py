@@ -2,21 +2,59 @@
 
 import argparse
 import os.path
+import sqlite3
 import subprocess
+import sys
+import time
+from contextlib import nullcontext
 from shutil import which
-from sys import exit
-from typing import Final, List
+from typing import Dict, Final, List, Optional
 
 from colorama import Fore, Style
 
 import crash_test.error_codes
 from crash_test._version import __version__
-from crash_test.args_checker import arguments_check
-from crash_test.dependencies_checker import check_dependencies
+from crash_test.args_checker import arguments_check, matrix_options_check
+from crash_test.bake import bake_main, ensure_base, restore_base, script_ecosystem, DEFAULT_MAX_AGE
+from crash_test.cache import mount_cache, mount_cache_command, cache_environment
+from crash_test.cloud_init import build_user_data, write_user_data, wait_for_provisioning, split_boot_scripts
+from crash_test.collect import collect_artifacts, DEFAULT_COLLECT_FOLDER, DEFAULT_MAX_COLLECT_SIZE
+from crash_test.daemon import serve_main, admission, get_socket_path
+from crash_test.dependencies_checker import check_subprojects_dependencies, Subproject, DEFAULT_MAX_DEPTH
 from crash_test.error_logger import log_error
-from crash_test.utils import get_scripts_absolute_path, check_script_path
+from crash_test.matrix import build_jobs, parse_profile, run_matrix, Profile, MatrixJob
+from crash_test.headless import build_result, write_result, should_teardown, TEARDOWN_POLICIES, \
+    DEFAULT_TEARDOWN_POLICY, INVALID_ARGUMENTS_EXIT_CODE
+from crash_test.history import record_run, find_regressions, print_regressions, stats_main
+from crash_test.ignore import load_ignore_rules, IgnoreRule
+from crash_test.mount import choose_transfer_mode, mount_project_commands, TRANSFER_MODES
+from crash_test.multipass import execute_multipass_command, launch_command, instance_exists, instance_state, \
+    instance_info, invalidate_instances_cache, set_log_file, set_persistent_sessions, DEFAULT_CPUS, \
+    DEFAULT_MEMORY, DEFAULT_DISK
+from crash_test.pool import pool_main, claim_instance, replace_instance, DEFAULT_IMAGE
+from crash_test.profiler import profile_guest, DEFAULT_SAMPLING_INTERVAL
+from crash_test.retry import cancel_on_signals, phase_value, reset_policies, set_policy
+from crash_test.registry import gc_main, register_instance, unregister_instance, teardown_in_background, \
+    teardown_instance
+from crash_test.scheduler import StepScheduler
+from crash_test.session import close_sessions
+from crash_test.sizing import resolve_instance_size, InstanceSize
+from crash_test.timings import recorder, Timing
+from crash_test.transfer import stream_project, collect_files, COMPRESSIONS
+from crash_test.watch import ProjectWatcher, WatchedRun, cancellable_command, DEFAULT_DEBOUNCE
+from crash_test.sync import sync_project, save_manifest, has_manifest, forget_instance
+from crash_test.snapshots import dependencies_fingerprint, find_snapshot, restore_snapshot, save_snapshot
+from crash_test.utils import get_scripts_absolute_path, check_script_path, parse_size, parse_duration, \
+    SCRIPT_RELATIVE_PATH
 
-SCRIPT_RELATIVE_PATH: Final[str] = "crash_test/scripts"
+# crashtest subcommands, dispatched before the instance arguments are parsed
+COMMANDS: Final[dict] = {
+    "pool": pool_main,
+    "serve": serve_main,
+    "gc": gc_main,
+    "bake": bake_main,
+    "stats": stats_main,
+}
 
 
 def args_parser():
@@ -42,15 +80,237 @@ def args_parser():
                         action="store_true",
                         help="Delete the instance"
                         )
+    parser.add_argument("--detach-delete",
+                        action="store_true",
+                        help="With --delete, return immediately and delete the instance in the background"
+                        )
     parser.add_argument("--install-dependencies",
                         action="store_true",
                         help="Installs the dependencies for the project"
                         )
+    parser.add_argument("--baked",
+                        action="store_true",
+                        help="Clone a base with the toolchains of the dependencies already installed instead of "
+                             "launching a new instance, see crashtest bake"
+                        )
+    parser.add_argument("--bake-max-age",
+                        type=parse_duration,
+                        default=DEFAULT_MAX_AGE,
+                        help=f"Bake the base of --baked again when it is older than this (default: {DEFAULT_MAX_AGE})"
+                        )
+    parser.add_argument("--cloud-init",
+                        action="store_true",
+                        help="Install the dependencies at the first boot of a new instance with cloud-init, while "
+                             "the project is transferred, instead of after the transfer"
+                        )
+    parser.add_argument("--manifest-depth",
+                        type=int,
+                        default=DEFAULT_MAX_DEPTH,
+                        help=f"Max folder depth searched for the subprojects to install (default: {DEFAULT_MAX_DEPTH})"
+                        )
     parser.add_argument("-s",
                         "--script",
                         type=str,
                         help="Execute a custom script"
                         )
+    parser.add_argument("--image",
+                        type=str,
+                        help="Image of the multipass instance (e.g. 22.04). Defaults to the multipass default image"
+                        )
+    parser.add_argument("--cpus",
+                        type=int,
+                        help="CPUs of the instance. Defaults to a number sized from the project"
+                        )
+    parser.add_argument("--memory",
+                        type=str,
+                        help="Memory of the instance (e.g. 4G). Defaults to an amount sized from the project"
+                        )
+    parser.add_argument("--disk",
+                        type=str,
+                        help="Disk space of the instance (e.g. 20G). Defaults to an amount sized from the project"
+                        )
+    parser.add_argument("--no-auto-size",
+                        action="store_true",
+                        help="Use the multipass defaults (1 CPU, 1G memory, 5G disk) for the resources that are not "
+                             "specified, instead of sizing them from the project"
+                        )
+    parser.add_argument("--pool",
+                        action="store_true",
+                        help="Claim a pre-launched instance from the pool (see: crashtest pool fill) instead of "
+                             "launching a new one"
+                        )
+    parser.add_argument("--stream",
+                        action="store_true",
+                        help="Transfer the project as a single archive streamed into the instance, skipping the "
+                             "files ignored by .gitignore, .crashtestignore, .git, venv and node_modules"
+                        )
+    parser.add_argument("--compression",
+                        type=str,
+                        choices=COMPRESSIONS,
+                        default="gzip",
+                        help="Compression of the --stream archive (default: gzip)"
+                        )
+    parser.add_argument("--mode",
+                        type=str,
+                        choices=TRANSFER_MODES,
+                        default="copy",
+                        help="Copy the project to the instance, mount it with multipass mount, or pick one from the "
+                             "size and the file count of the project (default: copy)"
+                        )
+    parser.add_argument("--overlay",
+                        action="store_true",
+                        help="Mount the project under a copy-on-write overlay, so the files written in the instance "
+                             "do not reach the host project"
+                        )
+    parser.add_argument("--sync",
+                        action="store_true",
+                        help="Reuse the instance if it already exists and only transfer the changed project files"
+                        )
+    parser.add_argument("--watch",
+                        action="store_true",
+                        help="Keep the instance running, sync the changed files and run the script again every time "
+                             "the project changes, instead of opening a shell (implies --sync)"
+                        )
+    parser.add_argument("--debounce",
+                        type=float,
+                        default=DEFAULT_DEBOUNCE,
+                        help=f"Seconds the project has to stay untouched before --watch syncs it "
+                             f"(default: {DEFAULT_DEBOUNCE})"
+                        )
+    parser.add_argument("--reuse-dependencies",
+                        action="store_true",
+                        help="Restore an instance where the same dependencies are already installed and snapshot "
+                             "the instance after installing new ones (requires --install-dependencies)"
+                        )
+    parser.add_argument("--cache",
+                        action="store_true",
+                        help="Mount the host package cache in the instance to reuse the pip, npm and apt downloads"
+                        )
+    parser.add_argument("--offline",
+                        action="store_true",
+                        help="Install the dependencies only from the host package cache (implies --cache)"
+                        )
+    parser.add_argument("--log-file",
+                        type=str,
+                        help="Write the full output of the multipass commands to this file"
+                        )
+    parser.add_argument("--profile",
+                        action="store_true",
+                        help="Sample the CPU, memory, disk I/O and tasks of the instance while the script runs and "
+                             "print their peak and percentiles"
+                        )
+    parser.add_argument("--profile-interval",
+                        type=float,
+                        default=DEFAULT_SAMPLING_INTERVAL,
+                        help=f"Seconds between two samples of --profile (default: {DEFAULT_SAMPLING_INTERVAL:g})"
+                        )
+    parser.add_argument("--profile-output",
+                        type=str,
+                        help="Write the samples of --profile to this file, as JSON if it ends with .json, otherwise "
+                             "as CSV (implies --profile)"
+                        )
+    parser.add_argument("--headless",
+                        action="store_true",
+                        help="Run unattended: no shell and no prompt, the instance is deleted according to "
+                             "--teardown, crashtest exits with the exit code of the script and prints a JSON result"
+                        )
+    parser.add_argument("--teardown",
+                        type=str,
+                        choices=TEARDOWN_POLICIES,
+                        default=DEFAULT_TEARDOWN_POLICY,
+                        help=f"When --headless deletes the instance (default: {DEFAULT_TEARDOWN_POLICY})"
+                        )
+    parser.add_argument("--result-file",
+                        type=str,
+                        help="Write the JSON result of --headless to this file instead of printing it"
+                        )
+    parser.add_argument("--collect",
+                        type=str,
+                        action="append",
+                        default=[],
+                        metavar="GLOB",
+                        help="Copy the files of the instance matching this glob (relative to the home folder, ** "
+                             "matches nested folders) to the host when the run ends. Can be repeated"
+                        )
+    parser.add_argument("--collect-dir",
+                        type=str,
+                        help=f"Folder of the collected files (default: {DEFAULT_COLLECT_FOLDER}/INSTANCE_NAME)"
+                        )
+    parser.add_argument("--collect-max-size",
+                        type=str,
+                        default=DEFAULT_MAX_COLLECT_SIZE,
+                        help=f"Max size of the collected files per run (default: {DEFAULT_MAX_COLLECT_SIZE})"
+                        )
+    parser.add_argument("--persistent-session",
+                        action="store_true",
+                        help="Run the commands in a single shell session per instance instead of a multipass exec "
+                             "per command"
+                        )
+    parser.add_argument("--timeout",
+                        type=phase_value,
+                        action="append",
+                        default=[],
+                        metavar="PHASE=SECONDS",
+                        help="Kill a multipass command of this phase (launch, transfer, exec...) after SECONDS, 0 for "
+                             "no limit. Can be repeated"
+                        )
+    parser.add_argument("--retries",
+                        type=phase_value,
+                        action="append",
+                        default=[],
+                        metavar="PHASE=COUNT",
+                        help="Retry a failed multipass command of this phase COUNT times. Can be repeated"
+                        )
+    parser.add_argument("--no-history",
+                        action="store_true",
+                        help="Do not record the run in the history database read by crashtest stats"
+                        )
+    parser.add_argument("--critical-path",
+                        action="store_true",
+                        help="Print the duration of every provisioning step and the critical path"
+                        )
+    parser.add_argument("--timings",
+                        action="store_true",
+                        help="Print the duration, exit code and byte counts of every multipass command"
+                        )
+    parser.add_argument("--trace",
+                        type=str,
+                        help="Write the timings as a Chrome trace-event JSON file (chrome://tracing, Perfetto)"
+                        )
+    parser.add_argument("--matrix-image",
+                        type=str,
+                        action="append",
+                        default=[],
+                        help="Run the project on an instance of this image, can be repeated to test several images "
+                             "concurrently"
+                        )
+    parser.add_argument("--matrix-profile",
+                        type=parse_profile,
+                        action="append",
+                        default=[],
+                        help="Resource profile CPUS:MEMORY:DISK (e.g. 2:4G:20G) of the matrix instances, can be "
+                             "repeated"
+                        )
+    parser.add_argument("--matrix-count",
+                        type=int,
+                        default=1,
+                        help="Number of instances of each image and profile of the matrix"
+                        )
+    parser.add_argument("--concurrency",
+                        type=int,
+                        default=3,
+                        help="Max number of matrix instances provisioned at the same time (default: 3)"
+                        )
+    parser.add_argument("--daemon",
+                        action="store_true",
+                        help="Wait for the crashtest daemon (see: crashtest serve) to admit the run before launching "
+                             "the instances"
+                        )
+    parser.add_argument("--daemon-socket",
+                        type=str,
+                        default=get_socket_path(),
+                        help="Path to the Unix socket of the crashtest daemon"
+                        )
     parser.add_argument("-v",
                         "--version",
                         action="version",
@@ -70,99 +330,663 @@ class CrashTest:
             # The project name without the path
             self.project_name = self.args.project[self.args.project.rfind("/") + 1:]
 
+            # The name of the multipass instance, which differs from the requested one for pool instances
+            self.instance_name = self.args.instance_name
+
+            # The installation scripts with the subprojects they install and the fingerprint of the dependencies
+            self.dependencies_scripts: Dict[str, List[Subproject]] = {}
+            self.dependencies_fingerprint = None
+            # The fingerprint of the dependencies manifests, recorded in the history
+            self.manifest_fingerprint = None
+            self.dependencies_restored = False
+
+            # Whether the existing instance is reused by --sync
+            self.instance_reused = False
+
+            # The project files to stream, collected while the instance boots
+            self.project_entries = None
+
+            # copy or mount, resolved from --mode
+            self.transfer_mode = None
+
+            # The resources of the instance, sized from the project once per run
+            self.instance_size = None
+
+            # Whether the dependencies are installed by cloud-init at the first boot of the instance
+            self.cloud_init_provisioning = False
+
+            # The result of a --headless run
+            self.failed_step: Optional[str] = None
+            self.scheduler: Optional[StepScheduler] = None
+            self.matrix_jobs: Optional[List[MatrixJob]] = None
+            self.teardown_result: Optional[str] = None
+
+            if self.args.offline:
+                self.args.cache = True
+            if self.args.headless and self.args.watch:
+                print(f"{Fore.YELLOW}--watch waits for changes forever, it is ignored by --headless.{Style.RESET_ALL}")
+                self.args.watch = False
+            if self.args.watch:
+                self.args.sync = True
+            if self.args.profile_output:
+                self.args.profile = True
+
+            set_log_file(self.args.log_file)
+            set_persistent_sessions(self.args.persistent_session)
+            reset_policies()
+            for phase, timeout in self.args.timeout:
+                set_policy(phase, timeout=timeout)
+            for phase, retries in self.args.retries:
+                set_policy(phase, retries=int(retries))
+            # The state of the instances is queried once per run
+            invalidate_instances_cache()
+
+    def is_matrix(self) -> bool:
+        return bool(self.args.matrix_image or self.args.matrix_profile or self.args.matrix_count > 1)
+
+    def matrix_unsupported_options(self) -> List[str]:
+        """
+        :return: the specified options that the matrix runs do not support
+        """
+        options = {"--pool": self.args.pool, "--stream": self.args.stream, "--sync": self.args.sync,
+                   "--watch": self.args.watch, "--baked": self.args.baked,
+                   "--persistent-session": self.args.persistent_session}
+        return [option for option, specified in options.items() if specified]
+
+    def requested_resources(self) -> dict:
+        """
+        Get the resources the run allocates at most at the same time: the sized instance, or up to --concurrency
+        matrix instances of the largest profile
+        :return: dict: the cpus, memory and disk (in bytes)
+        """
+        if self.is_matrix():
+            profiles = self.args.matrix_profile or [Profile()]
+            instances = min(self.args.concurrency,
+                            len(profiles) * len(self.args.matrix_image or [None]) * self.args.matrix_count)
+        else:
+            size = self.get_instance_size()
+            profiles = [Profile(cpus=size.cpus, memory=size.memory, disk=size.disk)]
+            instances = 1
+
+        return {
+            "cpus": instances * max(profile.cpus or DEFAULT_CPUS for profile in profiles),
+            "memory": instances * max(parse_size(profile.memory or DEFAULT_MEMORY) for profile in profiles),
+            "disk": instances * max(parse_size(profile.disk or DEFAULT_DISK) for profile in profiles),
+        }
+
     def run(self):
         if which("multipass") is not None:
-            self.create_instance()
+            started = time.time()
+            first_timing = len(recorder.timings)
+            exit_code = 1
+            try:
+                with cancel_on_signals():
+                    if self.args.daemon:
+                        with admission(socket_path=self.args.daemon_socket, name=self.args.instance_name,
+                                       **self.requested_resources()) as admitted:
+                            if not admitted:
+                                # An unreachable daemon or a rejected job fails the run: provisioning anyway would
+                                # exceed the budget the daemon enforces
+                                self.failed_step = "admission"
+                                sys.exit(1)
+                            self.provision()
+                    else:
+                        self.provision()
+                exit_code = 0
+            except SystemExit as error:
+                exit_code = error.code if isinstance(error.code, int) else int(error.code is not None)
+                raise
+            except KeyboardInterrupt:
+                # The running multipass commands were killed by cancel_on_signals
+                exit_code = 130
+                print(f"\n{Fore.YELLOW}crashtest: cancelled.{Style.RESET_ALL}")
+                sys.exit(exit_code)
+            finally:
+                close_sessions()
+                if not self.args.no_history:
+                    self.record_history(timings=recorder.timings[first_timing:], started=started,
+                                        exit_code=exit_code)
+                if self.args.headless:
+                    self.write_result(started=started, exit_code=exit_code)
+                if self.args.timings:
+                    recorder.print_summary()
+                if self.args.trace:
+                    recorder.write_chrome_trace(self.args.trace)
         else:
             print(log_error(error_code=crash_test.error_codes.MULTIPASS_NOT_INSTALLED_ERROR))
 
+    def record_history(self, timings: List[Timing], started: float, exit_code: int) -> None:
+        """
+        Appends the run to the history database and warns about the phases that were significantly slower than
+        usual. A history that can not be written never fails the run.
+        """
+        try:
+            run_id = record_run(timings, started=started, duration=time.time() - started, exit_code=exit_code,
+                                instance_name=self.instance_name, project=os.path.abspath(self.args.project),
+                                image=self.args.image, fingerprint=self.manifest_fingerprint)
+            regressions = find_regressions(run_ids=[run_id])
+        except (sqlite3.Error, OSError) as error:
+            print(f"{Fore.YELLOW}The run could not be recorded in the history: {error}{Style.RESET_ALL}")
+            return
+
+        if regressions:
+            print()
+            print_regressions(regressions)
+
+    def write_result(self, started: float, exit_code: int) -> None:
+        """
+        Emits the JSON result of a --headless run
+        """
+        steps = {step.name: step.duration for step in self.scheduler.steps.values()
+                 if step.start is not None} if self.scheduler else {}
+        failed_step = self.failed_step or (self.scheduler.failed_step if self.scheduler else None)
+        if self.matrix_jobs:
+            failed_step = next((job.failed_step for job in self.matrix_jobs if job.returncode), None)
+        write_result(build_result(exit_code=exit_code, started=started, instance_name=self.instance_name,
+                                  project=os.path.abspath(self.args.project), image=self.args.image,
+                                  failed_step=failed_step, steps=steps, teardown=self.teardown_result,
+                                  artifacts=self.artifacts_path() if self.args.collect else None,
+                                  jobs=self.matrix_jobs), path=self.args.result_file)
+
+    def get_instance_size(self) -> InstanceSize:
+        if self.instance_size is None:
+            self.instance_size = resolve_instance_size(project_path=self.args.project, cpus=self.args.cpus,
+                                                       memory=self.args.memory, disk=self.args.disk,
+                                                       auto_size=not self.args.no_auto_size)
+        return self.instance_size
+
+    def provision(self) -> None:
+        if self.is_matrix():
+            self.run_matrix()
+        else:
+            self.create_instance()
+
     @staticmethod
     def execute_multipass_command(command) -> None:
         """
         Executes a specified multipass command and prints possible errors
         :param command: the Multipass command to execute
         """
-        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        execute_multipass_command(command)
 
-        if result.stdout:
-            print(f"Output: {result.stdout}")
+    def dependencies_scripts_paths(self) -> Dict[str, List[Subproject]]:
+        """
+        Get the dependencies installation scripts for the subprojects of the project
+        :return: dict: the path to each script and the subprojects it installs, empty if the project has no
+        supported dependencies
+        """
+        if check_script_path(script_path=get_scripts_absolute_path(SCRIPT_RELATIVE_PATH)):
+            return check_subprojects_dependencies(project_path=self.args.project,
+                                                  scripts_relative_path=SCRIPT_RELATIVE_PATH,
+                                                  max_depth=self.args.manifest_depth)
+        return {}
+
+    def install_dependencies_commands(self, instance_name: str, script_path: str,
+                                      subprojects: List[Subproject] = None) -> List[List[str]]:
+        """
+        Build the commands that transfer a dependencies installation script to the instance and execute it. The
+        script installs the subprojects in parallel, or only the project folder if no subprojects are specified.
+        """
+        instance_script_path = f"./{self.project_name}/install_{os.path.basename(script_path)}"
+        transfer_script_command = ["multipass", "transfer", "-r", f"{script_path}",
+                                   f"{instance_name}:{instance_script_path}"]
 
-        if result.returncode != 0:
-            print(
-                f"{log_error(error_code=crash_test.error_codes.MULTIPASS_GENERIC_ERROR)}{result.stderr}{Style.RESET_ALL}"
-            )
-            exit(result.returncode)
+        run_script_command = ["multipass", "exec", f"{instance_name}", "--"]
+        if self.args.cache:
+            # runs the script with the environment that points it to the mounted package cache
+            run_script_command += cache_environment(offline=self.args.offline)
+        run_script_command += ["bash", instance_script_path, f"{self.project_name}"]
+        run_script_command += [subproject.path for subproject in subprojects or []]
 
-    def install_dependencies(self) -> None:
+        return [transfer_script_command, run_script_command]
+
+    def custom_script_commands(self, instance_name: str, cancellable: bool = False) -> List[List[str]]:
         """
-        Create the installation script for the dependencies in the multipass instance and executes it.
+        Build the commands that transfer the custom script to the project folder of the instance and execute it.
+        A cancellable script runs in its own process group, so --watch can stop it with all its child processes.
         """
-        if check_script_path(script_path=get_scripts_absolute_path(SCRIPT_RELATIVE_PATH)):
-            script_path = check_dependencies(project_path=self.args.project,
-                                             scripts_relative_path=SCRIPT_RELATIVE_PATH)
+        multipass_transfer_command: List[str] = ["multipass", "transfer", "-r", f"{self.args.script}",
+                                                 f"{instance_name}:./{self.project_name}/"]
 
-            if script_path:
-                print(f"{Fore.GREEN}Installing dependencies...{Style.RESET_ALL}")
+        script_command = ["bash", f"./{self.project_name}/{os.path.basename(self.args.script)}"]
+        if cancellable:
+            script_command = cancellable_command(script_command)
+        run_script_command = ["multipass", "exec", f"{instance_name}", "--"] + script_command
 
-                transfer_script_command = ["multipass", "transfer", "-r", f"{script_path}",
-                                           f"{self.args.instance_name}:./{self.project_name}/install_dependencies.sh"]
+        return [multipass_transfer_command, run_script_command]
 
-                self.execute_multipass_command(transfer_script_command)
+    def resolve_dependencies(self) -> None:
+        """
+        Detects the subprojects of the project, selects their installation scripts and fingerprints the
+        dependencies if the --reuse-dependencies flag is specified
+        """
+        self.dependencies_scripts = self.dependencies_scripts_paths()
 
-                run_script_command = ["multipass", "exec", f"{self.args.instance_name}", "--", "bash",
-                                      f"./{self.project_name}/install_dependencies.sh", f"{self.project_name}"]
+        if self.dependencies_scripts:
+            self.manifest_fingerprint = dependencies_fingerprint(project_path=self.args.project,
+                                                                 script_paths=list(self.dependencies_scripts),
+                                                                 image=self.args.image,
+                                                                 max_depth=self.args.manifest_depth)
+            if self.args.reuse_dependencies:
+                self.dependencies_fingerprint = self.manifest_fingerprint
+
+    def mount_cache(self) -> None:
+        """
+        Mounts the host package cache if the dependencies have to be installed
+        """
+        if self.dependencies_scripts and not self.dependencies_restored:
+            mount_cache(self.instance_name)
 
+    def install_dependencies(self) -> None:
+        """
+        Create the installation scripts for the dependencies in the multipass instance and executes them. The
+        scripts of the different project types run one after the other since they all use apt, but each script
+        installs its subprojects in parallel. If cloud-init already runs them, waits for them to finish and only
+        installs the subprojects that need their sources.
+        """
+        scripts = self.dependencies_scripts
+        if self.cloud_init_provisioning:
+            print(f"{Fore.GREEN}Waiting for the dependencies installed at boot...{Style.RESET_ALL}")
+            wait_for_provisioning(self.instance_name)
+            # The subprojects installed from their sources are installed now that they are transferred
+            scripts = split_boot_scripts(self.dependencies_scripts)[1]
+
+        if scripts and not self.dependencies_restored:
+            for script_path, subprojects in scripts.items():
+                print(f"{Fore.GREEN}Installing dependencies of "
+                      f"{', '.join(subproject.path for subproject in subprojects)}...{Style.RESET_ALL}")
+
+                transfer_script_command, run_script_command = self.install_dependencies_commands(
+                    instance_name=self.instance_name, script_path=script_path, subprojects=subprojects
+                )
+                self.execute_multipass_command(transfer_script_command)
                 self.execute_multipass_command(run_script_command)
 
-    def execute_custom_script(self) -> None:
+        if self.dependencies_fingerprint and not self.dependencies_restored:
+            save_snapshot(instance_name=self.instance_name, fingerprint=self.dependencies_fingerprint,
+                          image=self.args.image)
+
+    def execute_custom_script(self, cancellable: bool = False) -> None:
         if os.path.exists(self.args.script):
+            multipass_transfer_command, run_script_command = self.custom_script_commands(self.instance_name,
+                                                                                         cancellable=cancellable)
+
             # transfers the script to the project folder in the multipass session
             print(f"{Fore.GREEN}Transferring the script...\n{Style.RESET_ALL}")
-            multipass_transfer_command: List[str] = ["multipass", "transfer", "-r", f"{self.args.script}",
-                                                     f"{self.args.instance_name}:./{self.project_name}/"]
             self.execute_multipass_command(multipass_transfer_command)
             print(f"{Fore.GREEN}{self.args.script} transferred successfully!\n{Style.RESET_ALL}")
 
-            # Run the script
-            run_script_command = ["multipass", "exec", f"{self.args.instance_name}", "--", "bash",
-                                  f"./{self.project_name}/{self.args.script[self.args.script.rfind('/'):]}"]
+            # Run the script, sampling the resources of the instance if the --profile flag is specified
+            with profile_guest(self.instance_name, interval=self.args.profile_interval,
+                               output_path=self.args.profile_output) if self.args.profile else nullcontext():
+                self.execute_multipass_command(run_script_command)
 
-            self.execute_multipass_command(run_script_command)
+    def resume_instance(self) -> bool:
+        """
+        Reuses the instance if it already exists, starting it if it is stopped
+        :return: Bool: True if the instance exists
+        """
+        match instance_state(self.instance_name):
+            case None:
+                return False
+            case "Running":
+                print(f"{Fore.GREEN}Reusing the running instance {self.instance_name}!\n{Style.RESET_ALL}")
+                return True
+            case "Deleted":
+                # A deleted instance keeps its name until it is purged
+                print(f"{Fore.GREEN}Recovering the deleted instance {self.instance_name}...\n{Style.RESET_ALL}")
+                self.execute_multipass_command(["multipass", "recover", self.instance_name])
+            case state:
+                print(f"{Fore.GREEN}Starting the {state.lower()} instance {self.instance_name}...\n{Style.RESET_ALL}")
 
-    def create_instance(self) -> None:
+        self.execute_multipass_command(["multipass", "start", self.instance_name])
+        return True
+
+    def launch_instance(self) -> None:
         """
-        Creates a Multipass instance and transfer the specified project to the newly created instance
+        Reuses the instance if it already exists. Otherwise, restores a dependencies snapshot or claims an instance
+        from the pool if the --reuse-dependencies or the --pool flags are specified, or launches a new instance.
+        The instance is registered as owned by crashtest, unless it existed before and crashtest did not create it.
         """
-        if arguments_check(instance_name=self.args.instance_name, project_path=self.args.project):
+        launched = False
+        try:
+            if self.resume_instance():
+                return
+
+            # Set before the instance is created, so that an instance whose creation failed half-way is registered
+            launched = True
+            if self.dependencies_fingerprint:
+                snapshot_instance = find_snapshot(self.dependencies_fingerprint)
+                if snapshot_instance:
+                    restore_snapshot(snapshot_instance=snapshot_instance, instance_name=self.instance_name,
+                                     project_name=self.project_name)
+                    self.dependencies_restored = True
+                    return
+
+            if self.args.pool:
+                claimed_instance = claim_instance(image=self.args.image or DEFAULT_IMAGE, alias=self.args.instance_name)
+                if claimed_instance:
+                    self.instance_name = claimed_instance
+                    print(f"{Fore.GREEN}Instance {self.instance_name} claimed from the pool as "
+                          f"{self.args.instance_name}!\n{Style.RESET_ALL}")
+                    return
+
+                print(f"{Fore.YELLOW}The pool is empty, launching a new instance...{Style.RESET_ALL}")
+
+            if self.args.baked and self.dependencies_scripts:
+                # Bakes the base first if it is missing or older than --bake-max-age
+                base = ensure_base({script_ecosystem(script_path): script_path
+                                    for script_path in self.dependencies_scripts},
+                                   image=self.args.image, max_age=self.args.bake_max_age)
+                size = self.get_instance_size()
+                restore_base(base["instance"], instance_name=self.instance_name, cpus=size.cpus, memory=size.memory,
+                             disk=size.disk)
+                return
+
             # creates multipass session
             print(f"{Fore.GREEN}Creating multipass instance...\n{Style.RESET_ALL}")
-            multipass_launch_command: List[str] = ["multipass", "launch", "--name", self.args.instance_name]
-            self.execute_multipass_command(multipass_launch_command)
-            print(f"{Fore.GREEN}Instance {self.args.instance_name} created successfully!\n{Style.RESET_ALL}")
+            size = self.get_instance_size()
+            user_data_path = None
+            # A mounted project would hide the manifests written at boot
+            boot_scripts = split_boot_scripts(self.dependencies_scripts)[0] if self.args.cloud_init else {}
+            if boot_scripts and self.transfer_mode != "mount":
+                environment = cache_environment(offline=self.args.offline) if self.args.cache else []
+                user_data_path = write_user_data(self.instance_name, build_user_data(
+                    project_path=self.args.project, project_name=self.project_name,
+                    scripts=boot_scripts, environment=environment
+                ))
+
+            multipass_launch_command: List[str] = launch_command(instance_name=self.instance_name,
+                                                                 image=self.args.image, cpus=size.cpus,
+                                                                 memory=size.memory, disk=size.disk,
+                                                                 cloud_init=user_data_path)
+            try:
+                self.execute_multipass_command(multipass_launch_command)
+            finally:
+                if user_data_path:
+                    os.remove(user_data_path)
+            self.cloud_init_provisioning = user_data_path is not None
+            print(f"{Fore.GREEN}Instance {self.instance_name} created successfully!\n{Style.RESET_ALL}")
+        finally:
+            # Also registers an instance whose launch failed half-way, so crashtest gc can delete it
+            register_instance(self.instance_name, project=os.path.abspath(self.args.project), image=self.args.image,
+                              launched=launched)
 
-            # transfers the specified project to the multipass session
-            print(f"{Fore.GREEN}Transferring the project...\n{Style.RESET_ALL}")
+    def transfer_project(self) -> None:
+        """
+        Transfers the whole project to the multipass instance
+        """
+        print(f"{Fore.GREEN}Transferring the project...\n{Style.RESET_ALL}")
+        if self.args.stream:
+            if not stream_project(instance_name=self.instance_name, project_path=self.args.project,
+                                  project_name=self.project_name, compression=self.args.compression,
+                                  entries=self.project_entries):
+                sys.exit(1)
+        else:
             multipass_transfer_command: List[str] = ["multipass", "transfer", "-r", f"{self.args.project}/",
-                                                     f"{self.args.instance_name}:."]
+                                                     f"{self.instance_name}:."]
             self.execute_multipass_command(multipass_transfer_command)
-            print(f"{Fore.GREEN}{self.project_name} transferred successfully!\n{Style.RESET_ALL}")
+        print(f"{Fore.GREEN}{self.project_name} transferred successfully!\n{Style.RESET_ALL}")
 
-            # Install the dependencies
-            if self.args.install_dependencies:
-                self.install_dependencies()
+        # Records the transferred files for the next --sync run
+        if self.args.sync:
+            save_manifest(instance_name=self.instance_name, project_path=self.args.project,
+                          rules=self.transfer_rules())
 
-            # Execute a custom script
-            if self.args.script:
-                self.execute_custom_script()
+    def mount_project(self) -> None:
+        """
+        Mounts the project in the multipass instance instead of copying it
+        """
+        print(f"{Fore.GREEN}Mounting the project...\n{Style.RESET_ALL}")
+        mounted = (instance_info(self.instance_name) or {}).get("mounts", {})
+        for command in mount_project_commands(instance_name=self.instance_name, project_path=self.args.project,
+                                              project_name=self.project_name, overlay=self.args.overlay,
+                                              mounted=mounted):
+            self.execute_multipass_command(command)
+        print(f"{Fore.GREEN}{self.project_name} mounted successfully!\n{Style.RESET_ALL}")
 
-            # Opens a shell to the multipass instance
-            print(f"{Fore.GREEN}Opening the shell...\n{Style.RESET_ALL}")
-            multipass_shell_command: List[str] = ["multipass", "shell", self.args.instance_name]
-            subprocess.run(multipass_shell_command)
+    def resolve_transfer_mode(self) -> str:
+        return choose_transfer_mode(mode=self.args.mode, project_path=self.args.project, rules=self.transfer_rules())
+
+    def transfer_rules(self) -> List[IgnoreRule]:
+        """
+        :return: the ignore rules of the transfer, --stream skips the ignored files while multipass transfer copies
+        everything
+        """
+        return load_ignore_rules(self.args.project) if self.args.stream else []
+
+    def sync_project(self) -> None:
+        """
+        Syncs the changes of the project to the existing multipass instance
+        """
+        sync_project(instance_name=self.instance_name, project_path=self.args.project, project_name=self.project_name,
+                     rules=self.transfer_rules())
+        print(f"{Fore.GREEN}{self.project_name} synced successfully!\n{Style.RESET_ALL}")
+
+    def scan_project(self) -> None:
+        self.project_entries = collect_files(self.args.project)
+
+    def provisioning_steps(self) -> StepScheduler:
+        """
+        Models the provisioning as steps with their dependencies, so that the host-side steps (manifest detection,
+        project scan) run while the instance boots
+        :return: the scheduler of the provisioning steps
+        """
+        scheduler = StepScheduler()
+
+        def registered(*step_names) -> List[str]:
+            return [step_name for step_name in step_names if step_name in scheduler.steps]
+
+        if self.args.install_dependencies:
+            scheduler.add_step("resolve dependencies", self.resolve_dependencies)
+
+        if self.instance_reused:
+            # Starts the instance if it is stopped
+            scheduler.add_step("launch", self.launch_instance)
+            scheduler.add_step("sync", self.sync_project, dependencies=["launch"])
+            transfer_step = "sync"
+        else:
+            if self.args.stream and self.transfer_mode != "mount":
+                scheduler.add_step("scan project", self.scan_project)
+            # The snapshot to restore depends on the dependencies fingerprint, the cloud-init user-data on the
+            # installation scripts
+            scheduler.add_step("launch", self.launch_instance,
+                               dependencies=registered("resolve dependencies")
+                               if self.args.reuse_dependencies or self.args.cloud_init or self.args.baked else [])
+            if self.transfer_mode == "mount":
+                scheduler.add_step("mount project", self.mount_project, dependencies=["launch"])
+                transfer_step = "mount project"
+            else:
+                scheduler.add_step("transfer", self.transfer_project, dependencies=registered("launch", "scan project"))
+                transfer_step = "transfer"
+
+        if self.args.install_dependencies:
+            if self.args.cache:
+                scheduler.add_step("mount cache", self.mount_cache,
+                                   dependencies=registered("launch", "resolve dependencies"))
+            scheduler.add_step("install dependencies", self.install_dependencies,
+                               dependencies=registered(transfer_step, "resolve dependencies", "mount cache"))
+
+        # --watch runs the script itself, so that a change can cancel it
+        if self.args.script and not self.args.watch:
+            scheduler.add_step("custom script", self.execute_custom_script,
+                               dependencies=registered(transfer_step, "install dependencies"))
+
+        return scheduler
+
+    def create_instance(self) -> None:
+        """
+        Creates a Multipass instance and transfer the specified project to the newly created instance
+        """
+        if arguments_check(instance_name=self.args.instance_name, project_path=self.args.project):
+            self.transfer_mode = self.resolve_transfer_mode()
+            # A mounted project is always up to date, there is nothing to sync
+            self.instance_reused = (self.transfer_mode == "copy" and self.args.sync
+                                    and has_manifest(self.instance_name, self.args.project)
+                                    and instance_exists(self.instance_name))
+
+            # The changes made during the provisioning are synced as soon as it is done
+            watcher = ProjectWatcher(self.args.project, rules=load_ignore_rules(self.args.project),
+                                     debounce=self.args.debounce) if self.args.watch else None
+
+            scheduler = self.scheduler = self.provisioning_steps()
+            succeeded = False
+            try:
+                scheduler.run()
+                if self.args.critical_path:
+                    scheduler.print_report()
+
+                if watcher:
+                    self.watch_project(watcher)
+                elif not self.args.headless:
+                    # Opens a shell to the multipass instance
+                    print(f"{Fore.GREEN}Opening the shell...\n{Style.RESET_ALL}")
+                    multipass_shell_command: List[str] = ["multipass", "shell", self.instance_name]
+                    shell_start = time.perf_counter()
+                    shell_result = subprocess.run(multipass_shell_command)
+                    recorder.record(name=" ".join(multipass_shell_command), category="multipass",
+                                    start=shell_start, end=time.perf_counter(), returncode=shell_result.returncode)
+                succeeded = True
+            finally:
+                # The artifacts of a failed script matter the most, and are gone once the instance is deleted
+                self.collect_artifacts()
+                if self.args.headless:
+                    self.headless_teardown(succeeded)
 
             # Delete the instance if the --delete flag is specified
-            if self.args.delete:
+            if self.args.delete and not self.args.headless:
                 self.delete_instance()
+        elif self.args.headless:
+            sys.exit(INVALID_ARGUMENTS_EXIT_CODE)
+
+    def headless_teardown(self, succeeded: bool) -> None:
+        """
+        Deletes the instance without confirmation if the --teardown policy says so, a failed instance may be kept to
+        debug it
+        """
+        if not instance_exists(self.instance_name):
+            # The launch failed
+            return
+
+        if not should_teardown(self.args.teardown, succeeded=succeeded):
+            self.teardown_result = "kept"
+            print(f"{Fore.YELLOW}Instance {self.instance_name} kept (--teardown {self.args.teardown})."
+                  f"{Style.RESET_ALL}")
+        elif self.args.detach_delete:
+            teardown_in_background([self.instance_name])
+            # Releases the claimed pool instance right away, the refill does not wait for the background teardown
+            replace_instance(self.instance_name)
+            self.teardown_result = "detached"
+            print(f"{Fore.GREEN}Instance {self.instance_name} is being deleted in the background.{Style.RESET_ALL}")
+        else:
+            self.teardown_result = "deleted" if teardown_instance(self.instance_name) else "kept"
+
+    def artifacts_path(self) -> str:
+        return self.args.collect_dir or os.path.join(DEFAULT_COLLECT_FOLDER, self.instance_name)
+
+    def collect_artifacts(self) -> None:
+        """
+        Streams the files matching the --collect globs back from the instance
+        """
+        if self.args.collect and instance_exists(self.instance_name):
+            collect_artifacts(self.instance_name, patterns=self.args.collect, output_path=self.artifacts_path(),
+                              max_size=parse_size(self.args.collect_max_size))
+
+    def start_watched_run(self) -> Optional[WatchedRun]:
+        if not self.args.script:
+            return None
+        return WatchedRun(self.instance_name, target=lambda: self.execute_custom_script(cancellable=True))
+
+    def watch_project(self, watcher: ProjectWatcher) -> None:
+        """
+        Syncs the changed files and runs the custom script again every time the project changes, until Ctrl+C. A
+        change that arrives while the script runs cancels the stale run.
+        :param watcher: the watcher started before the provisioning
+        """
+        run = self.start_watched_run()
+        print(f"{Fore.GREEN}Watching {self.project_name} for changes, press Ctrl+C to stop...\n{Style.RESET_ALL}")
+        try:
+            while True:
+                changes = watcher.wait_for_changes()
+                if run:
+                    run.cancel()
+
+                print(f"{Fore.GREEN}{len(changes)} file(s) changed: {', '.join(changes[:5])}"
+                      f"{'...' if len(changes) > 5 else ''}\n{Style.RESET_ALL}")
+                # A mounted project is always up to date
+                if self.transfer_mode != "mount":
+                    self.sync_project()
+                run = self.start_watched_run()
+        except KeyboardInterrupt:
+            if run:
+                run.cancel()
+            print(f"\n{Fore.GREEN}Stopped watching {self.project_name}.{Style.RESET_ALL}")
+
+    def add_matrix_steps(self, job: MatrixJob, scripts: Dict[str, List[Subproject]]) -> None:
+        """
+        Adds the commands that transfer the project, install the dependencies and execute the custom script to a job
+        of the matrix
+        :param job: the matrix job
+        :param scripts: the path to each installation script and the subprojects it installs
+        """
+        if self.transfer_mode == "mount":
+            job.steps += [("mount project", command) for command in
+                          mount_project_commands(instance_name=job.instance_name, project_path=self.args.project,
+                                                 project_name=self.project_name, overlay=self.args.overlay)]
+        else:
+            job.steps.append(("transfer", ["multipass", "transfer", "-r", f"{self.args.project}/",
+                                           f"{job.instance_name}:."]))
+
+        if scripts and self.args.cache:
+            job.steps.append(("mount cache", mount_cache_command(job.instance_name)))
+        for script_path, subprojects in scripts.items():
+            job.steps += [("install dependencies", command) for command in
+                          self.install_dependencies_commands(job.instance_name, script_path=script_path,
+                                                             subprojects=subprojects)]
+
+        if self.args.script and os.path.exists(self.args.script):
+            job.steps += [("script", command) for command in self.custom_script_commands(job.instance_name)]
+
+    def add_matrix_cleanup_steps(self, job: MatrixJob) -> None:
+        """
+        Adds the deletion of the instance to a job of the matrix if the --delete flag or the --teardown policy say so
+        :param job: the matrix job
+        """
+        if self.args.headless:
+            if should_teardown(self.args.teardown, succeeded=True):
+                job.cleanup_steps.append(("delete", ["multipass", "delete", "--purge", job.instance_name]))
+            job.cleanup_on_failure = should_teardown(self.args.teardown, succeeded=False)
+        elif self.args.delete:
+            job.cleanup_steps.append(("delete", ["multipass", "delete", "--purge", job.instance_name]))
+
+    def run_matrix(self) -> None:
+        """
+        Launches an instance for every image and resource profile of the matrix and transfers the project, installs
+        the dependencies and executes the custom script on all of them concurrently. The matrix runs unattended:
+        no shell is opened and the instances are deleted without confirmation if the --delete flag is specified.
+        """
+        if not arguments_check(instance_name=self.args.instance_name, project_path=self.args.project) or \
+                not matrix_options_check(self.matrix_unsupported_options()):
+            if self.args.headless:
+                sys.exit(INVALID_ARGUMENTS_EXIT_CODE)
+            return
+
+        jobs = build_jobs(instance_name=self.args.instance_name, images=self.args.matrix_image,
+                          profiles=self.args.matrix_profile, count=self.args.matrix_count)
+        scripts = self.dependencies_scripts_paths() if self.args.install_dependencies else {}
+        self.transfer_mode = self.resolve_transfer_mode()
+
+        for job in jobs:
+            self.add_matrix_steps(job, scripts=scripts)
+            self.add_matrix_cleanup_steps(job)
+            # An existing instance makes the launch of its job fail, it is not crashtest's to delete
+            register_instance(job.instance_name, project=os.path.abspath(self.args.project), image=job.image,
+                              launched=not instance_exists(job.instance_name))
+
+        self.matrix_jobs = jobs
+        if not run_matrix(jobs, concurrency=self.args.concurrency):
+            # --headless propagates the exit code of the first failed job
+            sys.exit(next(job.returncode for job in jobs if job.returncode) if self.args.headless else 1)
 
     def delete_instance(self) -> None:
         """
@@ -171,23 +995,36 @@ class CrashTest:
         match input(
             "Are you sure you want to delete this instance? [Y/n]\n>>> "
         ).lower().strip()[0]:
+            case "y" if self.args.detach_delete:
+                teardown_in_background([self.instance_name])
+                replace_instance(self.instance_name)
+                print(f"{Fore.GREEN}Instance {self.instance_name} is being deleted in the background.{Style.RESET_ALL}")
             case "y":
                 # Stops the instance
                 print(f"\n{Fore.GREEN}Stopping the instance...{Style.RESET_ALL}")
-                multipass_stop_command: List[str] = ["multipass", "stop", self.args.instance_name]
+                multipass_stop_command: List[str] = ["multipass", "stop", self.instance_name]
                 self.execute_multipass_command(multipass_stop_command)
-                print(f"{Fore.GREEN}Instance {self.args.instance_name} stopped.{Style.RESET_ALL}\n")
+                print(f"{Fore.GREEN}Instance {self.instance_name} stopped.{Style.RESET_ALL}\n")
 
                 # Deletes the instance
-                print(f"{Fore.GREEN}Deleting the instance {self.args.instance_name}...{Style.RESET_ALL}\n")
-                multipass_delete_command = ["multipass", "delete", self.args.instance_name]
+                print(f"{Fore.GREEN}Deleting the instance {self.instance_name}...{Style.RESET_ALL}\n")
+                multipass_delete_command = ["multipass", "delete", self.instance_name]
                 self.execute_multipass_command(multipass_delete_command)
                 print(f"{Fore.GREEN}Instance deleted!{Style.RESET_ALL}")
+                forget_instance(self.instance_name)
+                unregister_instance(self.instance_name)
+
+                # Replaces the claimed pool instance while the user moves on
+                replace_instance(self.instance_name)
             case _:
                 print(f"{Fore.YELLOW}Elimination aborted.{Style.RESET_ALL}")
 
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        COMMANDS[sys.argv[1]](sys.argv[2:])
+        return
+
     crashtest: CrashTest = CrashTest(args=args_parser())
     crashtest.run()
 
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import shutil
+import socket
+import socketserver
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Final, Optional
+
+from colorama import Fore, Style
+
+import crash_test.error_codes
+from crash_test.error_logger import log_error
+from crash_test.utils import get_crashtest_home, get_host_memory, parse_size
+
+SOCKET_FILE: Final[str] = "crashtest.sock"
+# The number of recent admissions used to compute the wait times
+WAIT_HISTORY: Final[int] = 100
+
+
+def get_socket_path() -> str:
+    return os.path.join(get_crashtest_home(), SOCKET_FILE)
+
+
+class AdmissionQueue:
+    """
+    FIFO queue that admits jobs when their CPUs, memory and disk fit in what is left of the host budget
+    """
+
+    def __init__(self, cpus: int, memory: int, disk: int):
+        self.budget = {"cpus": cpus, "memory": memory, "disk": disk}
+        self.used = {"cpus": 0, "memory": 0, "disk": 0}
+        self.queue: deque = deque()
+        self.running: dict = {}
+        self.waits: deque = deque(maxlen=WAIT_HISTORY)
+        self.admitted_total = 0
+        self.condition = threading.Condition()
+
+    def fits_budget(self, job: dict) -> bool:
+        return all(job[resource] <= self.budget[resource] for resource in self.budget)
+
+    def fits_left(self, job: dict) -> bool:
+        return all(self.used[resource] + job[resource] <= self.budget[resource] for resource in self.budget)
+
+    def acquire(self, job: dict) -> float:
+        """
+        Block until the job is at the head of the queue and fits in the budget left
+        :param job: dict with the id, name, cpus, memory and disk (in bytes) of the job
+        :return: the seconds the job waited
+        """
+        with self.condition:
+            job["submitted"] = time.time()
+            self.queue.append(job)
+            self.condition.wait_for(lambda: self.queue[0] is job and self.fits_left(job))
+            self.queue.popleft()
+
+            for resource in self.used:
+                self.used[resource] += job[resource]
+            waited = time.time() - job["submitted"]
+            job["admitted"] = time.time()
+            self.running[job["id"]] = job
+            self.waits.append(waited)
+            self.admitted_total += 1
+            self.condition.notify_all()
+
+        return waited
+
+    def cancel(self, job: dict) -> None:
+        with self.condition:
+            if job in self.queue:
+                self.queue.remove(job)
+                self.condition.notify_all()
+
+    def release(self, job: dict) -> None:
+        with self.condition:
+            if self.running.pop(job["id"], None) is not None:
+                for resource in self.used:
+                    self.used[resource] -= job[resource]
+            self.condition.notify_all()
+
+    def status(self) -> dict:
+        with self.condition:
+            now = time.time()
+            return {
+                "type": "status",
+                "budget": self.budget,
+                "used": dict(self.used),
+                "queue_depth": len(self.queue),
+                "queued": [{"name": job["name"], "waiting": now - job["submitted"]} for job in self.queue],
+                "running": [{"name": job["name"], "running": now - job["admitted"]} for job in self.running.values()],
+                "admitted_total": self.admitted_total,
+                "average_wait": sum(self.waits) / len(self.waits) if self.waits else 0.0,
+                "max_wait": max(self.waits, default=0.0),
+            }
+
+
+class DaemonRequestHandler(socketserver.StreamRequestHandler):
+    def send(self, message: dict) -> None:
+        self.wfile.write(f"{json.dumps(message)}\n".encode())
+        self.wfile.flush()
+
+    def handle(self) -> None:
+        admission_queue: AdmissionQueue = self.server.admission_queue
+        line = self.rfile.readline()
+        if not line:
+            return
+
+        request = json.loads(line)
+        match request.get("type"):
+            case "status":
+                self.send(admission_queue.status())
+            case "submit":
+                job = {"id": id(self), "name": request.get("name", "job"), "cpus": int(request.get("cpus", 1)),
+                       "memory": int(request.get("memory", 0)), "disk": int(request.get("disk", 0))}
+                if not admission_queue.fits_budget(job):
+                    self.send({"type": "rejected", "reason": "the job needs more than the whole host budget"})
+                    return
+
+                self.send({"type": "queued", "position": admission_queue.status()["queue_depth"] + 1})
+                try:
+                    waited = admission_queue.acquire(job)
+                    self.send({"type": "admitted", "waited": waited})
+                    # The job holds its resources until the client closes the connection
+                    while self.rfile.readline():
+                        pass
+                except OSError:
+                    admission_queue.cancel(job)
+                finally:
+                    admission_queue.release(job)
+
+
+# Unix sockets are not available on Windows, where serve() refuses to start
+class DaemonServer(socketserver.ThreadingMixIn, getattr(socketserver, "UnixStreamServer", socketserver.TCPServer)):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, admission_queue: AdmissionQueue):
+        self.admission_queue = admission_queue
+        super().__init__(socket_path, DaemonRequestHandler)
+
+
+def serve(socket_path: str, cpus: int, memory: int, disk: int) -> None:
+    """
+    Run the daemon that admits the crashtest jobs of the host against the CPU, memory and disk budget
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        print(log_error(error_code=crash_test.error_codes.DAEMON_NOT_RUNNING_ERROR, socket_path=socket_path))
+        return
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    server = DaemonServer(socket_path, AdmissionQueue(cpus=cpus, memory=memory, disk=disk))
+    print(f"{Fore.GREEN}crashtest daemon listening on {socket_path} "
+          f"(CPUs: {cpus}, memory: {memory / 1024 ** 3:.1f}G, disk: {disk / 1024 ** 3:.1f}G){Style.RESET_ALL}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+
+
+def connect(socket_path: str) -> Optional[socket.socket]:
+    if not hasattr(socket, "AF_UNIX"):
+        print(log_error(error_code=crash_test.error_codes.DAEMON_NOT_RUNNING_ERROR, socket_path=socket_path))
+        return None
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+    except OSError:
+        client.close()
+        print(log_error(error_code=crash_test.error_codes.DAEMON_NOT_RUNNING_ERROR, socket_path=socket_path))
+        return None
+
+    return client
+
+
+@contextmanager
+def admission(socket_path: str, name: str, cpus: int, memory: int, disk: int):
+    """
+    Wait until the daemon admits the job and hold the admission while the job runs
+    :return: Bool: True if the job was admitted
+    """
+    client = connect(socket_path)
+    if client is None:
+        yield False
+        return
+
+    with client, client.makefile("rwb") as stream:
+        stream.write(f"{json.dumps({'type': 'submit', 'name': name, 'cpus': cpus, 'memory': memory, 'disk': disk})}\n"
+                     .encode())
+        stream.flush()
+
+        admitted = False
+        while line := stream.readline():
+            message = json.loads(line)
+            match message["type"]:
+                case "queued":
+                    print(f"{Fore.YELLOW}Queued by the crashtest daemon at position {message['position']}..."
+                          f"{Style.RESET_ALL}")
+                case "rejected":
+                    print(log_error(error_code=crash_test.error_codes.DAEMON_JOB_REJECTED_ERROR) + message["reason"])
+                    break
+                case "admitted":
+                    print(f"{Fore.GREEN}Admitted by the crashtest daemon after {message['waited']:.1f}s\n"
+                          f"{Style.RESET_ALL}")
+                    admitted = True
+                    break
+
+        yield admitted
+
+
+def print_status(socket_path: str) -> None:
+    client = connect(socket_path)
+    if client is None:
+        return
+
+    with client, client.makefile("rwb") as stream:
+        stream.write(b'{"type": "status"}\n')
+        stream.flush()
+        status = json.loads(stream.readline())
+
+    budget, used = status["budget"], status["used"]
+    print(f"CPUs: {used['cpus']}/{budget['cpus']}  "
+          f"Memory: {used['memory'] / 1024 ** 3:.1f}G/{budget['memory'] / 1024 ** 3:.1f}G  "
+          f"Disk: {used['disk'] / 1024 ** 3:.1f}G/{budget['disk'] / 1024 ** 3:.1f}G")
+    print(f"Queue depth: {status['queue_depth']}  Running: {len(status['running'])}  "
+          f"Admitted: {status['admitted_total']}  "
+          f"Wait: {status['average_wait']:.1f}s average, {status['max_wait']:.1f}s max")
+    for job in status["running"]:
+        print(f"  running  {job['name']} ({job['running']:.0f}s)")
+    for job in status["queued"]:
+        print(f"  queued   {job['name']} ({job['waiting']:.0f}s)")
+
+
+def serve_args_parser(argv):
+    parser = argparse.ArgumentParser(
+        prog="crashtest serve",
+        description="Queue the crashtest runs of the host and admit them against a CPU, memory and disk budget"
+    )
+    parser.add_argument("--socket", type=str, default=get_socket_path(), help="Path to the Unix socket")
+    parser.add_argument("--cpus", type=int, default=os.cpu_count() or 1, help="CPUs budget (default: all)")
+    parser.add_argument("--memory", type=str, help="Memory budget (e.g. 16G, default: the host memory)")
+    parser.add_argument("--disk", type=str,
+                        help="Disk budget (e.g. 100G, default: the free space of the crashtest home)")
+    parser.add_argument("--status", action="store_true", help="Print the queue of a running daemon")
+
+    return parser.parse_args(argv)
+
+
+def serve_main(argv) -> None:
+    args = serve_args_parser(argv)
+
+    if args.status:
+        print_status(args.socket)
+    else:
+        memory = parse_size(args.memory) if args.memory else get_host_memory()
+        disk = parse_size(args.disk) if args.disk else shutil.disk_usage(get_crashtest_home()).free
+        serve(socket_path=args.socket, cpus=args.cpus, memory=memory, disk=disk)
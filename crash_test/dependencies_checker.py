@@ -1,22 +1,144 @@
 #!/usr/bin/env python3
 
 import os
+import re
+from dataclasses import dataclass, field
+from typing import Dict, Final, List, Optional
 
 import crash_test.error_codes
 from crash_test.error_logger import log_error
+from crash_test.ignore import load_ignore_rules, walk_project
 from crash_test.script_selector import script_selector
 from crash_test.utils import get_scripts_absolute_path, check_script_path
 
+# The files that make a folder a subproject of each project type
+PROJECT_FILES: Final[Dict[str, List[str]]] = {
+    "python": ["requirements.txt", "pyproject.toml", "setup.py"],
+    "npm": ["package.json"],
+}
+
+# The files that define the dependencies of each project type
+MANIFEST_FILES: Final[Dict[str, List[str]]] = {
+    "python": PROJECT_FILES["python"] + ["setup.cfg", "poetry.lock", "Pipfile", "Pipfile.lock"],
+    "npm": PROJECT_FILES["npm"] + ["package-lock.json", "npm-shrinkwrap.json", "yarn.lock", "pnpm-lock.yaml"],
+}
+
+# The max folder depth searched for subprojects
+DEFAULT_MAX_DEPTH: Final[int] = 4
+
+# pyproject.toml also holds the configuration of tools (black, ruff...) in projects of other types, it only makes a
+# python subproject if it declares a package
+PYPROJECT_FILE: Final[str] = "pyproject.toml"
+PYPROJECT_PACKAGE_TABLE: Final[re.Pattern] = re.compile(r"^\s*\[\s*(project|build-system)\s*\]", re.MULTILINE)
+
+
+@dataclass
+class Subproject:
+    # The posix path relative to the project, "." for the project itself
+    path: str
+    project_type: str
+    manifests: List[str] = field(default_factory=list)
+
+
+def declares_package(pyproject_path: str) -> bool:
+    """
+    :return: Bool: True if the pyproject.toml has a [project] or a [build-system] table
+    """
+    try:
+        with open(pyproject_path, "r", errors="replace") as pyproject_file:
+            return PYPROJECT_PACKAGE_TABLE.search(pyproject_file.read()) is not None
+    except OSError:
+        return False
+
+
+def is_project_file(project_path: str, manifest: str, project_type: str) -> bool:
+    """
+    :param project_path: the path to the project
+    :param manifest: the posix path of the manifest relative to the project
+    :param project_type: the type of the subproject of the manifest
+    :return: Bool: True if the manifest makes its folder a subproject
+    """
+    file_name = os.path.basename(manifest)
+    if file_name == PYPROJECT_FILE:
+        return declares_package(os.path.join(project_path, *manifest.split("/")))
+
+    return file_name in PROJECT_FILES[project_type]
+
+
+def find_subprojects(project_path: str, max_depth: Optional[int] = DEFAULT_MAX_DEPTH) -> List[Subproject]:
+    """
+    Walk the project once, skipping the ignored folders, and find the folders holding dependency manifests
+    :param project_path: the path to the project
+    :param max_depth: the max folder depth to search, unlimited if None
+    :return: the subprojects sorted by path, the project itself first
+    """
+    manifest_types = {manifest: project_type for project_type, manifests in MANIFEST_FILES.items()
+                      for manifest in manifests}
+    subprojects: Dict[tuple, Subproject] = {}
+
+    if not os.path.isdir(project_path):
+        return []
+
+    for relative_path, entry in walk_project(project_path, load_ignore_rules(project_path), max_depth=max_depth):
+        if entry.name in manifest_types and entry.is_file():
+            folder = os.path.dirname(relative_path) or "."
+            project_type = manifest_types[entry.name]
+            subproject = subprojects.setdefault((folder, project_type), Subproject(path=folder,
+                                                                                   project_type=project_type))
+            subproject.manifests.append(relative_path)
+
+    # Lock files alone do not make a subproject
+    return sorted((subproject for subproject in subprojects.values()
+                   if any(is_project_file(project_path, manifest, subproject.project_type)
+                          for manifest in subproject.manifests)),
+                  key=lambda subproject: (subproject.path != ".", subproject.path, subproject.project_type))
+
 
 def find_requirements_file(project_path):
-    if os.path.exists(project_path):
-        files = [element for element in os.listdir(project_path) if element is not os.path.isdir(element)]
-        for file in files:
-            match file:
-                case "requirements.txt":
-                    return "python"
-                case "package.json":
-                    return "npm"
+    """
+    Get the type of the project from the manifests at its root
+    :param project_path: the path to the project
+    :return: "python", "npm" or None if the project root has no supported manifest
+    """
+    subprojects = find_subprojects(project_path=str(project_path), max_depth=0)
+    if subprojects:
+        return subprojects[0].project_type
+
+
+def group_subprojects(subprojects: List[Subproject], scripts_absolute_path: str) -> Dict[str, List[Subproject]]:
+    """
+    Group the subprojects by installation script
+    :return: dict: the path to each installation script and the subprojects it installs
+    """
+    scripts: Dict[str, List[Subproject]] = {}
+    for subproject in subprojects:
+        script_path = script_selector(project_type=subproject.project_type, scripts_path=scripts_absolute_path)
+        if script_path:
+            scripts.setdefault(script_path, []).append(subproject)
+
+    return scripts
+
+
+def check_subprojects_dependencies(project_path: str, scripts_relative_path,
+                                   max_depth: Optional[int] = DEFAULT_MAX_DEPTH) -> Dict[str, List[Subproject]]:
+    """
+    Find the subprojects of the project and the scripts that install their dependencies
+    :return: dict: the path to each installation script and the subprojects it installs, empty if there is none
+    """
+    if not os.path.exists(project_path):
+        print(log_error(error_code=crash_test.error_codes.NO_SUCH_FILE_OR_DIRECTORY_ERROR, project_path=project_path))
+        return {}
+
+    subprojects = find_subprojects(project_path=project_path, max_depth=max_depth)
+    if not subprojects:
+        print(log_error(error_code=crash_test.error_codes.NO_SUPPORTED_REQUIREMENTS_FILE_FOUND_ERROR))
+        return {}
+
+    scripts_absolute_path = get_scripts_absolute_path(relative_path=scripts_relative_path)
+    if not check_script_path(script_path=scripts_absolute_path):
+        return {}
+
+    return group_subprojects(subprojects, scripts_absolute_path=scripts_absolute_path)
 
 
 def check_dependencies(project_path: str, scripts_relative_path) -> str:
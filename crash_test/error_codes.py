@@ -9,3 +9,7 @@ MULTIPASS_NOT_INSTALLED_ERROR: Final[int] = 303
 INVALID_INSTANCE_NAME_ERROR: Final[int] = 304
 NO_SUPPORTED_REQUIREMENTS_FILE_FOUND_ERROR: Final[int] = 305
 SCRIPT_FOLDER_NOT_FOUND_ERROR: Final[int] = 306
+POOL_LIMIT_REACHED_ERROR: Final[int] = 307
+DAEMON_NOT_RUNNING_ERROR: Final[int] = 308
+DAEMON_JOB_REJECTED_ERROR: Final[int] = 309
+MATRIX_UNSUPPORTED_OPTIONS_ERROR: Final[int] = 310
@@ -5,7 +5,7 @@ from colorama import Fore, Style
 import crash_test.error_codes
 
 
-def log_error(error_code: int, project_path: str = "", script_path: str = "") -> str:
+def log_error(error_code: int, project_path: str = "", script_path: str = "", socket_path: str = "") -> str:
     match error_code:
         case crash_test.error_codes.NO_SUCH_FILE_OR_DIRECTORY_ERROR:
             return f"crashtest: error: cannot access {project_path}: No such file or directory."
@@ -21,3 +21,11 @@ def log_error(error_code: int, project_path: str = "", script_path: str = "") ->
             return f"{Fore.YELLOW}No supported project requirements file was found!{Style.RESET_ALL}\n"
         case crash_test.error_codes.SCRIPT_FOLDER_NOT_FOUND_ERROR:
             return f"crashtest: error: cannot access {script_path}: No such file or directory."
+        case crash_test.error_codes.POOL_LIMIT_REACHED_ERROR:
+            return f"{Fore.YELLOW}crashtest: pool: host CPU or memory cap reached.{Style.RESET_ALL}"
+        case crash_test.error_codes.DAEMON_NOT_RUNNING_ERROR:
+            return f"crashtest: error: cannot connect to the crashtest daemon at {socket_path}."
+        case crash_test.error_codes.DAEMON_JOB_REJECTED_ERROR:
+            return "crashtest: error: the crashtest daemon rejected the job: "
+        case crash_test.error_codes.MATRIX_UNSUPPORTED_OPTIONS_ERROR:
+            return "crashtest: error: the matrix instances do not support "
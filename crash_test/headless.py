@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+import json
+import time
+from typing import Dict, Final, List, Optional
+
+from crash_test.matrix import MatrixJob
+
+# When --headless deletes the instance: after every run, only after a successful run (a failed instance is kept to
+# debug it) or never
+TEARDOWN_POLICIES: Final[List[str]] = ["always", "on-success", "never"]
+DEFAULT_TEARDOWN_POLICY: Final[str] = "always"
+# The version of the JSON result, bumped when a field changes meaning
+RESULT_VERSION: Final[int] = 1
+# The exit code of a headless run with invalid arguments
+INVALID_ARGUMENTS_EXIT_CODE: Final[int] = 2
+
+
+def should_teardown(policy: str, succeeded: bool) -> bool:
+    match policy:
+        case "always":
+            return True
+        case "on-success":
+            return succeeded
+        case _:
+            return False
+
+
+def run_status(exit_code: int) -> str:
+    match exit_code:
+        case 0:
+            return "passed"
+        case 130:
+            return "cancelled"
+        case _:
+            return "failed"
+
+
+def build_result(exit_code: int, started: float, instance_name: str, project: str, image: Optional[str],
+                 failed_step: Optional[str] = None, steps: Optional[Dict[str, float]] = None,
+                 teardown: Optional[str] = None, artifacts: Optional[str] = None,
+                 jobs: Optional[List[MatrixJob]] = None) -> dict:
+    """
+    Build the machine-readable result of a headless run
+    :param exit_code: the exit code of crashtest, the one of the script if it failed
+    :param started: the time.time() value when the run started
+    :param instance_name: the name of the multipass instance
+    :param project: the absolute path to the project
+    :param image: the image of the instance
+    :param failed_step: the provisioning step that failed, if any
+    :param steps: the duration of every provisioning step
+    :param teardown: "deleted", "detached" or "kept", None if the run ended before the teardown
+    :param artifacts: the folder of the collected artifacts, if any
+    :param jobs: the jobs of a matrix run
+    :return: dict: the result
+    """
+    result = {
+        "version": RESULT_VERSION,
+        "status": run_status(exit_code),
+        "exit_code": exit_code,
+        "instance": instance_name,
+        "project": project,
+        "image": image,
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(started)),
+        "duration": round(time.time() - started, 3),
+        "failed_step": failed_step,
+        "steps": {name: round(duration, 3) for name, duration in (steps or {}).items()},
+        "teardown": teardown,
+        "artifacts": artifacts,
+    }
+    if jobs is not None:
+        result["jobs"] = [{"instance": job.instance_name, "image": job.image, "profile": str(job.profile),
+                           "exit_code": job.returncode, "failed_step": job.failed_step,
+                           "duration": round(job.duration, 3)} for job in jobs]
+
+    return result
+
+
+def write_result(result: dict, path: Optional[str] = None) -> None:
+    """
+    Write the result as a single JSON line to a file, or print it as the last line of the output
+    :param result: the result built by build_result
+    :param path: the path to the result file, None to print it
+    """
+    line = json.dumps(result, separators=(",", ":"))
+    if path:
+        with open(path, "w") as result_file:
+            result_file.write(line + "\n")
+    else:
+        print(line, flush=True)
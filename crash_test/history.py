@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import sqlite3
+import time
+from contextlib import closing
+from dataclasses import dataclass, asdict
+from typing import Dict, Final, List, Optional
+
+from colorama import Fore, Style
+
+from crash_test.timings import Timing
+from crash_test.utils import get_crashtest_home, percentile, parse_duration
+
+# The SQLite database of the runs, in the crashtest home folder
+HISTORY_DATABASE: Final[str] = "history.db"
+SCHEMA_VERSION: Final[int] = 1
+SCHEMA: Final[str] = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started REAL NOT NULL,
+    duration REAL NOT NULL,
+    instance TEXT,
+    project TEXT,
+    image TEXT,
+    fingerprint TEXT,
+    exit_code INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS phases (
+    run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    duration REAL NOT NULL,
+    commands INTEGER NOT NULL DEFAULT 0,
+    bytes_in INTEGER NOT NULL DEFAULT 0,
+    bytes_out INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS phases_name ON phases (name, run_id);
+"""
+
+# The percentiles reported by crashtest stats
+PERCENTILES: Final[List[int]] = [50, 95, 99]
+# A phase regressed if it took longer than the p95 of its baseline and REGRESSION_FACTOR times its median. The
+# baseline is the last BASELINE_RUNS successful runs of the same project and image before the run, and needs at least
+# MIN_BASELINE_RUNS of them to be meaningful.
+BASELINE_RUNS: Final[int] = 20
+MIN_BASELINE_RUNS: Final[int] = 5
+REGRESSION_FACTOR: Final[float] = 1.5
+# The latest runs checked for regressions by crashtest stats
+DEFAULT_CHECKED_RUNS: Final[int] = 10
+
+
+@dataclass
+class PhaseRecord:
+    name: str
+    duration: float
+    commands: int = 0
+    bytes_in: int = 0
+    bytes_out: int = 0
+
+
+@dataclass
+class Regression:
+    run_id: int
+    started: float
+    phase: str
+    duration: float
+    baseline_p50: float
+    baseline_p95: float
+
+    @property
+    def slowdown(self) -> float:
+        return self.duration / self.baseline_p50 if self.baseline_p50 else float("inf")
+
+
+def get_history_path() -> str:
+    return os.path.join(get_crashtest_home(), HISTORY_DATABASE)
+
+
+def connect(path: Optional[str] = None) -> sqlite3.Connection:
+    """
+    Open the history database, creating its tables if needed. WAL lets concurrent runs append while another one
+    reads the statistics.
+    """
+    connection = sqlite3.connect(path or get_history_path(), timeout=10)
+    connection.execute("PRAGMA journal_mode = WAL")
+    connection.execute("PRAGMA foreign_keys = ON")
+    if connection.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+        connection.executescript(SCHEMA)
+        connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    return connection
+
+
+def phase_name(timing: Timing) -> str:
+    """
+    :return: the provisioning step name, or "multipass SUBCOMMAND" for a multipass command
+    """
+    if timing.category == "multipass":
+        parts = timing.name.split()
+        return f"multipass {parts[1]}" if len(parts) > 1 else timing.name
+    return timing.name
+
+
+def aggregate_phases(timings: List[Timing]) -> List[PhaseRecord]:
+    """
+    Sum the durations and byte counts of the provisioning steps and of the multipass commands of every subcommand
+    :param timings: the timings of the run
+    :return: the phases, in the order they first appear
+    """
+    phases: Dict[str, PhaseRecord] = {}
+    for timing in timings:
+        name = phase_name(timing)
+        phase = phases.setdefault(name, PhaseRecord(name=name, duration=0.0))
+        phase.duration += timing.duration
+        if timing.category == "multipass":
+            phase.commands += 1
+            phase.bytes_in += timing.bytes_in
+            phase.bytes_out += timing.bytes_out
+
+    return list(phases.values())
+
+
+def record_run(timings: List[Timing], started: float, duration: float, exit_code: int,
+               instance_name: Optional[str] = None, project: Optional[str] = None, image: Optional[str] = None,
+               fingerprint: Optional[str] = None, path: Optional[str] = None) -> int:
+    """
+    Append a run and the durations and byte counts of its phases to the history
+    :param timings: the timings of the run
+    :param started: the time.time() value when the run started
+    :param duration: the seconds the run took
+    :param exit_code: the exit code of the run
+    :param instance_name: the name of the multipass instance
+    :param project: the absolute path to the project
+    :param image: the image of the instance
+    :param fingerprint: the dependencies manifest fingerprint
+    :param path: the path to the database, the one of the crashtest home folder if None
+    :return: the id of the run
+    """
+    with closing(connect(path)) as connection, connection:
+        cursor = connection.execute(
+            "INSERT INTO runs (started, duration, instance, project, image, fingerprint, exit_code) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (started, duration, instance_name, project, image, fingerprint, exit_code)
+        )
+        run_id = cursor.lastrowid
+        connection.executemany(
+            "INSERT INTO phases (run_id, name, duration, commands, bytes_in, bytes_out) VALUES (?, ?, ?, ?, ?, ?)",
+            [(run_id, phase.name, phase.duration, phase.commands, phase.bytes_in, phase.bytes_out)
+             for phase in aggregate_phases(timings)]
+        )
+
+    return run_id
+
+
+def phase_statistics(since: Optional[float] = None, project: Optional[str] = None, image: Optional[str] = None,
+                     path: Optional[str] = None) -> Dict[str, Dict[str, float]]:
+    """
+    Compute the duration percentiles of every phase over the successful runs
+    :param since: only the runs started at or after this time.time() value if specified
+    :param project: only the runs of this project if specified
+    :param image: only the runs of this image if specified
+    :param path: the path to the database
+    :return: dict: {phase: {"runs", "p50", "p95", "p99", "bytes_out"}}, the bytes are the mean per run
+    """
+    query = ("SELECT phases.name, phases.duration, phases.bytes_out FROM phases JOIN runs ON runs.id = phases.run_id "
+             "WHERE runs.exit_code = 0")
+    parameters = []
+    for condition, value in (("runs.started >= ?", since), ("runs.project = ?", project), ("runs.image = ?", image)):
+        if value is not None:
+            query += f" AND {condition}"
+            parameters.append(value)
+
+    durations: Dict[str, List[float]] = {}
+    output_bytes: Dict[str, int] = {}
+    with closing(connect(path)) as connection:
+        for name, duration, bytes_out in connection.execute(query, parameters):
+            durations.setdefault(name, []).append(duration)
+            output_bytes[name] = output_bytes.get(name, 0) + bytes_out
+
+    statistics = {}
+    for name, values in durations.items():
+        statistics[name] = {"runs": len(values), "bytes_out": output_bytes[name] / len(values)}
+        for rank in PERCENTILES:
+            statistics[name][f"p{rank}"] = percentile(values, rank)
+
+    return statistics
+
+
+def find_regressions(run_ids: Optional[List[int]] = None, checked_runs: int = DEFAULT_CHECKED_RUNS,
+                     project: Optional[str] = None, image: Optional[str] = None,
+                     path: Optional[str] = None) -> List[Regression]:
+    """
+    Compare the phases of runs with the rolling baseline of the successful runs of the same project and image that
+    came before them
+    :param run_ids: the runs to check, the latest checked_runs runs if None
+    :param checked_runs: the number of latest runs to check
+    :param project: only check the runs of this project if specified
+    :param image: only check the runs of this image if specified
+    :param path: the path to the database
+    :return: the phases that were significantly slower than their baseline
+    """
+    regressions = []
+    with closing(connect(path)) as connection:
+        if run_ids is None:
+            run_ids = [row[0] for row in connection.execute(
+                "SELECT id FROM runs WHERE (? IS NULL OR project = ?) AND (? IS NULL OR image = ?) "
+                "ORDER BY id DESC LIMIT ?", (project, project, image, image, checked_runs)
+            )]
+
+        for run_id in sorted(run_ids):
+            run = connection.execute("SELECT started, project, image FROM runs WHERE id = ?", (run_id,)).fetchone()
+            if run is None:
+                continue
+            started, project, image = run
+            for name, duration in connection.execute("SELECT name, duration FROM phases WHERE run_id = ?",
+                                                     (run_id,)).fetchall():
+                baseline = [row[0] for row in connection.execute(
+                    "SELECT phases.duration FROM phases JOIN runs ON runs.id = phases.run_id "
+                    "WHERE phases.name = ? AND runs.id < ? AND runs.exit_code = 0 AND runs.project IS ? "
+                    "AND runs.image IS ? ORDER BY runs.id DESC LIMIT ?",
+                    (name, run_id, project, image, BASELINE_RUNS)
+                )]
+                if len(baseline) < MIN_BASELINE_RUNS:
+                    continue
+
+                baseline_p50, baseline_p95 = percentile(baseline, 50), percentile(baseline, 95)
+                if duration > baseline_p95 and duration > REGRESSION_FACTOR * baseline_p50:
+                    regressions.append(Regression(run_id=run_id, started=started, phase=name, duration=duration,
+                                                  baseline_p50=baseline_p50, baseline_p95=baseline_p95))
+
+    return regressions
+
+
+def print_regressions(regressions: List[Regression]) -> None:
+    for regression in regressions:
+        started = time.strftime("%Y-%m-%d %H:%M", time.localtime(regression.started))
+        print(f"{Fore.YELLOW}⚠ run {regression.run_id} ({started}): "
+              f"{regression.phase} took {regression.duration:.1f}s, {regression.slowdown:.1f}x its baseline median "
+              f"of {regression.baseline_p50:.1f}s (p95 {regression.baseline_p95:.1f}s){Style.RESET_ALL}")
+
+
+def print_statistics(statistics: Dict[str, Dict[str, float]]) -> None:
+    if not statistics:
+        print(f"{Fore.YELLOW}No successful run recorded yet.{Style.RESET_ALL}")
+        return
+
+    print(f"{'PHASE':<30}{'RUNS':>6}" + "".join(f"{f'P{rank}':>10}" for rank in PERCENTILES) + f"{'OUT/RUN':>12}")
+    for name, phase in sorted(statistics.items(), key=lambda item: -item[1]["p50"]):
+        print(f"{name:<30}{phase['runs']:>6}" + "".join(f"{phase[f'p{rank}']:>9.2f}s" for rank in PERCENTILES) +
+              f"{phase['bytes_out']:>12.0f}")
+
+
+def stats_args_parser(argv):
+    parser = argparse.ArgumentParser(
+        prog="crashtest stats",
+        description="Print the duration percentiles of the provisioning phases of the past runs and the runs that "
+                    "were significantly slower than usual"
+    )
+    parser.add_argument("--since", type=parse_duration, help="Only the runs of this period (e.g. 12h, 7d)")
+    parser.add_argument("-p", "--project", type=str, help="Only the runs of this project")
+    parser.add_argument("--image", type=str, help="Only the runs of this image")
+    parser.add_argument("--check", type=int, default=DEFAULT_CHECKED_RUNS,
+                        help=f"Check the latest CHECK runs for regressions (default: {DEFAULT_CHECKED_RUNS})")
+    parser.add_argument("--json", action="store_true", help="Print the statistics and the regressions as JSON")
+
+    return parser.parse_args(argv)
+
+
+def stats_main(argv) -> None:
+    args = stats_args_parser(argv)
+    since = time.time() - args.since if args.since is not None else None
+    project = os.path.abspath(args.project) if args.project else None
+    statistics = phase_statistics(since=since, project=project, image=args.image)
+    regressions = find_regressions(checked_runs=args.check, project=project, image=args.image)
+    regressions = [regression for regression in regressions if since is None or regression.started >= since]
+
+    if args.json:
+        print(json.dumps({"phases": statistics, "regressions": [asdict(regression) for regression in regressions]},
+                         indent=2))
+        return
+
+    print_statistics(statistics)
+    if regressions:
+        print()
+        print_regressions(regressions)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+import os
+import re
+from typing import Final, Iterator, List, Tuple
+
+# Folders rebuilt by the dependencies installation scripts or useless in the instance
+DEFAULT_IGNORE_PATTERNS: Final[List[str]] = [".git/", "venv/", ".venv/", "node_modules/", "__pycache__/"]
+IGNORE_FILES: Final[List[str]] = [".gitignore", ".crashtestignore"]
+
+
+class IgnoreRule:
+    def __init__(self, pattern: str):
+        self.negated = pattern.startswith("!")
+        pattern = pattern[1:] if self.negated else pattern
+
+        self.directory_only = pattern.endswith("/")
+        pattern = pattern.rstrip("/")
+
+        # A pattern with a slash is relative to the project root, otherwise it matches at any depth
+        anchored = "/" in pattern
+        pattern = pattern.lstrip("/")
+
+        regex = ""
+        index = 0
+        while index < len(pattern):
+            if pattern.startswith("**/", index):
+                regex += "(?:.*/)?"
+                index += 3
+            elif pattern.startswith("**", index):
+                regex += ".*"
+                index += 2
+            elif pattern[index] == "*":
+                regex += "[^/]*"
+                index += 1
+            elif pattern[index] == "?":
+                regex += "[^/]"
+                index += 1
+            else:
+                regex += re.escape(pattern[index])
+                index += 1
+
+        self.regex = re.compile(("" if anchored else "(?:.*/)?") + regex + "$")
+
+    def matches(self, relative_path: str, is_dir: bool) -> bool:
+        if self.directory_only and not is_dir:
+            return False
+        return self.regex.match(relative_path) is not None
+
+
+def load_ignore_rules(project_path: str) -> List[IgnoreRule]:
+    """
+    Load the default ignore patterns and the ones from the .gitignore and .crashtestignore files of the project root
+    :param project_path: the path to the project
+    :return: the ignore rules, the last matching rule wins
+    """
+    patterns = list(DEFAULT_IGNORE_PATTERNS)
+    for ignore_file in IGNORE_FILES:
+        ignore_file_path = os.path.join(project_path, ignore_file)
+        if os.path.isfile(ignore_file_path):
+            with open(ignore_file_path, "r") as file:
+                patterns += [line.strip() for line in file if line.strip() and not line.startswith("#")]
+
+    return [IgnoreRule(pattern) for pattern in patterns]
+
+
+def is_ignored(relative_path: str, is_dir: bool, rules: List[IgnoreRule]) -> bool:
+    ignored = False
+    for rule in rules:
+        if rule.matches(relative_path, is_dir):
+            ignored = not rule.negated
+
+    return ignored
+
+
+def walk_project(project_path: str, rules: List[IgnoreRule],
+                 max_depth: int = None) -> Iterator[Tuple[str, os.DirEntry]]:
+    """
+    Walk the project once, skipping the ignored files and without descending into the ignored folders
+    :param project_path: the path to the project
+    :param rules: the ignore rules
+    :param max_depth: the max folder depth to descend into, unlimited if None
+    :return: an iterator of (relative posix path, directory entry)
+    """
+    directories: List[Tuple[str, int]] = [(project_path, 0)]
+
+    while directories:
+        directory, depth = directories.pop()
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                relative_path = os.path.relpath(entry.path, project_path).replace(os.sep, "/")
+                is_dir = entry.is_dir(follow_symlinks=False)
+
+                if is_ignored(relative_path, is_dir, rules):
+                    continue
+
+                yield relative_path, entry
+
+                if is_dir and (max_depth is None or depth < max_depth):
+                    directories.append((entry.path, depth + 1))
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+import asyncio
+import itertools
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+from colorama import Fore, Style
+
+from crash_test.multipass import launch_command, prepare_retry, TAIL_LINES
+from crash_test.retry import get_policy, command_phase, backoff_delay, track_process_group, untrack_process_group, \
+    kill_process_group, TIMEOUT_EXIT_CODE
+from crash_test.timings import recorder
+
+# Colors used to tell apart the output of the matrix instances
+PREFIX_COLORS: List[str] = [Fore.CYAN, Fore.MAGENTA, Fore.BLUE, Fore.YELLOW, Fore.GREEN, Fore.WHITE]
+
+
+@dataclass
+class Profile:
+    cpus: Optional[int] = None
+    memory: Optional[str] = None
+    disk: Optional[str] = None
+
+    def __str__(self) -> str:
+        return f"{self.cpus or '-'}:{self.memory or '-'}:{self.disk or '-'}"
+
+
+@dataclass
+class MatrixJob:
+    instance_name: str
+    image: Optional[str]
+    profile: Profile
+    steps: List[Tuple[str, List[str]]] = field(default_factory=list)
+    # Steps that run even if a previous step failed (e.g. the instance deletion)
+    cleanup_steps: List[Tuple[str, List[str]]] = field(default_factory=list)
+    # Whether the cleanup steps also run after a failed step, False keeps a failed instance to debug it
+    cleanup_on_failure: bool = True
+    returncode: Optional[int] = None
+    failed_step: Optional[str] = None
+    duration: float = 0.0
+
+
+def parse_profile(profile: str) -> Profile:
+    """
+    Parse a resource profile
+    :param profile: CPUS:MEMORY:DISK (e.g. 2:4G:20G), every part can be omitted (e.g. :4G)
+    :return: the profile
+    """
+    cpus, memory, disk = (profile.split(":") + ["", "", ""])[:3]
+    return Profile(cpus=int(cpus) if cpus else None, memory=memory or None, disk=disk or None)
+
+
+def build_jobs(instance_name: str, images: List[Optional[str]], profiles: List[Profile], count: int) -> List[MatrixJob]:
+    """
+    Build a job for every combination of image and profile, repeated count times
+    :param instance_name: the base name of the instances
+    :return: the matrix jobs
+    """
+    jobs: List[MatrixJob] = []
+    for index, (image, profile, _) in enumerate(itertools.product(images or [None], profiles or [Profile()],
+                                                                  range(count)), start=1):
+        job = MatrixJob(instance_name=f"{instance_name}-{index}", image=image, profile=profile)
+        job.steps.append(("launch", launch_command(instance_name=job.instance_name, image=image, cpus=profile.cpus,
+                                                   memory=profile.memory, disk=profile.disk)))
+        jobs.append(job)
+
+    return jobs
+
+
+async def run_attempt(prefix: str, command: List[str], timeout: Optional[float],
+                      lane: Optional[str] = None) -> Tuple[int, bool, List[str]]:
+    """
+    Run a multipass command once and print its output line by line, prefixed with the instance name
+    :param timeout: the seconds after which the command is killed with its child processes, no limit if None
+    :param lane: the trace lane of the command, the instance name of its job
+    :return: the return code of the command, whether it timed out and the last lines of its output
+    """
+    start = time.perf_counter()
+    output_bytes = 0
+    output_tail: deque = deque(maxlen=TAIL_LINES)
+    process = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE,
+                                                   stderr=asyncio.subprocess.STDOUT, start_new_session=True)
+    track_process_group(process.pid)
+
+    async def print_output() -> int:
+        nonlocal output_bytes
+        while line := await process.stdout.readline():
+            output_bytes += len(line)
+            output_tail.append(line.decode(errors='replace'))
+            print(f"{prefix} {line.decode(errors='replace').rstrip()}")
+        return await process.wait()
+
+    timed_out = False
+    try:
+        returncode = await asyncio.wait_for(print_output(), timeout=timeout)
+    except asyncio.TimeoutError:
+        kill_process_group(process.pid)
+        await process.wait()
+        returncode = TIMEOUT_EXIT_CODE
+        timed_out = True
+    finally:
+        untrack_process_group(process.pid)
+
+    recorder.record(name=" ".join(command), category="multipass", start=start, end=time.perf_counter(),
+                    returncode=returncode, bytes_out=output_bytes, lane=lane)
+
+    return returncode, timed_out, list(output_tail)
+
+
+async def run_step(prefix: str, command: List[str], lane: Optional[str] = None) -> int:
+    """
+    Run a multipass command with the timeout and the retries of its policy, printing its output line by line,
+    prefixed with the instance name
+    :param lane: the trace lane of the command, the instance name of its job
+    :return: the return code of the last attempt
+    """
+    policy = get_policy(command)
+    for attempt in range(policy.retries + 1):
+        returncode, timed_out, output_tail = await run_attempt(prefix, command, timeout=policy.timeout, lane=lane)
+        if returncode == 0 or attempt == policy.retries or \
+                not await asyncio.to_thread(prepare_retry, command, output_tail):
+            break
+
+        delay = backoff_delay(attempt)
+        failure = f"timed out after {policy.timeout:g}s" if timed_out else f"failed with exit code {returncode}"
+        print(f"{prefix} {Fore.YELLOW}multipass {command_phase(command)} {failure}, retrying in {delay:.1f}s "
+              f"({attempt + 1}/{policy.retries})...{Style.RESET_ALL}")
+        await asyncio.sleep(delay)
+
+    return returncode
+
+
+async def run_job(job: MatrixJob, color: str, semaphore: asyncio.Semaphore) -> None:
+    async with semaphore:
+        prefix = f"{color}[{job.instance_name}]{Style.RESET_ALL}"
+        start = time.monotonic()
+        job.returncode = 0
+
+        for step_name, command in job.steps:
+            print(f"{prefix} {Fore.GREEN}{step_name}...{Style.RESET_ALL}")
+            returncode = await run_step(prefix, command, lane=job.instance_name)
+            if returncode != 0:
+                job.returncode = returncode
+                job.failed_step = step_name
+                print(f"{prefix} {Fore.RED}{step_name} failed with exit code {returncode}{Style.RESET_ALL}")
+                break
+
+        for step_name, command in job.cleanup_steps if job.returncode == 0 or job.cleanup_on_failure else []:
+            print(f"{prefix} {Fore.GREEN}{step_name}...{Style.RESET_ALL}")
+            await run_step(prefix, command, lane=job.instance_name)
+
+        job.duration = time.monotonic() - start
+
+
+async def run_jobs(jobs: List[MatrixJob], concurrency: int) -> None:
+    semaphore = asyncio.Semaphore(concurrency)
+    await asyncio.gather(*(run_job(job, PREFIX_COLORS[index % len(PREFIX_COLORS)], semaphore)
+                           for index, job in enumerate(jobs)))
+
+
+def run_matrix(jobs: List[MatrixJob], concurrency: int) -> bool:
+    """
+    Run the steps of every job, up to concurrency jobs at the same time, and print a summary
+    :return: Bool: True if every job succeeded
+    """
+    start = time.monotonic()
+    asyncio.run(run_jobs(jobs, concurrency=max(concurrency, 1)))
+    print_summary(jobs, total_duration=time.monotonic() - start)
+
+    return all(job.returncode == 0 for job in jobs)
+
+
+def print_summary(jobs: List[MatrixJob], total_duration: float) -> None:
+    print(f"\n{'INSTANCE':<30}{'IMAGE':<16}{'PROFILE':<16}{'EXIT':>6}{'DURATION':>11}  FAILED STEP")
+    for job in jobs:
+        color = Fore.GREEN if job.returncode == 0 else Fore.RED
+        print(f"{color}{job.instance_name:<30}{job.image or 'default':<16}{str(job.profile):<16}"
+              f"{job.returncode:>6}{job.duration:>10.1f}s  {job.failed_step or ''}{Style.RESET_ALL}")
+    print(f"\nTotal: {total_duration:.1f}s")
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+import os
+import shlex
+from typing import Collection, Final, List, Tuple
+
+from colorama import Fore, Style
+
+from crash_test.ignore import IgnoreRule, walk_project
+
+TRANSFER_MODES: Final[List[str]] = ["auto", "copy", "mount"]
+
+# Projects at least this large or with at least this many files are mounted by the auto mode
+MOUNT_SIZE_THRESHOLD: Final[int] = 500 * 1024 ** 2
+MOUNT_FILES_THRESHOLD: Final[int] = 20_000
+
+GUEST_HOME_PATH: Final[str] = "/home/ubuntu"
+# The read-only side of the overlay is mounted here, the writes go to the instance disk
+GUEST_LOWER_PATH: Final[str] = "/home/ubuntu/.crashtest-lower"
+GUEST_OVERLAY_PATH: Final[str] = "/var/lib/crashtest-overlay"
+
+
+def measure_project(project_path: str, rules: List[IgnoreRule]) -> Tuple[int, int]:
+    """
+    Measure the size and the file count of the project, stopping as soon as a mount threshold is reached
+    :param project_path: the path to the project
+    :param rules: the ignore rules of the transfer
+    :return: the size in bytes and the number of files measured
+    """
+    size = 0
+    files = 0
+    for _, entry in walk_project(project_path, rules=rules):
+        if entry.is_file(follow_symlinks=False):
+            size += entry.stat(follow_symlinks=False).st_size
+            files += 1
+            if size >= MOUNT_SIZE_THRESHOLD or files >= MOUNT_FILES_THRESHOLD:
+                break
+
+    return size, files
+
+
+def choose_transfer_mode(mode: str, project_path: str, rules: List[IgnoreRule]) -> str:
+    """
+    Resolve the auto mode from the size and the file count of the project
+    :param mode: auto, copy or mount
+    :param project_path: the path to the project
+    :param rules: the ignore rules of the transfer
+    :return: copy or mount
+    """
+    if mode != "auto":
+        return mode
+
+    size, files = measure_project(project_path, rules=rules)
+    mode = "mount" if size >= MOUNT_SIZE_THRESHOLD or files >= MOUNT_FILES_THRESHOLD else "copy"
+    print(f"{Fore.GREEN}The project has {'at least ' if mode == 'mount' else ''}{files} files "
+          f"({size / 1024 ** 2:.1f}M), it will be {'mounted' if mode == 'mount' else 'copied'}.\n{Style.RESET_ALL}")
+
+    return mode
+
+
+def mount_project_commands(instance_name: str, project_path: str, project_name: str, overlay: bool,
+                           mounted: Collection[str] = ()) -> List[List[str]]:
+    """
+    Build the commands that expose the project at the path it would be copied to in the instance, so the
+    installation and custom scripts work unchanged
+    :param instance_name: the name of the multipass instance
+    :param project_path: the path to the project
+    :param project_name: the project name without the path
+    :param overlay: mount the project under a copy-on-write overlay, so the writes of the instance stay in the
+    instance and the host project is left untouched
+    :param mounted: the paths of the instance where a host folder is already mounted, which are not mounted again
+    :return: the multipass commands
+    """
+    project_guest_path = f"{GUEST_HOME_PATH}/{project_name}"
+    if not overlay:
+        if project_guest_path in mounted:
+            return []
+        return [["multipass", "mount", os.path.abspath(project_path), f"{instance_name}:{project_guest_path}"]]
+
+    lower_path = f"{GUEST_LOWER_PATH}/{project_name}"
+    upper_path = f"{GUEST_OVERLAY_PATH}/{project_name}/upper"
+    work_path = f"{GUEST_OVERLAY_PATH}/{project_name}/work"
+    # The overlay does not survive a restart of the instance, unlike the multipass mount
+    overlay_script = (
+        f"mountpoint -q {shlex.quote(project_guest_path)} || {{ mkdir -p {shlex.quote(project_guest_path)}"
+        f" && sudo mkdir -p {shlex.quote(upper_path)} {shlex.quote(work_path)}"
+        f" && sudo chown ubuntu:ubuntu {shlex.quote(upper_path)}"
+        f" && sudo mount -t overlay overlay"
+        f" -o {shlex.quote(f'lowerdir={lower_path},upperdir={upper_path},workdir={work_path}')}"
+        f" {shlex.quote(project_guest_path)}; }}"
+    )
+
+    commands = []
+    if lower_path not in mounted:
+        commands.append(["multipass", "mount", os.path.abspath(project_path), f"{instance_name}:{lower_path}"])
+    commands.append(["multipass", "exec", instance_name, "--", "bash", "-c", overlay_script])
+
+    return commands
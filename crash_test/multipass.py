@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+
+import json
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from typing import BinaryIO, Callable, Dict, Final, List, Optional, Tuple
+
+from colorama import Fore, Style
+
+import crash_test.error_codes
+from crash_test.error_logger import log_error
+from crash_test.retry import CommandPolicy, get_policy, command_phase, backoff_delay, track_process_group, \
+    untrack_process_group, kill_process_group, TIMEOUT_EXIT_CODE
+from crash_test.session import get_session, close_session, session_arguments
+from crash_test.timings import recorder
+
+# The resources multipass allocates to an instance when they are not specified
+DEFAULT_CPUS: Final[int] = 1
+DEFAULT_MEMORY: Final[str] = "1G"
+DEFAULT_DISK: Final[str] = "5G"
+
+# The number of output lines kept in memory for the error report
+TAIL_LINES: Final[int] = 50
+# The error of a launch whose instance name is taken (launch failed: instance "NAME" already exists)
+ALREADY_EXISTS_ERROR: Final[str] = "already exists"
+
+# The file where the full output of the multipass commands is written, if any
+log_file_path: Optional[str] = None
+
+# Run the exec and small transfer commands through a long-lived shell per instance instead of a new multipass exec
+persistent_sessions: bool = False
+
+# The multipass commands after which the cached state of the instances is outdated
+STATE_CHANGING_COMMANDS: Final[set] = {"launch", "start", "stop", "restart", "suspend", "delete", "recover", "purge",
+                                       "clone", "mount", "umount"}
+
+# The multipass commands that end the shells running in the instances
+SESSION_ENDING_COMMANDS: Final[set] = {"stop", "restart", "suspend", "delete"}
+
+# The output of multipass list and multipass info, queried once per run
+instances_cache: Optional[Dict[str, dict]] = None
+instances_info_cache: Dict[str, Optional[dict]] = {}
+instances_cache_lock = threading.Lock()
+
+
+def set_log_file(path: Optional[str]) -> None:
+    """
+    Tee the full output of the next multipass commands to a file
+    :param path: the path to the log file or None to disable it
+    """
+    global log_file_path
+    log_file_path = path
+
+
+def set_persistent_sessions(enabled: bool) -> None:
+    """
+    Run the next exec commands, and the transfers of single files, through a persistent session of their instance
+    :param enabled: True to use the sessions, False to run a multipass process per command
+    """
+    global persistent_sessions
+    persistent_sessions = enabled
+
+
+@dataclass
+class CommandResult:
+    command: List[str]
+    returncode: int
+    attempts: int = 1
+    timed_out: bool = False
+    duration: float = 0.0
+    # The last lines of output of the last attempt, stderr if there is any
+    output_tail: List[str] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return self.returncode == 0
+
+
+class MultipassCommandError(SystemExit):
+    """
+    A multipass command still failed after its retries. As a SystemExit with the exit code of the command, an
+    uncaught failure ends crashtest like before, while the callers that can recover catch it and get the result.
+    """
+
+    def __init__(self, result: CommandResult):
+        super().__init__(result.returncode)
+        self.result = result
+
+
+def stream_output(stream, output, tail: deque, log_file, log_lock: threading.Lock, byte_count: List[int]) -> None:
+    """
+    Print the lines of a process stream as soon as they arrive, keeping only the last ones in memory
+    """
+    for line in stream:
+        byte_count[0] += len(line.encode())
+        output.write(line)
+        output.flush()
+        tail.append(line)
+        if log_file:
+            with log_lock:
+                log_file.write(line)
+
+
+def run_in_session(instance_name: str, arguments: List[str], tail: deque, log_file, byte_count: List[int],
+                   timeout: Optional[float] = None) -> Tuple[int, bool]:
+    """
+    Run a command in the persistent session of an instance, printing its output like stream_output
+    :param timeout: the seconds after which the session is killed, no limit if None
+    :return: the exit code of the command and whether it timed out
+    """
+    def on_line(line: str) -> None:
+        byte_count[0] += len(line.encode())
+        sys.stdout.write(line)
+        sys.stdout.flush()
+        tail.append(line)
+        if log_file:
+            log_file.write(line)
+
+    session = get_session(instance_name)
+    timer = threading.Timer(timeout, session.process.kill) if timeout else None
+    if timer:
+        timer.start()
+    try:
+        returncode = session.run(arguments, on_line=on_line)
+    finally:
+        if timer:
+            timer.cancel()
+
+    timed_out = timer is not None and timer.finished.is_set() and not session.alive()
+    return (TIMEOUT_EXIT_CODE if timed_out else returncode), timed_out
+
+
+def write_input(stream, input_writer: Callable[[BinaryIO], int], input_bytes: List[int]) -> None:
+    """
+    Write the input of a process with input_writer, then close its stdin so that the process sees the end of it
+    """
+    try:
+        input_bytes[0] += input_writer(stream.buffer)
+    except BrokenPipeError:
+        # The process exited early, its exit code reports the error
+        pass
+    finally:
+        try:
+            stream.close()
+        except BrokenPipeError:
+            pass
+
+
+def run_process(command: List[str], stdout_tail: deque, stderr_tail: deque, log_file, byte_count: List[int],
+                timeout: Optional[float] = None, input_writer: Optional[Callable[[BinaryIO], int]] = None,
+                input_bytes: Optional[List[int]] = None) -> Tuple[int, bool]:
+    """
+    Run a command in its own session, so that it can be killed with all its child processes on timeout or Ctrl-C
+    :param timeout: the seconds after which the command is killed, no limit if None
+    :param input_writer: writes the stdin of the command and returns the bytes written, no stdin if None
+    :param input_bytes: the bytes written by input_writer are added to it
+    :return: the exit code of the command and whether it timed out
+    """
+    log_lock = threading.Lock()
+    stderr_bytes: List[int] = [0]
+    process = subprocess.Popen(command, stdin=subprocess.PIPE if input_writer else None, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, text=True, errors="replace", bufsize=1,
+                               start_new_session=True)
+    track_process_group(process.pid)
+    threads = [
+        threading.Thread(target=stream_output,
+                         args=(process.stdout, sys.stdout, stdout_tail, log_file, log_lock, byte_count)),
+        threading.Thread(target=stream_output,
+                         args=(process.stderr, sys.stderr, stderr_tail, log_file, log_lock, stderr_bytes)),
+    ]
+    if input_writer:
+        threads.append(threading.Thread(target=write_input, args=(process.stdin, input_writer,
+                                                                  input_bytes if input_bytes is not None else [0])))
+    for thread in threads:
+        thread.start()
+
+    timed_out = False
+    try:
+        returncode = process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        kill_process_group(process.pid)
+        process.wait()
+        returncode = TIMEOUT_EXIT_CODE
+        timed_out = True
+    finally:
+        untrack_process_group(process.pid)
+
+    for thread in threads:
+        thread.join()
+    # The readers hit the end of the pipes, stdin is closed by write_input
+    process.stdout.close()
+    process.stderr.close()
+    byte_count[0] += stderr_bytes[0]
+
+    return returncode, timed_out
+
+
+def launch_target(command: List[str]) -> Optional[str]:
+    """
+    :return: the name of the instance created by a multipass launch command, None for the other commands
+    """
+    if command_phase(command) == "launch" and "--name" in command:
+        return command[command.index("--name") + 1]
+    return None
+
+
+def prepare_retry(command: List[str], output_tail: List[str]) -> bool:
+    """
+    Clean up after a failed attempt: a failed launch may leave a broken instance behind, which would make the next
+    launch fail because the name is taken. A launch that failed because the instance already existed created nothing:
+    it is not retried and the instance, that crashtest did not create, is kept.
+    :param command: the multipass command that failed
+    :param output_tail: the last lines of the output of the failed attempt
+    :return: Bool: True if the command should be retried
+    """
+    instance_name = launch_target(command)
+    if not instance_name:
+        return True
+    if any(ALREADY_EXISTS_ERROR in line for line in output_tail):
+        return False
+
+    subprocess.run(["multipass", "delete", "--purge", instance_name], stdout=subprocess.DEVNULL,
+                   stderr=subprocess.DEVNULL)
+    invalidate_instances_cache()
+    return True
+
+
+def run_attempt(command: List[str], timeout: Optional[float],
+                input_writer: Optional[Callable[[BinaryIO], int]] = None) -> Tuple[int, bool, List[str]]:
+    """
+    Run a command once, streaming its output
+    :param input_writer: writes the stdin of the command and returns the bytes written, no stdin if None
+    :return: the exit code, whether the command timed out and the last lines of its output (stderr if any)
+    """
+    stdout_tail: deque = deque(maxlen=TAIL_LINES)
+    stderr_tail: deque = deque(maxlen=TAIL_LINES)
+    output_bytes: List[int] = [0]
+    input_bytes: List[int] = [0]
+    start = time.perf_counter()
+
+    with open(log_file_path, "a") if log_file_path else nullcontext() as log_file:
+        if log_file:
+            log_file.write(f"$ {' '.join(command)}\n")
+
+        # A session reads the commands from its stdin, so a command with an input needs its own process
+        translated = session_arguments(command) if persistent_sessions and input_writer is None else None
+        if translated:
+            # The session merges stderr in stdout
+            instance_name, arguments = translated
+            returncode, timed_out = run_in_session(instance_name, arguments, stdout_tail, log_file, output_bytes,
+                                                   timeout=timeout)
+        else:
+            returncode, timed_out = run_process(command, stdout_tail, stderr_tail, log_file, output_bytes,
+                                                timeout=timeout, input_writer=input_writer, input_bytes=input_bytes)
+
+    recorder.record(name=" ".join(command), category="multipass", start=start, end=time.perf_counter(),
+                    returncode=returncode, bytes_in=input_bytes[0], bytes_out=output_bytes[0])
+
+    if len(command) > 1 and command[1] in STATE_CHANGING_COMMANDS:
+        invalidate_instances_cache()
+        # The shell of a stopped, restarted or deleted instance is gone
+        if command[1] in SESSION_ENDING_COMMANDS:
+            for instance_name in command[2:]:
+                close_session(instance_name)
+
+    return returncode, timed_out, list(stderr_tail or stdout_tail)
+
+
+def run_multipass_command(command: List[str], policy: Optional[CommandPolicy] = None,
+                          input_writer: Optional[Callable[[BinaryIO], int]] = None) -> CommandResult:
+    """
+    Executes a multipass command and streams its output, killing the attempts that exceed the timeout of the
+    command and retrying the failed ones after a jittered backoff
+    :param command: the Multipass command to execute
+    :param policy: the timeout and retries, the policy of the multipass subcommand if None
+    :param input_writer: writes the stdin of every attempt and returns the bytes written, no stdin if None
+    :return: the result of the last attempt
+    """
+    policy = policy or get_policy(command)
+    start = time.perf_counter()
+    attempt = 0
+    while True:
+        returncode, timed_out, output_tail = run_attempt(command, timeout=policy.timeout, input_writer=input_writer)
+        if returncode == 0 or attempt >= policy.retries or not prepare_retry(command, output_tail):
+            break
+
+        delay = backoff_delay(attempt)
+        failure = f"timed out after {policy.timeout:g}s" if timed_out else f"failed with exit code {returncode}"
+        print(f"{Fore.YELLOW}multipass {command_phase(command)} {failure}, retrying in {delay:.1f}s "
+              f"({attempt + 1}/{policy.retries})...{Style.RESET_ALL}")
+        time.sleep(delay)
+        attempt += 1
+
+    return CommandResult(command=command, returncode=returncode, attempts=attempt + 1, timed_out=timed_out,
+                         duration=time.perf_counter() - start, output_tail=output_tail)
+
+
+def execute_multipass_command(command, policy: Optional[CommandPolicy] = None) -> CommandResult:
+    """
+    Executes a specified multipass command, streams its output and prints possible errors
+    :param command: the Multipass command to execute
+    :param policy: the timeout and retries, the policy of the multipass subcommand if None
+    :return: the result of the command
+    :raise MultipassCommandError: if the command still failed after its retries
+    """
+    policy = policy or get_policy(command)
+    result = run_multipass_command(command, policy=policy)
+
+    if not result.ok:
+        timeout_message = f"timed out after {policy.timeout:g}s\n" if result.timed_out else ""
+        print(
+            f"{log_error(error_code=crash_test.error_codes.MULTIPASS_GENERIC_ERROR)}{timeout_message}"
+            f"{''.join(result.output_tail)}{Style.RESET_ALL}"
+        )
+        raise MultipassCommandError(result)
+
+    return result
+
+
+def launch_command(instance_name: str, image: str = None, cpus: int = None, memory: str = None,
+                   disk: str = None, cloud_init: str = None) -> List[str]:
+    """
+    Build the multipass launch command for an instance
+    :param instance_name: the name of the multipass instance
+    :param image: the image to launch (the multipass default image if None)
+    :param cpus: the number of CPUs to allocate
+    :param memory: the amount of memory to allocate (e.g. 1G)
+    :param disk: the disk space to allocate (e.g. 5G)
+    :param cloud_init: the path to a cloud-init user-data file
+    :return: the multipass launch command
+    """
+    command: List[str] = ["multipass", "launch", "--name", instance_name]
+    if cpus:
+        command += ["--cpus", str(cpus)]
+    if memory:
+        command += ["--memory", memory]
+    if disk:
+        command += ["--disk", disk]
+    if cloud_init:
+        command += ["--cloud-init", cloud_init]
+    if image:
+        command.append(image)
+
+    return command
+
+
+def query_multipass(command: List[str]) -> Optional[dict]:
+    """
+    Run a multipass command with a JSON output
+    :return: the parsed output or None if the command failed
+    """
+    start = time.perf_counter()
+    try:
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    except OSError:
+        return None
+    recorder.record(name=" ".join(command), category="multipass", start=start, end=time.perf_counter(),
+                    returncode=result.returncode, bytes_out=len(result.stdout))
+
+    if result.returncode != 0:
+        return None
+    try:
+        return json.loads(result.stdout)
+    except json.JSONDecodeError:
+        return None
+
+
+def invalidate_instances_cache() -> None:
+    global instances_cache
+    with instances_cache_lock:
+        instances_cache = None
+        instances_info_cache.clear()
+
+
+def list_instances() -> Optional[Dict[str, dict]]:
+    """
+    Get the multipass instances, running multipass list only once until an instance changes
+    :return: dict: the name and the multipass list entry (state, ipv4, release) of every instance, or None if
+    multipass list failed, a failed list is not cached
+    """
+    global instances_cache
+    with instances_cache_lock:
+        if instances_cache is None:
+            output = query_multipass(["multipass", "list", "--format", "json"])
+            if output is None:
+                return None
+            instances_cache = {instance["name"]: instance for instance in output.get("list", [])}
+        return instances_cache
+
+
+def instance_info(instance_name: str) -> Optional[dict]:
+    """
+    Get the details of an instance, running multipass info only once until an instance changes
+    :param instance_name: the name of the multipass instance
+    :return: dict: the multipass info entry (state, mounts, cpu_count...) or None if the instance does not exist
+    """
+    with instances_cache_lock:
+        if instance_name not in instances_info_cache:
+            output = query_multipass(["multipass", "info", instance_name, "--format", "json"]) or {}
+            instances_info_cache[instance_name] = output.get("info", {}).get(instance_name)
+        return instances_info_cache[instance_name]
+
+
+def instance_state(instance_name: str) -> Optional[str]:
+    """
+    Get the state of an instance
+    :param instance_name: the name of the multipass instance
+    :return: Running, Stopped, Suspended, Deleted... or None if the instance does not exist
+    """
+    return (list_instances() or {}).get(instance_name, {}).get("state")
+
+
+def instance_exists(instance_name: str) -> bool:
+    """
+    Check if a multipass instance exists and is not deleted
+    :param instance_name: the name of the multipass instance
+    :return: Bool: True if the instance exists
+    """
+    return instance_state(instance_name) not in (None, "Deleted")
+
+
+def is_mounted(instance_name: str, guest_path: str) -> bool:
+    """
+    Check if a host folder is already mounted at a path of the instance
+    :param instance_name: the name of the multipass instance
+    :param guest_path: the mount path in the instance
+    :return: Bool: True if something is mounted at the path
+    """
+    return guest_path in (instance_info(instance_name) or {}).get("mounts", {})
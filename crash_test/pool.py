@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Final, List, Optional
+
+from colorama import Fore, Style
+
+import crash_test.error_codes
+from crash_test.error_logger import log_error
+from crash_test.multipass import execute_multipass_command, launch_command, list_instances, instance_exists, \
+    MultipassCommandError, DEFAULT_CPUS, DEFAULT_MEMORY, DEFAULT_DISK
+from crash_test.utils import load_state, save_state, state_lock, parse_size, get_host_memory
+
+POOL_STATE_FILE: Final[str] = "pool.json"
+DEFAULT_IMAGE: Final[str] = "default"
+DEFAULT_POOL_SIZE: Final[int] = 1
+# A launching instance missing from multipass list for longer than this was left behind by an interrupted fill
+LAUNCH_GRACE_PERIOD: Final[int] = 15 * 60
+
+
+def pool_instance_name(image: str) -> str:
+    """
+    Generate a unique name for a pool instance of the specified image
+    :param image: the image of the pool instance
+    :return: a valid multipass instance name
+    """
+    image_slug = re.sub(r"[^a-z0-9]+", "-", image.lower()).strip("-")
+    return f"crashtest-pool-{image_slug}-{uuid.uuid4().hex[:6]}"
+
+
+def get_pool_state() -> dict:
+    state = load_state(POOL_STATE_FILE)
+    state.setdefault("config", {})
+    state.setdefault("limits", {})
+    state.setdefault("instances", [])
+    return state
+
+
+def get_pool_limits(state: dict) -> dict:
+    """
+    Get the host CPU and memory cap of the pool. Defaults to half of the host resources.
+    :param state: the pool state
+    :return: dict: the max_cpus and max_memory (in bytes) the pool instances may use
+    """
+    return {
+        "max_cpus": state["limits"].get("max_cpus") or max((os.cpu_count() or 2) // 2, 1),
+        "max_memory": state["limits"].get("max_memory") or get_host_memory() // 2,
+    }
+
+
+def get_pool_usage(state: dict) -> dict:
+    """
+    Sum the CPUs and memory allocated to all the pool instances, claimed ones included
+    :param state: the pool state
+    :return: dict: the used cpus and memory (in bytes)
+    """
+    return {
+        "cpus": sum(instance["cpus"] for instance in state["instances"]),
+        "memory": sum(parse_size(instance["memory"]) for instance in state["instances"]),
+    }
+
+
+def fits_in_limits(state: dict, cpus: int, memory: str) -> bool:
+    limits = get_pool_limits(state)
+    usage = get_pool_usage(state)
+
+    if usage["cpus"] + cpus > limits["max_cpus"]:
+        return False
+    if limits["max_memory"] and usage["memory"] + parse_size(memory) > limits["max_memory"]:
+        return False
+
+    return True
+
+
+def expire_instances(state: dict, existing: dict) -> None:
+    """
+    Forget the pool instances that no longer exist, so they are neither claimed nor counted toward the host cap
+    :param state: the pool state, updated in place
+    :param existing: the multipass instances listed by a successful multipass list
+    """
+    now = time.time()
+    state["instances"] = [
+        instance for instance in state["instances"]
+        if instance["name"] in existing
+        or (instance["status"] == "launching" and now - instance.get("created", now) < LAUNCH_GRACE_PERIOD)
+    ]
+
+
+def launch_pool_instance(instance: dict) -> bool:
+    image = None if instance["image"] == DEFAULT_IMAGE else instance["image"]
+    command = launch_command(instance_name=instance["name"], image=image, cpus=instance["cpus"],
+                             memory=instance["memory"], disk=instance["disk"])
+    try:
+        execute_multipass_command(command)
+    except MultipassCommandError:
+        return False
+
+    return True
+
+
+def fill_pool(image: str) -> None:
+    """
+    Launch the instances needed to bring the pool of the specified image back to its configured size
+    :param image: the image of the pool to fill
+    """
+    existing = list_instances()
+    with state_lock(POOL_STATE_FILE):
+        state = get_pool_state()
+        # A failed multipass list does not tell which instances are gone
+        if existing is not None:
+            expire_instances(state, existing=existing)
+        config = state["config"].get(image, {})
+        size = config.get("size", DEFAULT_POOL_SIZE)
+        cpus = config.get("cpus", DEFAULT_CPUS)
+        memory = config.get("memory", DEFAULT_MEMORY)
+        disk = config.get("disk", DEFAULT_DISK)
+
+        available = [instance for instance in state["instances"]
+                     if instance["image"] == image and instance["status"] in ("ready", "launching")]
+
+        new_instances: List[dict] = []
+        for _ in range(size - len(available)):
+            if not fits_in_limits(state, cpus=cpus, memory=memory):
+                print(log_error(error_code=crash_test.error_codes.POOL_LIMIT_REACHED_ERROR))
+                break
+
+            instance = {"name": pool_instance_name(image), "image": image, "cpus": cpus, "memory": memory,
+                        "disk": disk, "status": "launching", "alias": None, "created": time.time()}
+            state["instances"].append(instance)
+            new_instances.append(instance)
+
+        save_state(POOL_STATE_FILE, state)
+
+    if not new_instances:
+        return
+
+    print(f"{Fore.GREEN}Launching {len(new_instances)} pool instance(s) of {image}...\n{Style.RESET_ALL}")
+    with ThreadPoolExecutor(max_workers=len(new_instances)) as executor:
+        launched = dict(zip([instance["name"] for instance in new_instances],
+                            executor.map(launch_pool_instance, new_instances)))
+
+    with state_lock(POOL_STATE_FILE):
+        state = get_pool_state()
+        for instance in list(state["instances"]):
+            if instance["name"] in launched:
+                if launched[instance["name"]]:
+                    instance["status"] = "ready"
+                else:
+                    state["instances"].remove(instance)
+        save_state(POOL_STATE_FILE, state)
+
+
+def refill_in_background(image: str) -> None:
+    """
+    Spawn a detached crashtest process that refills the pool, so the CLI returns immediately
+    :param image: the image of the pool to refill
+    """
+    subprocess.Popen([sys.executable, "-m", "crash_test.crashtest", "pool", "fill", "--image", image],
+                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+
+
+def claim_instance(image: str, alias: str) -> Optional[str]:
+    """
+    Claim a ready pool instance of the specified image
+    :param image: the image of the instance
+    :param alias: the instance name requested by the user, recorded as a tag of the claimed instance
+    :return: the name of the claimed instance or None if the pool is empty
+    """
+    if list_instances() is None:
+        # The ready instances can not be checked, a new instance is launched instead
+        return None
+
+    with state_lock(POOL_STATE_FILE):
+        state = get_pool_state()
+        for instance in list(state["instances"]):
+            if instance["image"] != image or instance["status"] != "ready":
+                continue
+            if instance_exists(instance["name"]):
+                instance["status"] = "claimed"
+                instance["alias"] = alias
+                instance["claimed"] = time.time()
+                save_state(POOL_STATE_FILE, state)
+                return instance["name"]
+            # Deleted outside of crashtest
+            state["instances"].remove(instance)
+        save_state(POOL_STATE_FILE, state)
+
+    return None
+
+
+def release_instance(instance_name: str) -> Optional[str]:
+    """
+    Forget a claimed pool instance after it has been deleted
+    :param instance_name: the name of the deleted instance
+    :return: the image of the released instance or None if the instance does not belong to the pool
+    """
+    with state_lock(POOL_STATE_FILE):
+        state = get_pool_state()
+        for instance in state["instances"]:
+            if instance["name"] == instance_name:
+                state["instances"].remove(instance)
+                save_state(POOL_STATE_FILE, state)
+                return instance["image"]
+
+    return None
+
+
+def replace_instance(instance_name: str) -> None:
+    """
+    Release a claimed pool instance that is being deleted and refill its pool in the background
+    :param instance_name: the name of the deleted instance
+    """
+    pool_image = release_instance(instance_name)
+    if pool_image:
+        refill_in_background(pool_image)
+
+
+def drain_pool(image: Optional[str] = None) -> None:
+    """
+    Delete the ready instances of the pool. Claimed instances are left to their users.
+    :param image: only drain the pool of this image if specified
+    """
+    with state_lock(POOL_STATE_FILE):
+        state = get_pool_state()
+        drained = [instance for instance in state["instances"]
+                   if instance["status"] == "ready" and (image is None or instance["image"] == image)]
+        state["instances"] = [instance for instance in state["instances"] if instance not in drained]
+        save_state(POOL_STATE_FILE, state)
+
+    if drained:
+        subprocess.run(["multipass", "delete", "--purge"] + [instance["name"] for instance in drained])
+    print(f"{Fore.GREEN}{len(drained)} pool instance(s) deleted.{Style.RESET_ALL}")
+
+
+def pool_status() -> None:
+    """
+    Print the state of the pool of every image and the host resources it uses
+    """
+    state = get_pool_state()
+    images = sorted(set(state["config"]) | {instance["image"] for instance in state["instances"]})
+
+    print(f"{'IMAGE':<20}{'SIZE':>6}{'READY':>8}{'LAUNCHING':>11}{'CLAIMED':>9}")
+    for image in images:
+        statuses = [instance["status"] for instance in state["instances"] if instance["image"] == image]
+        size = state["config"].get(image, {}).get("size", DEFAULT_POOL_SIZE)
+        print(f"{image:<20}{size:>6}{statuses.count('ready'):>8}"
+              f"{statuses.count('launching'):>11}{statuses.count('claimed'):>9}")
+
+    limits = get_pool_limits(state)
+    usage = get_pool_usage(state)
+    print(f"\nCPUs: {usage['cpus']}/{limits['max_cpus']}  "
+          f"Memory: {usage['memory'] / 1024 ** 3:.1f}G/{limits['max_memory'] / 1024 ** 3:.1f}G")
+
+    for instance in state["instances"]:
+        if instance["status"] == "claimed":
+            print(f"{instance['name']} claimed as {instance['alias']}")
+
+
+def pool_args_parser(argv):
+    parser = argparse.ArgumentParser(
+        prog="crashtest pool",
+        description="Manage the pool of pre-launched multipass instances"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    fill_parser = subparsers.add_parser("fill", help="Launch instances until the pool reaches its size")
+    fill_parser.add_argument("--image", type=str, default=DEFAULT_IMAGE, help="Image of the pool instances")
+    fill_parser.add_argument("--size", type=int, help="Number of ready instances to keep for the image")
+    fill_parser.add_argument("--cpus", type=int, help="CPUs of each pool instance")
+    fill_parser.add_argument("--memory", type=str, help="Memory of each pool instance (e.g. 1G)")
+    fill_parser.add_argument("--disk", type=str, help="Disk space of each pool instance (e.g. 5G)")
+    fill_parser.add_argument("--max-cpus", type=int, help="Max CPUs used by all the pool instances")
+    fill_parser.add_argument("--max-memory", type=str, help="Max memory used by all the pool instances (e.g. 8G)")
+
+    subparsers.add_parser("status", help="Show the state of the pool")
+
+    drain_parser = subparsers.add_parser("drain", help="Delete the ready pool instances")
+    drain_parser.add_argument("--image", type=str, help="Only drain the pool of this image")
+
+    return parser.parse_args(argv)
+
+
+def pool_main(argv) -> None:
+    args = pool_args_parser(argv)
+
+    match args.command:
+        case "fill":
+            with state_lock(POOL_STATE_FILE):
+                state = get_pool_state()
+                config = state["config"].setdefault(args.image, {})
+                for key in ("size", "cpus", "memory", "disk"):
+                    if getattr(args, key) is not None:
+                        config[key] = getattr(args, key)
+                if args.max_cpus is not None:
+                    state["limits"]["max_cpus"] = args.max_cpus
+                if args.max_memory is not None:
+                    state["limits"]["max_memory"] = parse_size(args.max_memory)
+                save_state(POOL_STATE_FILE, state)
+            fill_pool(image=args.image)
+        case "status":
+            pool_status()
+        case "drain":
+            drain_pool(image=args.image)
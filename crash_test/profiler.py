@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+
+import csv
+import json
+import subprocess
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict, fields
+from typing import Dict, Final, List, Optional, Tuple
+
+from colorama import Fore, Style
+
+from crash_test.utils import percentile
+
+DEFAULT_SAMPLING_INTERVAL: Final[float] = 1.0
+# The percentiles printed for every metric
+PERCENTILES: Final[List[int]] = [50, 95]
+
+# Prints one line per interval with the raw counters of the guest: time, CPU jiffies (total, idle, iowait), CPUs, memory
+# (total, available), disk bytes (read, written) of the whole disks and tasks (running, total). The loop ends with a
+# broken pipe once the profiler stops reading. %.0f since the %d of mawk overflows at 2G.
+SAMPLING_SCRIPT: Final[str] = (
+    "while :; do "
+    "printf 'SAMPLE %s' \"$(date +%s.%N)\"; "
+    "awk '/^cpu /{printf \" %.0f %.0f %.0f\", $2+$3+$4+$5+$6+$7+$8+$9, $5, $6} /^cpu[0-9]/{n++} "
+    "END{printf \" %.0f\", n}' /proc/stat; "
+    "awk '/^MemTotal:/{t=$2} /^MemAvailable:/{a=$2} END{printf \" %.0f %.0f\", t*1024, a*1024}' /proc/meminfo; "
+    "awk '$3 ~ /^(sd[a-z]+|vd[a-z]+|xvd[a-z]+|nvme[0-9]+n[0-9]+)$/{r+=$6; w+=$10} "
+    "END{printf \" %.0f %.0f\", r*512, w*512}' /proc/diskstats; "
+    "awk '{split($4, tasks, \"/\"); printf \" %.0f %.0f\\n\", tasks[1], tasks[2]}' /proc/loadavg; "
+    "sleep {interval}; "
+    "done"
+)
+
+
+@dataclass
+class Sample:
+    time: float
+    cpu_percent: float
+    iowait_percent: float
+    memory_used: int
+    memory_total: int
+    disk_read_rate: float
+    disk_write_rate: float
+    running_tasks: int
+    tasks: int
+    cpus: int
+
+
+# The metrics summarized at the end of the run, with their unit
+SUMMARY_METRICS: Final[Dict[str, str]] = {
+    "cpu_percent": "%",
+    "iowait_percent": "%",
+    "memory_used": "bytes",
+    "disk_read_rate": "bytes/s",
+    "disk_write_rate": "bytes/s",
+    "running_tasks": "",
+    "tasks": "",
+}
+
+
+def sampling_command(instance_name: str, interval: float) -> List[str]:
+    return ["multipass", "exec", instance_name, "--", "bash", "-c",
+            SAMPLING_SCRIPT.replace("{interval}", f"{interval:g}")]
+
+
+def parse_counters(line: str) -> Optional[Tuple[float, ...]]:
+    """
+    Parse a line of the sampling script
+    :return: the raw counters or None if the line is not a sample
+    """
+    parts = line.split()
+    if len(parts) != 12 or parts[0] != "SAMPLE":
+        return None
+    try:
+        return tuple(float(part) for part in parts[1:])
+    except ValueError:
+        return None
+
+
+def build_sample(previous: Tuple[float, ...], current: Tuple[float, ...], origin: float) -> Sample:
+    """
+    Turn two consecutive raw counters into the usage of the guest over the interval between them
+    :param previous: the previous counters
+    :param current: the current counters
+    :param origin: the time of the first counters, the sample time is relative to it
+    :return: the sample
+    """
+    elapsed = max(current[0] - previous[0], 1e-6)
+    cpu_total = max(current[1] - previous[1], 1)
+    cpu_idle = current[2] - previous[2]
+    cpu_iowait = current[3] - previous[3]
+    cpus = max(int(current[4]), 1)
+
+    return Sample(
+        time=round(current[0] - origin, 3),
+        cpu_percent=round(100 * (cpu_total - cpu_idle - cpu_iowait) / cpu_total, 1),
+        iowait_percent=round(100 * cpu_iowait / cpu_total, 1),
+        memory_used=int(current[5] - current[6]),
+        memory_total=int(current[5]),
+        disk_read_rate=round((current[7] - previous[7]) / elapsed, 1),
+        disk_write_rate=round((current[8] - previous[8]) / elapsed, 1),
+        # The sampling script is counted
+        running_tasks=int(current[9]),
+        tasks=int(current[10]),
+        cpus=cpus,
+    )
+
+
+class GuestProfiler:
+    """
+    Samples the CPU, memory, disk I/O and tasks of an instance from /proc, through a single multipass exec that
+    prints the counters at every interval
+    """
+
+    def __init__(self, instance_name: str, interval: float = DEFAULT_SAMPLING_INTERVAL):
+        self.instance_name = instance_name
+        self.interval = interval
+        self.samples: List[Sample] = []
+        self.process: Optional[subprocess.Popen] = None
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self.process = subprocess.Popen(sampling_command(self.instance_name, self.interval), stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL, text=True, errors="replace", bufsize=1)
+        self.thread = threading.Thread(target=self.read_samples, daemon=True)
+        self.thread.start()
+
+    def read_samples(self) -> None:
+        origin = None
+        previous = None
+        for line in self.process.stdout:
+            current = parse_counters(line)
+            if current is None:
+                continue
+            if previous is not None:
+                self.samples.append(build_sample(previous, current, origin=origin))
+            else:
+                origin = current[0]
+            previous = current
+
+    def stop(self) -> List[Sample]:
+        """
+        Stop sampling
+        :return: the samples
+        """
+        if self.process:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+            self.thread.join()
+            self.process.stdout.close()
+
+        return self.samples
+
+
+def summarize(samples: List[Sample]) -> Dict[str, Dict[str, float]]:
+    """
+    Compute the peak, the mean and the percentiles of every metric
+    :return: dict: {metric: {"peak", "mean", "p50", "p95"}}
+    """
+    summary = {}
+    for metric in SUMMARY_METRICS:
+        values = [getattr(sample, metric) for sample in samples]
+        summary[metric] = {"peak": max(values, default=0), "mean": sum(values) / len(values) if values else 0}
+        for rank in PERCENTILES:
+            summary[metric][f"p{rank}"] = percentile(values, rank)
+
+    return summary
+
+
+def bottleneck(samples: List[Sample]) -> Optional[str]:
+    """
+    Guess what limited the script: the resource that was saturated for most of the run
+    :return: "memory", "I/O", "CPU", "single-CPU" or None if nothing was saturated
+    """
+    if not samples:
+        return None
+
+    summary = summarize(samples)
+    memory_total = max(sample.memory_total for sample in samples)
+    if memory_total and summary["memory_used"]["p95"] >= 0.9 * memory_total:
+        return "memory"
+    if summary["iowait_percent"]["p50"] >= 20:
+        return "I/O"
+    if summary["cpu_percent"]["p50"] >= 80:
+        return "CPU"
+    # A single-threaded script saturates one CPU only
+    cpus = max(sample.cpus for sample in samples)
+    if cpus > 1 and summary["cpu_percent"]["p50"] >= 80 / cpus:
+        return "single-CPU"
+
+    return None
+
+
+def format_metric(value: float, unit: str) -> str:
+    match unit:
+        case "bytes" | "bytes/s":
+            return f"{value / 1024 ** 2:.1f}M{'/s' if unit == 'bytes/s' else ''}"
+        case "%":
+            return f"{value:.1f}%"
+        case _:
+            return f"{value:.0f}"
+
+
+def print_profile(samples: List[Sample]) -> None:
+    """
+    Print the peak, mean and percentiles of every metric and the likely bottleneck
+    """
+    print(f"\n{Fore.GREEN}Guest profile ({len(samples)} samples):{Style.RESET_ALL}")
+    if not samples:
+        print(f"{Fore.YELLOW}The script ended before the first sample.{Style.RESET_ALL}\n")
+        return
+
+    summary = summarize(samples)
+    statistics = ["peak", "mean"] + [f"p{rank}" for rank in PERCENTILES]
+    print(f"{'METRIC':<18}" + "".join(f"{statistic.upper():>12}" for statistic in statistics))
+    for metric, unit in SUMMARY_METRICS.items():
+        print(f"{metric:<18}" + "".join(f"{format_metric(summary[metric][statistic], unit):>12}"
+                                        for statistic in statistics))
+
+    limit = bottleneck(samples)
+    print(f"\nThe script looks {limit}-bound.\n" if limit else "\nNo resource of the instance was saturated.\n")
+
+
+def write_profile(samples: List[Sample], path: str) -> None:
+    """
+    Write the time series of the samples, as JSON if the path ends with .json, otherwise as CSV
+    :param samples: the samples
+    :param path: the path to the output file
+    """
+    if path.endswith(".json"):
+        with open(path, "w") as profile_file:
+            json.dump({"summary": summarize(samples), "samples": [asdict(sample) for sample in samples]},
+                      profile_file, indent=2)
+        return
+
+    with open(path, "w", newline="") as profile_file:
+        writer = csv.DictWriter(profile_file, fieldnames=[field.name for field in fields(Sample)])
+        writer.writeheader()
+        writer.writerows(asdict(sample) for sample in samples)
+
+
+@contextmanager
+def profile_guest(instance_name: str, interval: float = DEFAULT_SAMPLING_INTERVAL, output_path: Optional[str] = None):
+    """
+    Profile the instance while the body runs, then print the profile and write the time series. The profile is
+    reported even if the body fails.
+    :param instance_name: the name of the multipass instance
+    :param interval: the seconds between two samples
+    :param output_path: the CSV or JSON file of the time series, if any
+    """
+    profiler = GuestProfiler(instance_name, interval=interval)
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        samples = profiler.stop()
+        print_profile(samples)
+        if output_path:
+            write_profile(samples, output_path)
+            print(f"{Fore.GREEN}Profile written to {output_path}{Style.RESET_ALL}\n")
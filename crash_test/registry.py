@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+import argparse
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Final, List, Optional
+
+from colorama import Fore, Style
+
+from crash_test.multipass import execute_multipass_command, run_multipass_command, list_instances, \
+    invalidate_instances_cache, MultipassCommandError
+from crash_test.pool import replace_instance
+from crash_test.session import close_session
+from crash_test.sync import forget_instance
+from crash_test.utils import load_state, save_state, state_lock, parse_duration, format_duration
+
+# The instances launched, cloned or claimed by crashtest, the ones crashtest gc may delete
+REGISTRY_STATE_FILE: Final[str] = "instances.json"
+DEFAULT_TTL: Final[str] = "24h"
+# The instances torn down at the same time
+MAX_TEARDOWN_WORKERS: Final[int] = 8
+
+
+def get_registry_state() -> dict:
+    state = load_state(REGISTRY_STATE_FILE)
+    state.setdefault("instances", {})
+    return state
+
+
+def register_instance(instance_name: str, project: Optional[str] = None, image: Optional[str] = None,
+                      launched: bool = True) -> None:
+    """
+    Record that crashtest owns an instance, or that it used it again
+    :param instance_name: the name of the multipass instance
+    :param project: the path to the project tested on the instance
+    :param image: the image of the instance
+    :param launched: whether crashtest launched or cloned the instance, an instance it did not create is only
+    recorded as used again if crashtest already owns it
+    """
+    with state_lock(REGISTRY_STATE_FILE):
+        state = get_registry_state()
+        if not launched and instance_name not in state["instances"]:
+            return
+        now = time.time()
+        instance = state["instances"].setdefault(instance_name, {"created": now})
+        instance.update({"last_used": now, "project": project, "image": image})
+        save_state(REGISTRY_STATE_FILE, state)
+
+
+def unregister_instance(instance_name: str) -> None:
+    with state_lock(REGISTRY_STATE_FILE):
+        state = get_registry_state()
+        if state["instances"].pop(instance_name, None) is not None:
+            save_state(REGISTRY_STATE_FILE, state)
+
+
+def expired_instances(ttl: float, instance_names: Optional[List[str]] = None) -> List[str]:
+    """
+    Find the crashtest instances that were not used for longer than the TTL, forgetting the instances that no longer
+    exist. Nothing is forgotten if multipass list failed.
+    :param ttl: the seconds after which an unused instance expires
+    :param instance_names: only consider these instances if specified
+    :return: the names of the expired instances, the least recently used first
+    """
+    existing = list_instances()
+    with state_lock(REGISTRY_STATE_FILE):
+        state = get_registry_state()
+        if existing is not None:
+            for instance_name in [name for name in state["instances"] if name not in existing]:
+                del state["instances"][instance_name]
+            save_state(REGISTRY_STATE_FILE, state)
+
+    now = time.time()
+    expired = [(instance["last_used"], instance_name) for instance_name, instance in state["instances"].items()
+               if now - instance["last_used"] >= ttl and (not instance_names or instance_name in instance_names)]
+
+    return [instance_name for _, instance_name in sorted(expired)]
+
+
+def teardown_instance(instance_name: str) -> bool:
+    """
+    Stop, delete and purge an instance, then forget everything crashtest knows about it
+    :param instance_name: the name of the multipass instance
+    :return: Bool: True if the instance was deleted
+    """
+    close_session(instance_name)
+    # The instance is deleted even if it could not be stopped (e.g. it is already stopped or deleted)
+    run_multipass_command(["multipass", "stop", instance_name])
+    try:
+        execute_multipass_command(["multipass", "delete", "--purge", instance_name])
+    except MultipassCommandError:
+        return False
+
+    forget_instance(instance_name)
+    unregister_instance(instance_name)
+    # Replaces a claimed pool instance
+    replace_instance(instance_name)
+
+    print(f"{Fore.GREEN}Instance {instance_name} deleted.{Style.RESET_ALL}")
+    return True
+
+
+def teardown_instances(instance_names: List[str]) -> int:
+    """
+    Tear down instances in parallel
+    :param instance_names: the names of the multipass instances
+    :return: the number of deleted instances
+    """
+    if not instance_names:
+        return 0
+
+    with ThreadPoolExecutor(max_workers=min(len(instance_names), MAX_TEARDOWN_WORKERS)) as executor:
+        deleted = sum(executor.map(teardown_instance, instance_names))
+    invalidate_instances_cache()
+
+    return deleted
+
+
+def teardown_in_background(instance_names: List[str]) -> None:
+    """
+    Spawn a detached crashtest process that tears down the instances, so the CLI returns immediately
+    :param instance_names: the names of the multipass instances
+    """
+    subprocess.Popen([sys.executable, "-m", "crash_test.crashtest", "gc", "--ttl", "0", *instance_names],
+                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+
+
+def collect_garbage(ttl: float, instance_names: Optional[List[str]] = None, detach: bool = False,
+                    dry_run: bool = False) -> None:
+    """
+    Delete the crashtest instances that were not used for longer than the TTL
+    :param ttl: the seconds after which an unused instance expires
+    :param instance_names: only collect these instances if specified
+    :param detach: tear down the instances in a background process
+    :param dry_run: only print the instances that would be deleted
+    """
+    expired = expired_instances(ttl, instance_names=instance_names)
+    if not expired:
+        print(f"{Fore.GREEN}No instance to delete.{Style.RESET_ALL}")
+        return
+
+    state = get_registry_state()
+    now = time.time()
+    for instance_name in expired:
+        print(f"{instance_name} unused for {format_duration(now - state['instances'][instance_name]['last_used'])}")
+
+    if dry_run:
+        return
+
+    if detach:
+        teardown_in_background(expired)
+        print(f"{Fore.GREEN}{len(expired)} instance(s) are being deleted in the background.{Style.RESET_ALL}")
+        return
+
+    deleted = teardown_instances(expired)
+    print(f"{Fore.GREEN}{deleted} instance(s) deleted.{Style.RESET_ALL}")
+
+
+def gc_args_parser(argv):
+    parser = argparse.ArgumentParser(
+        prog="crashtest gc",
+        description="Stop, delete and purge the instances created by crashtest that were not used for a while"
+    )
+    parser.add_argument("instances", nargs="*", help="Only collect these instances")
+    parser.add_argument("--ttl", type=parse_duration, default=DEFAULT_TTL,
+                        help=f"Delete the instances unused for this long (e.g. 30m, 12h, 7d, 0 for all). "
+                             f"Defaults to {DEFAULT_TTL}")
+    parser.add_argument("--detach-delete", action="store_true",
+                        help="Return immediately and delete the instances in the background")
+    parser.add_argument("--dry-run", action="store_true", help="Only list the instances that would be deleted")
+
+    return parser.parse_args(argv)
+
+
+def gc_main(argv) -> None:
+    args = gc_args_parser(argv)
+    collect_garbage(ttl=args.ttl, instance_names=args.instances, detach=args.detach_delete,
+                    dry_run=args.dry_run)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import random
+import signal
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+from typing import Dict, Final, List, Optional, Set, Tuple
+
+# The exit code of a command killed by its timeout, like timeout(1)
+TIMEOUT_EXIT_CODE: Final[int] = 124
+
+# The backoff before the nth retry is a random delay up to min(BACKOFF_CAP, BACKOFF_BASE * 2 ** n) seconds
+BACKOFF_BASE: Final[float] = 2.0
+BACKOFF_CAP: Final[float] = 30.0
+
+
+@dataclass(frozen=True)
+class CommandPolicy:
+    # The seconds an attempt may run before it is killed, no limit if None
+    timeout: Optional[float] = None
+    # The attempts made after the first one failed
+    retries: int = 0
+
+
+# The policy of every multipass command. The timeouts are opt-in (--timeout) since a slow mirror or a large project
+# may legitimately take hours. exec is never retried since the scripts it runs are not idempotent.
+DEFAULT_POLICIES: Final[Dict[str, CommandPolicy]] = {
+    "launch": CommandPolicy(retries=2),
+    "clone": CommandPolicy(retries=1),
+    "start": CommandPolicy(retries=2),
+    "restart": CommandPolicy(retries=2),
+    "recover": CommandPolicy(retries=1),
+    "transfer": CommandPolicy(retries=2),
+    "mount": CommandPolicy(retries=2),
+    "exec": CommandPolicy(),
+    "stop": CommandPolicy(retries=1),
+    "delete": CommandPolicy(retries=1),
+    # The wait for the dependencies installed at boot by cloud-init (--cloud-init), not a multipass subcommand
+    "provisioning": CommandPolicy(),
+}
+
+# The policies of this run, the defaults overridden by --timeout and --retries
+policies: Dict[str, CommandPolicy] = dict(DEFAULT_POLICIES)
+
+# The process groups of the running commands, killed on Ctrl-C and SIGTERM
+active_process_groups: Set[int] = set()
+active_process_groups_lock = threading.Lock()
+
+
+def command_phase(command: List[str]) -> Optional[str]:
+    """
+    :return: the multipass subcommand (launch, transfer, exec...) or None if the command is not a multipass command
+    """
+    if len(command) > 1 and os.path.basename(command[0]) == "multipass":
+        return command[1]
+    return None
+
+
+def phase_policy(phase: Optional[str]) -> CommandPolicy:
+    return policies.get(phase, CommandPolicy())
+
+
+def get_policy(command: List[str]) -> CommandPolicy:
+    return phase_policy(command_phase(command))
+
+
+def set_policy(phase: str, timeout: Optional[float] = None, retries: Optional[int] = None) -> None:
+    """
+    Override the timeout or the retries of a multipass command
+    :param phase: the multipass subcommand (e.g. launch)
+    :param timeout: the seconds an attempt may run, 0 for no limit
+    :param retries: the attempts made after the first one failed
+    """
+    policy = policies.get(phase, CommandPolicy())
+    if timeout is not None:
+        policy = replace(policy, timeout=timeout or None)
+    if retries is not None:
+        policy = replace(policy, retries=retries)
+    policies[phase] = policy
+
+
+def reset_policies() -> None:
+    policies.clear()
+    policies.update(DEFAULT_POLICIES)
+
+
+def phase_value(value: str) -> Tuple[str, float]:
+    """
+    Parse a PHASE=VALUE command-line option (e.g. launch=300)
+    """
+    phase, separator, number = value.partition("=")
+    if not separator or phase not in DEFAULT_POLICIES:
+        raise argparse.ArgumentTypeError(f"expected PHASE=VALUE with PHASE in {', '.join(DEFAULT_POLICIES)}")
+    try:
+        return phase, float(number)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{number} is not a number")
+
+
+def backoff_delay(retry: int) -> float:
+    """
+    Full jitter backoff: the concurrent runs that failed together do not retry together
+    :param retry: the number of the retry, from 0
+    :return: the seconds to wait before the retry
+    """
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** retry))
+
+
+def track_process_group(pid: int) -> None:
+    with active_process_groups_lock:
+        active_process_groups.add(pid)
+
+
+def untrack_process_group(pid: int) -> None:
+    with active_process_groups_lock:
+        active_process_groups.discard(pid)
+
+
+def kill_process_group(pid: int, signal_number: int = signal.SIGKILL if hasattr(signal, "SIGKILL")
+                       else signal.SIGTERM) -> None:
+    """
+    Kill a command started in its own session and all the processes it started
+    """
+    try:
+        if hasattr(os, "killpg"):
+            os.killpg(pid, signal_number)
+        else:
+            os.kill(pid, signal_number)
+    except OSError:
+        # The command already ended
+        pass
+
+
+def terminate_active_processes() -> None:
+    with active_process_groups_lock:
+        process_groups = list(active_process_groups)
+    for pid in process_groups:
+        kill_process_group(pid, signal.SIGTERM)
+
+
+@contextmanager
+def cancel_on_signals():
+    """
+    Kill the running commands on Ctrl-C and SIGTERM. They run in their own sessions, so the terminal does not send
+    them the Ctrl-C itself. Ctrl-C then raises KeyboardInterrupt and SIGTERM exits with 128 + the signal number.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def handle_signal(signal_number, _frame):
+        terminate_active_processes()
+        if signal_number == signal.SIGINT:
+            raise KeyboardInterrupt
+        raise SystemExit(128 + signal_number)
+
+    handled_signals = [signal.SIGINT] + ([signal.SIGTERM] if hasattr(signal, "SIGTERM") else [])
+    previous_handlers = {signal_number: signal.signal(signal_number, handle_signal)
+                         for signal_number in handled_signals}
+    try:
+        yield
+    finally:
+        for signal_number, handler in previous_handlers.items():
+            signal.signal(signal_number, handler)
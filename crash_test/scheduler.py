@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from colorama import Fore, Style
+
+from crash_test.timings import recorder
+
+
+@dataclass
+class Step:
+    name: str
+    action: Callable[[], None]
+    dependencies: List[str] = field(default_factory=list)
+    start: Optional[float] = None
+    end: Optional[float] = None
+
+    @property
+    def duration(self) -> float:
+        return (self.end or 0.0) - (self.start or 0.0)
+
+
+class StepScheduler:
+    """
+    Runs a DAG of provisioning steps, starting each step as soon as all its dependencies are done
+    """
+
+    def __init__(self):
+        self.steps: Dict[str, Step] = {}
+        self.start: Optional[float] = None
+        self.failed_step: Optional[str] = None
+
+    def add_step(self, name: str, action: Callable[[], None], dependencies: List[str] = None) -> None:
+        """
+        Register a step
+        :param name: the unique name of the step
+        :param action: the function that runs the step
+        :param dependencies: the names of the already registered steps that have to be done before this step starts
+        """
+        dependencies = dependencies or []
+        for dependency in dependencies:
+            if dependency not in self.steps:
+                raise ValueError(f"Unknown dependency {dependency} of step {name}")
+
+        self.steps[name] = Step(name=name, action=action, dependencies=dependencies)
+
+    def run_step(self, step: Step) -> None:
+        step.start = time.perf_counter()
+        try:
+            step.action()
+        finally:
+            step.end = time.perf_counter()
+            recorder.record(name=step.name, category="step", start=step.start, end=step.end)
+
+    def run(self) -> None:
+        """
+        Run all the steps. If a step fails, no new step is started and its exception is raised once the running
+        steps are done.
+        """
+        self.start = time.perf_counter()
+        pending: Dict[str, Step] = dict(self.steps)
+        done: set = set()
+
+        with ThreadPoolExecutor(max_workers=max(len(self.steps), 1)) as executor:
+            running = {}
+            while pending or running:
+                for step in list(pending.values()):
+                    if all(dependency in done for dependency in step.dependencies):
+                        running[executor.submit(self.run_step, step)] = step
+                        del pending[step.name]
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    step = running.pop(future)
+                    if future.exception() is not None:
+                        self.failed_step = step.name
+                        wait(running)
+                        raise future.exception()
+                    done.add(step.name)
+
+    def critical_path(self) -> List[Step]:
+        """
+        Follow back, from the last step to finish, the dependency that finished last before each step started
+        :return: the steps of the critical path, in execution order
+        """
+        finished_steps = [step for step in self.steps.values() if step.end is not None]
+        if not finished_steps:
+            return []
+
+        step = max(finished_steps, key=lambda finished_step: finished_step.end)
+        path = [step]
+        while step.dependencies:
+            step = max((self.steps[dependency] for dependency in step.dependencies),
+                       key=lambda dependency_step: dependency_step.end)
+            path.append(step)
+
+        return list(reversed(path))
+
+    def print_report(self) -> None:
+        print(f"\n{'STEP':<24}{'START':>9}{'DURATION':>10}")
+        for step in sorted(self.steps.values(), key=lambda registered_step: registered_step.start or 0.0):
+            if step.start is not None:
+                print(f"{step.name:<24}{step.start - self.start:>8.1f}s{step.duration:>9.1f}s")
+
+        critical_path = self.critical_path()
+        print(f"\n{Fore.GREEN}Critical path "
+              f"({sum(step.duration for step in critical_path):.1f}s): "
+              f"{' -> '.join(f'{step.name} ({step.duration:.1f}s)' for step in critical_path)}{Style.RESET_ALL}\n")
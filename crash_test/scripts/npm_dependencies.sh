@@ -4,19 +4,109 @@
 # Description:
 # This script updates the multipass instance, installs nvm and the latest version
 # of node and npm
+#
+# Usage: npm_dependencies.sh PROJECT_NAME [SUBPROJECT...]
+# The subproject folders, relative to the project, are installed in parallel, with npm ci
+# when they have a lock file.
+#
+# If CRASHTEST_CACHE points to the host cache mounted by crashtest, nvm, the
+# node archives and the npm packages are reused across runs and instances.
+# If CRASHTEST_OFFLINE is 1, nothing is downloaded and everything comes from the cache.
+#
+# If CRASHTEST_TOOLCHAIN_ONLY is 1, only nvm and node are installed and the instance
+# is marked as baked (crashtest bake). The instances cloned from a baked base skip
+# straight to the project dependencies.
 ###############################################################################
 
-printf "\nExecuting: sudo apt-get update\n"
-sudo apt-get update
+PROJECT_NAME=$1
+CACHE="${CRASHTEST_CACHE:-}"
+OFFLINE="${CRASHTEST_OFFLINE:-0}"
+TOOLCHAIN_ONLY="${CRASHTEST_TOOLCHAIN_ONLY:-0}"
+BAKED_MARKER="$HOME/.crashtest-baked/npm"
+export NVM_DIR="$HOME/.nvm"
 
-printf "\nExecuting: sudo apt-get upgrade -y\n"
-sudo apt-get upgrade -y
+if [ -n "$CACHE" ]; then
+  mkdir -p "$CACHE"/nvm/cache "$CACHE"/npm "$NVM_DIR"
+  export npm_config_cache="$CACHE"/npm
 
-# Install nvm
-printf "\nInstalling Node and Npm via nvm\n"
-curl -o- https://raw.githubusercontent.com/nvm-sh/nvm/v0.39.7/install.sh | bash
+  # nvm keeps the downloaded node archives in $NVM_DIR/.cache
+  ln -sfn "$CACHE"/nvm/cache "$NVM_DIR"/.cache
+fi
 
-# Install node lts and the latest version of npm
-nvm install --lts --latest-npm node
+if [ -f "$BAKED_MARKER" ]; then
+  printf "\nThe node toolchain was baked on %s, skipping nvm and node\n" "$(cat "$BAKED_MARKER")"
+  # shellcheck disable=SC1091
+  source "$NVM_DIR"/nvm.sh
+else
+  if [ "$OFFLINE" != "1" ]; then
+    printf "\nExecuting: sudo apt-get update\n"
+    sudo apt-get update
 
-npm install
\ No newline at end of file
+    printf "\nExecuting: sudo apt-get upgrade -y\n"
+    sudo apt-get upgrade -y
+  fi
+
+  # Install nvm
+  printf "\nInstalling Node and Npm via nvm\n"
+  if [ "$OFFLINE" = "1" ]; then
+    cp "$CACHE"/nvm/nvm.sh "$NVM_DIR"/nvm.sh
+  else
+    curl -o- https://raw.githubusercontent.com/nvm-sh/nvm/v0.39.7/install.sh | bash
+    if [ -n "$CACHE" ]; then
+      cp "$NVM_DIR"/nvm.sh "$CACHE"/nvm/nvm.sh
+    fi
+  fi
+
+  # shellcheck disable=SC1091
+  source "$NVM_DIR"/nvm.sh
+
+  # Install node lts and the latest version of npm
+  if [ "$OFFLINE" = "1" ]; then
+    nvm install --offline --lts
+  else
+    nvm install --lts --latest-npm node
+  fi
+fi
+
+# Mark the toolchain as baked, the project is installed by the instances cloned from this one
+if [ "$TOOLCHAIN_ONLY" = "1" ]; then
+  command -v npm > /dev/null || exit 1
+  mkdir -p "$(dirname "$BAKED_MARKER")" && date -u +%Y-%m-%dT%H:%M:%SZ > "$BAKED_MARKER"
+  exit 0
+fi
+
+# Install the dependencies of a subproject, from the lock file if there is one
+install_subproject() {
+  cd ./"$PROJECT_NAME"/"$1" || return 1
+
+  NPM_COMMAND=install
+  if [ -f package-lock.json ] || [ -f npm-shrinkwrap.json ]; then
+    NPM_COMMAND=ci
+  fi
+
+  if [ "$OFFLINE" = "1" ]; then
+    npm "$NPM_COMMAND" --offline
+  elif [ -n "$CACHE" ]; then
+    npm "$NPM_COMMAND" --prefer-offline
+  else
+    npm "$NPM_COMMAND"
+  fi
+}
+
+# The subprojects to install, relative to the project folder. Defaults to the project folder itself.
+shift
+SUBPROJECTS=("${@:-.}")
+
+# Install the subprojects in parallel, prefixing their output with their path
+set -o pipefail
+PIDS=()
+for SUBPROJECT in "${SUBPROJECTS[@]}"; do
+  (install_subproject "$SUBPROJECT") 2>&1 | sed -u "s|^|[$SUBPROJECT] |" &
+  PIDS+=($!)
+done
+
+STATUS=0
+for PID in "${PIDS[@]}"; do
+  wait "$PID" || STATUS=1
+done
+exit $STATUS
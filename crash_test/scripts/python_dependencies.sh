@@ -4,36 +4,125 @@
 # Description:
 # This script updates the multipass instance; installs python3, pip3 and python3 venv;
 # deletes any existing venv and creates a new one; installs all the dependencies from
-# requirements.txt
+# requirements.txt, or from pyproject.toml or setup.py
+#
+# Usage: python_dependencies.sh PROJECT_NAME [SUBPROJECT...]
+# Every subproject folder, relative to the project, gets its own venv and the subprojects
+# are installed in parallel.
+#
+# If CRASHTEST_CACHE points to the host cache mounted by crashtest, the .deb packages,
+# the apt package lists and the wheels are reused across runs and instances.
+# If CRASHTEST_OFFLINE is 1, nothing is downloaded and everything comes from the cache.
+#
+# If CRASHTEST_TOOLCHAIN_ONLY is 1, only the system packages are installed and the
+# instance is marked as baked (crashtest bake). The instances cloned from a baked base
+# skip straight to the project dependencies.
 #######################################################################################
 
 
 PROJECT_NAME=$1
+CACHE="${CRASHTEST_CACHE:-}"
+OFFLINE="${CRASHTEST_OFFLINE:-0}"
+TOOLCHAIN_ONLY="${CRASHTEST_TOOLCHAIN_ONLY:-0}"
+BAKED_MARKER="$HOME/.crashtest-baked/python"
 
-printf "\nExecuting: sudo apt-get update\n"
-sudo apt-get update
+if [ -n "$CACHE" ]; then
+  mkdir -p "$CACHE"/apt/archives "$CACHE"/apt/lists "$CACHE"/pip/http "$CACHE"/pip/wheelhouse
+  export PIP_CACHE_DIR="$CACHE"/pip/http
+fi
+
+if [ -f "$BAKED_MARKER" ]; then
+  printf "\nThe python toolchain was baked on %s, skipping the system packages\n" "$(cat "$BAKED_MARKER")"
+else
+  # Restore the cached apt package lists and .deb packages
+  if [ -n "$CACHE" ]; then
+    printf "\nRestoring the apt cache...\n"
+    # The mount is only readable by the default user, so the files are staged in /tmp for root
+    rm -rf /tmp/crashtest-apt && cp -r "$CACHE"/apt /tmp/crashtest-apt
+    sudo find /tmp/crashtest-apt/archives -name "*.deb" -exec cp {} /var/cache/apt/archives/ \;
+    if [ "$OFFLINE" = "1" ]; then
+      sudo find /tmp/crashtest-apt/lists -type f -exec cp {} /var/lib/apt/lists/ \;
+    fi
+  fi
+
+  if [ "$OFFLINE" != "1" ]; then
+    printf "\nExecuting: sudo apt-get update\n"
+    sudo apt-get update
 
-printf "\nExecuting: sudo apt-get upgrade -y\n"
-sudo apt-get upgrade -y
+    printf "\nExecuting: sudo apt-get upgrade -y\n"
+    sudo apt-get upgrade -y
+  fi
 
-# Install python3, pip3 and python3 venv
-printf "\nExecuting: sudo apt-get install python3 python3-pip python3-venv -y\n"
-sudo apt-get install python3 python3-pip python3-venv -y
+  # Install python3, pip3 and python3 venv
+  printf "\nExecuting: sudo apt-get install python3 python3-pip python3-venv -y\n"
+  sudo apt-get install python3 python3-pip python3-venv -y
+
+  # Save the apt package lists and .deb packages to the cache
+  if [ -n "$CACHE" ] && [ "$OFFLINE" != "1" ]; then
+    printf "\nSaving the apt cache...\n"
+    cp /var/cache/apt/archives/*.deb "$CACHE"/apt/archives/ 2>/dev/null
+    find /var/lib/apt/lists -maxdepth 1 -type f -name "*_*" -exec cp {} "$CACHE"/apt/lists/ \;
+  fi
+fi
 
-# Check if a venv already exists then deletes it
-if [ -d ./"$PROJECT_NAME"/ ]; then
-  rm -r ./"$PROJECT_NAME"/venv
+# Mark the toolchain as baked, the project is installed by the instances cloned from this one
+if [ "$TOOLCHAIN_ONLY" = "1" ]; then
+  python3 -m venv --help > /dev/null || exit 1
+  mkdir -p "$(dirname "$BAKED_MARKER")" && date -u +%Y-%m-%dT%H:%M:%SZ > "$BAKED_MARKER"
+  exit 0
 fi
 
-# Create a new python venv
-printf "\nCreating the venv...\n"
-python3 -m venv ./"$PROJECT_NAME"/venv
+# Create a venv for a subproject and install its dependencies from requirements.txt, or from pyproject.toml or
+# setup.py if there is no requirements.txt
+install_subproject() {
+  local SUBPROJECT_PATH=./"$PROJECT_NAME"/"$1"
+
+  # Check if a venv already exists then deletes it
+  if [ -d "$SUBPROJECT_PATH"/venv ]; then
+    rm -r "$SUBPROJECT_PATH"/venv
+  fi
+
+  # Create a new python venv
+  printf "\nCreating the venv...\n"
+  python3 -m venv "$SUBPROJECT_PATH"/venv
+
+  # Activate the python venv
+  printf "\nActivating the venv...\n"
+  # shellcheck disable=SC1091
+  source "$SUBPROJECT_PATH"/venv/bin/activate
+
+  printf "\nInstalling requirements...\n"
+  if [ -f "$SUBPROJECT_PATH"/requirements.txt ]; then
+    if [ -n "$CACHE" ]; then
+      # Build or download the wheels into the cache, then install only from the cache
+      if [ "$OFFLINE" != "1" ]; then
+        pip3 wheel -r "$SUBPROJECT_PATH"/requirements.txt -w "$CACHE"/pip/wheelhouse || return 1
+      fi
+      pip3 install --no-index --find-links "$CACHE"/pip/wheelhouse -r "$SUBPROJECT_PATH"/requirements.txt
+    else
+      pip3 install -r "$SUBPROJECT_PATH"/requirements.txt
+    fi
+  elif [ "$OFFLINE" = "1" ]; then
+    pip3 install --no-index --find-links "$CACHE"/pip/wheelhouse -e "$SUBPROJECT_PATH"
+  else
+    pip3 install -e "$SUBPROJECT_PATH"
+  fi
+}
+
+# The subprojects to install, relative to the project folder. Defaults to the project folder itself.
+shift
+SUBPROJECTS=("${@:-.}")
 
-# Activate the python venv
-printf "\nActivating the venv...\n"
-# shellcheck disable=SC1090
-source ./"$PROJECT_NAME"/venv/bin/activate
+# Install the subprojects in parallel, prefixing their output with their path
+set -o pipefail
+PIDS=()
+for SUBPROJECT in "${SUBPROJECTS[@]}"; do
+  (install_subproject "$SUBPROJECT") 2>&1 | sed -u "s|^|[$SUBPROJECT] |" &
+  PIDS+=($!)
+done
 
-# Install all the dependencies from requirements.txt
-printf "\nInstalling requirements...\n"
-pip3 install -r ./"$PROJECT_NAME"/requirements.txt
\ No newline at end of file
+STATUS=0
+for PID in "${PIDS[@]}"; do
+  wait "$PID" || STATUS=1
+done
+exit $STATUS
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+import base64
+import os
+import shlex
+import subprocess
+import threading
+import uuid
+from typing import Callable, Dict, Final, List, Optional
+
+from crash_test.retry import track_process_group, untrack_process_group
+
+# The largest file copied through a session, larger files go through multipass transfer. The file is passed base64
+# encoded (4/3 of its size) in a single bash -c argument, which Linux caps at 128K (MAX_ARG_STRLEN).
+MAX_SESSION_FILE_SIZE: Final[int] = 64 * 1024
+# The exit code of a command whose session ended before the command did
+SESSION_LOST_EXIT_CODE: Final[int] = 255
+
+
+class InstanceSession:
+    """
+    Long-lived shell in an instance that runs commands one after the other. The output of each command is followed
+    by a unique marker line holding its exit code, so a single multipass exec serves all the commands.
+    """
+
+    def __init__(self, instance_name: str):
+        self.instance_name = instance_name
+        self.lock = threading.Lock()
+        self.process = subprocess.Popen(["multipass", "exec", instance_name, "--", "bash", "--noprofile", "--norc"],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                        text=True, errors="replace", bufsize=1, start_new_session=True)
+        # Killed with the other running commands on Ctrl-C and SIGTERM
+        track_process_group(self.process.pid)
+
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def run(self, arguments: List[str], on_line: Callable[[str], None]) -> int:
+        """
+        Run a command in the session
+        :param arguments: the command and its arguments, as given to multipass exec
+        :param on_line: called with every line of output (stdout and stderr) of the command
+        :return: the exit code of the command
+        """
+        marker = f"__CRASHTEST_{uuid.uuid4().hex}__"
+        # The subshell keeps the session state (cwd, variables) from leaking between the commands and the command
+        # can not read the next ones from stdin
+        frame = f"( {shlex.join(arguments)} ) < /dev/null 2>&1; printf '%s %d\\n' {marker} $?\n"
+
+        with self.lock:
+            try:
+                self.process.stdin.write(frame)
+                self.process.stdin.flush()
+            except OSError:
+                return SESSION_LOST_EXIT_CODE
+
+            for line in self.process.stdout:
+                index = line.find(marker)
+                if index == -1:
+                    on_line(line)
+                    continue
+
+                # The output of the command may not end with a new line
+                if index:
+                    on_line(line[:index])
+                return int(line[index + len(marker):].split()[0])
+
+        return SESSION_LOST_EXIT_CODE
+
+    def close(self) -> None:
+        try:
+            self.process.stdin.write("exit\n")
+        except OSError:
+            pass
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.process.stdout.close()
+        untrack_process_group(self.process.pid)
+
+
+# The open sessions, one per instance
+sessions: Dict[str, InstanceSession] = {}
+sessions_lock = threading.Lock()
+
+
+def get_session(instance_name: str) -> InstanceSession:
+    """
+    Get the session of an instance, opening a new one if there is none or if it ended
+    """
+    with sessions_lock:
+        session = sessions.get(instance_name)
+        if session is None or not session.alive():
+            if session:
+                session.close()
+            session = sessions[instance_name] = InstanceSession(instance_name)
+        return session
+
+
+def close_session(instance_name: str) -> None:
+    with sessions_lock:
+        session = sessions.pop(instance_name, None)
+    if session:
+        session.close()
+
+
+def close_sessions() -> None:
+    for instance_name in list(sessions):
+        close_session(instance_name)
+
+
+def session_arguments(command: List[str]) -> Optional[tuple]:
+    """
+    Translate a multipass command that a session can run
+    :param command: the multipass command
+    :return: the instance name and the arguments to run in its session, or None if the command needs multipass
+    """
+    match command:
+        case ["multipass", "exec", instance_name, "--", *arguments] if arguments:
+            return instance_name, arguments
+        case ["multipass", "transfer", *options, source, destination] \
+                if set(options) <= {"-r", "--recursive"} and ":" in destination and os.path.isfile(source) \
+                and os.path.getsize(source) <= MAX_SESSION_FILE_SIZE:
+            instance_name, path = destination.split(":", 1)
+            if path.endswith("/"):
+                path += os.path.basename(source)
+            with open(source, "rb") as source_file:
+                content = base64.b64encode(source_file.read()).decode()
+            return instance_name, ["bash", "-c", f"printf %s {content} | base64 -d > {shlex.quote(path)}"]
+
+    return None
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import shutil
+from dataclasses import dataclass, field
+from typing import Final, Optional, Set
+
+from colorama import Fore, Style
+
+from crash_test.dependencies_checker import is_project_file, MANIFEST_FILES
+from crash_test.ignore import load_ignore_rules, walk_project
+from crash_test.multipass import DEFAULT_CPUS, DEFAULT_MEMORY, DEFAULT_DISK
+from crash_test.utils import get_available_memory, parse_size, format_size
+
+# The per-project configuration file, at the root of the project
+CONFIG_FILE: Final[str] = ".crashtest.json"
+
+LOCK_FILES: Final[Set[str]] = {"poetry.lock", "Pipfile.lock", "package-lock.json", "npm-shrinkwrap.json", "yarn.lock",
+                               "pnpm-lock.yaml"}
+
+# The memory the package manager of each ecosystem needs on top of the default memory
+ECOSYSTEM_MEMORY: Final[dict] = {"python": 512 * 1024 ** 2, "npm": 1024 ** 3}
+# The resolution and the extraction of the dependencies grow with the lock files: a 1M lock file pins about 2000
+# packages, which need about 2G of memory to install and 10G of disk once installed
+LOCK_FILE_MEMORY_FACTOR: Final[int] = 2048
+LOCK_FILE_DISK_FACTOR: Final[int] = 10240
+# The project is copied once and its build output takes about as much space
+PROJECT_DISK_FACTOR: Final[int] = 2
+MAX_CPUS: Final[int] = 8
+
+# The share of the free host resources an instance may take
+HOST_MEMORY_SHARE: Final[float] = 0.75
+HOST_DISK_SHARE: Final[float] = 0.5
+
+
+@dataclass
+class ProjectProfile:
+    size: int = 0
+    files: int = 0
+    # The folders holding dependency manifests, with their ecosystem
+    subprojects: Set[tuple] = field(default_factory=set)
+    lock_files_size: int = 0
+
+    @property
+    def ecosystems(self) -> Set[str]:
+        return {ecosystem for _, ecosystem in self.subprojects}
+
+
+@dataclass
+class InstanceSize:
+    cpus: Optional[int] = None
+    memory: Optional[str] = None
+    disk: Optional[str] = None
+
+    def __str__(self) -> str:
+        return (f"{self.cpus or DEFAULT_CPUS} CPUs, {self.memory or DEFAULT_MEMORY} memory, "
+                f"{self.disk or DEFAULT_DISK} disk")
+
+
+def profile_project(project_path: str) -> ProjectProfile:
+    """
+    Measure the project in a single walk: its size, its file count, its ecosystems and the size of its lock files.
+    The subprojects are the ones that get installed, a pyproject.toml that only configures tools is not one.
+    :param project_path: the path to the project
+    :return: the project profile
+    """
+    manifest_ecosystems = {manifest: ecosystem for ecosystem, manifests in MANIFEST_FILES.items()
+                           for manifest in manifests}
+    profile = ProjectProfile()
+
+    for relative_path, entry in walk_project(project_path, rules=load_ignore_rules(project_path)):
+        if not entry.is_file(follow_symlinks=False):
+            continue
+
+        size = entry.stat(follow_symlinks=False).st_size
+        profile.size += size
+        profile.files += 1
+        if entry.name in manifest_ecosystems and \
+                is_project_file(project_path, relative_path, project_type=manifest_ecosystems[entry.name]):
+            profile.subprojects.add((os.path.dirname(relative_path), manifest_ecosystems[entry.name]))
+        if entry.name in LOCK_FILES:
+            profile.lock_files_size += size
+
+    return profile
+
+
+def load_project_config(project_path: str) -> dict:
+    """
+    Load the per-project configuration
+    :param project_path: the path to the project
+    :return: the configuration or an empty dict if the project has none
+    """
+    try:
+        with open(os.path.join(project_path, CONFIG_FILE)) as config_file:
+            return json.load(config_file)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def size_instance(profile: ProjectProfile, host_cpus: int, host_memory: int, host_disk: int) -> InstanceSize:
+    """
+    Size an instance for the project, never below the multipass defaults and capped by the free host resources
+    :param profile: the project profile
+    :param host_cpus: the CPUs of the host
+    :param host_memory: the memory available on the host, in bytes
+    :param host_disk: the free disk space of the host, in bytes
+    :return: the instance size
+    """
+    # One CPU per subproject since they are installed in parallel, leaving one to the host
+    cpus = DEFAULT_CPUS + len(profile.subprojects) if profile.subprojects else DEFAULT_CPUS
+    cpus = min(cpus, MAX_CPUS, max(host_cpus - 1, DEFAULT_CPUS))
+
+    memory = parse_size(DEFAULT_MEMORY) + sum(ECOSYSTEM_MEMORY.get(ecosystem, 0) for ecosystem in profile.ecosystems)
+    memory += profile.lock_files_size * LOCK_FILE_MEMORY_FACTOR
+    memory = max(min(memory, int(host_memory * HOST_MEMORY_SHARE)), parse_size(DEFAULT_MEMORY))
+
+    disk = parse_size(DEFAULT_DISK) + profile.size * PROJECT_DISK_FACTOR
+    disk += profile.lock_files_size * LOCK_FILE_DISK_FACTOR
+    disk = max(min(disk, int(host_disk * HOST_DISK_SHARE)), parse_size(DEFAULT_DISK))
+
+    return InstanceSize(cpus=cpus, memory=format_size(memory), disk=format_size(disk))
+
+
+def resolve_instance_size(project_path: str, cpus: Optional[int] = None, memory: Optional[str] = None,
+                          disk: Optional[str] = None, auto_size: bool = True) -> InstanceSize:
+    """
+    Get the size of the instance of the project. The resources specified on the command line come first, then the
+    ones of the project configuration, then the ones sized from the project profile.
+    :param project_path: the path to the project
+    :param cpus: the CPUs specified on the command line
+    :param memory: the memory specified on the command line
+    :param disk: the disk space specified on the command line
+    :param auto_size: size the unspecified resources from the project profile instead of the multipass defaults
+    :return: the instance size, with None for the multipass defaults
+    """
+    config = load_project_config(project_path).get("resources", {})
+    size = InstanceSize()
+
+    if auto_size and not (cpus and memory and disk):
+        profile = profile_project(project_path)
+        size = size_instance(profile, host_cpus=os.cpu_count() or 1, host_memory=get_available_memory(),
+                             host_disk=shutil.disk_usage(os.path.expanduser("~")).free)
+        print(f"{Fore.GREEN}Sized the instance for {profile.files} files ({profile.size / 1024 ** 2:.1f}M), "
+              f"{', '.join(sorted(profile.ecosystems)) or 'no dependencies'} "
+              f"and {profile.lock_files_size / 1024:.0f}K of lock files: {size}\n{Style.RESET_ALL}")
+
+    return InstanceSize(cpus=cpus or config.get("cpus") or size.cpus,
+                        memory=memory or config.get("memory") or size.memory,
+                        disk=disk or config.get("disk") or size.disk)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+import hashlib
+import os
+import shlex
+import subprocess
+import time
+from typing import Final, List, Optional
+
+from colorama import Fore, Style
+
+from crash_test.dependencies_checker import find_subprojects, DEFAULT_MAX_DEPTH
+from crash_test.multipass import execute_multipass_command, instance_exists, invalidate_instances_cache, \
+    list_instances
+from crash_test.utils import load_state, save_state, state_lock
+
+SNAPSHOTS_STATE_FILE: Final[str] = "snapshots.json"
+# The snapshots kept, the least recently used ones are deleted beyond it
+MAX_SNAPSHOTS: Final[int] = 5
+# The folders where the installation scripts install the dependencies, kept when a restored project is cleaned
+DEPENDENCIES_FOLDERS: Final[List[str]] = ["venv", "node_modules"]
+
+
+def dependencies_fingerprint(project_path: str, script_paths: List[str], image: Optional[str],
+                             max_depth: Optional[int] = DEFAULT_MAX_DEPTH) -> Optional[str]:
+    """
+    Fingerprint the dependencies of a project: the project name, since the dependencies are installed in the project
+    folder of the instance, the manifests of the subprojects that are installed, the installation scripts and the image
+    :param project_path: the path to the project
+    :param script_paths: the paths to the dependencies installation scripts
+    :param image: the image of the instance
+    :param max_depth: the max folder depth of the installed subprojects (--manifest-depth), unlimited if None
+    :return: the sha256 fingerprint or None if the project has no supported manifest
+    """
+    manifests = [manifest for subproject in find_subprojects(project_path, max_depth=max_depth)
+                 for manifest in subproject.manifests]
+    if not manifests or not script_paths:
+        return None
+
+    project_name = os.path.basename(os.path.abspath(project_path))
+    fingerprint = hashlib.sha256(f"project:{project_name}\nimage:{image}\nmax_depth:{max_depth}\n".encode())
+    for name, file_path in ([(manifest, os.path.join(project_path, manifest)) for manifest in manifests] +
+                            [(os.path.basename(script_path), script_path) for script_path in sorted(script_paths)]):
+        with open(file_path, "rb") as file:
+            fingerprint.update(name.encode())
+            fingerprint.update(hashlib.sha256(file.read()).digest())
+
+    return fingerprint.hexdigest()
+
+
+def snapshot_instance_name(fingerprint: str) -> str:
+    return f"crashtest-deps-{fingerprint[:12]}"
+
+
+def find_snapshot(fingerprint: str) -> Optional[str]:
+    """
+    Find the stopped instance holding the dependencies of the fingerprint
+    :param fingerprint: the dependencies fingerprint
+    :return: the name of the snapshot instance or None if there is none
+    """
+    snapshot = load_state(SNAPSHOTS_STATE_FILE).get(fingerprint)
+    if snapshot and instance_exists(snapshot["instance"]):
+        return snapshot["instance"]
+
+    return None
+
+
+def clean_project_command(instance_name: str, project_name: str) -> List[str]:
+    """
+    :return: the command deleting the project files of a restored snapshot, except the installed dependencies, so
+    that the files deleted from the project since the snapshot do not come back with it
+    """
+    pruned = " -o ".join(f"-name {shlex.quote(folder)}" for folder in DEPENDENCIES_FOLDERS)
+    project_folder = shlex.quote(f"./{project_name}")
+    return ["multipass", "exec", instance_name, "--", "bash", "-c",
+            f"[ ! -d {project_folder} ] || find {project_folder} -mindepth 1 -type d \\( {pruned} \\) -prune "
+            f"-o ! -type d -exec rm -f {{}} +"]
+
+
+def restore_snapshot(snapshot_instance: str, instance_name: str, project_name: str) -> None:
+    """
+    Clone the snapshot instance into a new instance with the dependencies already installed
+    :param snapshot_instance: the name of the snapshot instance
+    :param instance_name: the name of the new instance
+    :param project_name: the name of the project folder in the instance
+    """
+    print(f"{Fore.GREEN}Restoring the dependencies snapshot {snapshot_instance}...\n{Style.RESET_ALL}")
+    execute_multipass_command(["multipass", "clone", snapshot_instance, "--name", instance_name])
+    execute_multipass_command(["multipass", "start", instance_name])
+    execute_multipass_command(clean_project_command(instance_name, project_name=project_name))
+
+    with state_lock(SNAPSHOTS_STATE_FILE):
+        state = load_state(SNAPSHOTS_STATE_FILE)
+        for snapshot in state.values():
+            if snapshot["instance"] == snapshot_instance:
+                snapshot["used"] = time.time()
+        save_state(SNAPSHOTS_STATE_FILE, state)
+    print(f"{Fore.GREEN}Instance {instance_name} restored successfully!\n{Style.RESET_ALL}")
+
+
+def evict_snapshots(max_snapshots: int = MAX_SNAPSHOTS) -> List[str]:
+    """
+    Delete the least recently used snapshots beyond max_snapshots, and forget the ones whose instance is gone,
+    unless multipass list failed
+    :return: the names of the deleted snapshot instances
+    """
+    listed = list_instances() is not None
+    with state_lock(SNAPSHOTS_STATE_FILE):
+        state = {fingerprint: snapshot for fingerprint, snapshot in load_state(SNAPSHOTS_STATE_FILE).items()
+                 if not listed or instance_exists(snapshot["instance"])}
+        least_recently_used = sorted(state, key=lambda fingerprint: state[fingerprint].get(
+            "used", state[fingerprint]["created"]))
+        evicted = [state.pop(fingerprint)["instance"]
+                   for fingerprint in least_recently_used[:max(len(state) - max_snapshots, 0)]]
+        save_state(SNAPSHOTS_STATE_FILE, state)
+
+    for snapshot_instance in evicted:
+        print(f"{Fore.GREEN}Deleting the least recently used snapshot {snapshot_instance}...{Style.RESET_ALL}")
+        subprocess.run(["multipass", "delete", "--purge", snapshot_instance], stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL)
+    if evicted:
+        invalidate_instances_cache()
+
+    return evicted
+
+
+def save_snapshot(instance_name: str, fingerprint: str, image: Optional[str]) -> None:
+    """
+    Clone an instance with freshly installed dependencies so later runs can restore it.
+    The instance has to be stopped to be cloned, so it is restarted afterwards.
+    :param instance_name: the name of the instance with the dependencies installed
+    :param fingerprint: the dependencies fingerprint
+    :param image: the image of the instance
+    """
+    snapshot_instance = snapshot_instance_name(fingerprint)
+    if instance_exists(snapshot_instance):
+        return
+
+    print(f"{Fore.GREEN}Saving the dependencies snapshot {snapshot_instance}...\n{Style.RESET_ALL}")
+    execute_multipass_command(["multipass", "stop", instance_name])
+    execute_multipass_command(["multipass", "clone", instance_name, "--name", snapshot_instance])
+    execute_multipass_command(["multipass", "start", instance_name])
+
+    with state_lock(SNAPSHOTS_STATE_FILE):
+        state = load_state(SNAPSHOTS_STATE_FILE)
+        state[fingerprint] = {"instance": snapshot_instance, "image": image, "created": time.time()}
+        save_state(SNAPSHOTS_STATE_FILE, state)
+    evict_snapshots()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+import glob
+import hashlib
+import os
+import posixpath
+from typing import Dict, Final, List, Optional, Tuple
+
+from colorama import Fore, Style
+
+from crash_test.ignore import IgnoreRule, walk_project
+from crash_test.multipass import execute_multipass_command
+from crash_test.utils import load_state, save_state, get_crashtest_home
+
+HASH_CHUNK_SIZE: Final[int] = 1024 * 1024
+# The max number of paths passed to a single multipass command
+COMMAND_BATCH_SIZE: Final[int] = 200
+
+
+def manifest_file_name(instance_name: str, project_path: str) -> str:
+    """
+    :return: the name of the manifest of a project in an instance, an instance can hold several projects. The
+    instance names can not contain dots, so the manifests of an instance are sync-INSTANCE.*.json
+    """
+    project_key = hashlib.sha256(os.path.abspath(project_path).encode()).hexdigest()[:16]
+    return f"sync-{instance_name}.{project_key}.json"
+
+
+def hash_file(file_path: str) -> str:
+    file_hash = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        while chunk := file.read(HASH_CHUNK_SIZE):
+            file_hash.update(chunk)
+
+    return file_hash.hexdigest()
+
+
+def scan_project(project_path: str, previous_manifest: Dict[str, dict] = None,
+                 rules: Optional[List[IgnoreRule]] = None) -> Dict[str, dict]:
+    """
+    Build the manifest of the project files. A file is only hashed again if its size or mtime changed
+    since the previous manifest.
+    :param project_path: the path to the project
+    :param previous_manifest: the manifest of the last sync
+    :param rules: the ignore rules of the transfer, every file is listed if None
+    :return: the manifest: {relative posix path: {"size", "mtime", "sha256"}}
+    """
+    previous_manifest = previous_manifest or {}
+    manifest: Dict[str, dict] = {}
+
+    for relative_path, entry in walk_project(project_path, rules=rules or []):
+        if entry.is_file(follow_symlinks=False):
+            stat = entry.stat(follow_symlinks=False)
+            previous = previous_manifest.get(relative_path)
+
+            if previous and previous["size"] == stat.st_size and previous["mtime"] == stat.st_mtime_ns:
+                file_hash = previous["sha256"]
+            else:
+                file_hash = hash_file(entry.path)
+
+            manifest[relative_path] = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "sha256": file_hash}
+
+    return manifest
+
+
+def diff_manifests(old_manifest: Dict[str, dict], new_manifest: Dict[str, dict]) -> Tuple[List[str], List[str]]:
+    """
+    Compare two manifests
+    :return: the added or changed files and the deleted files
+    """
+    changed = [path for path, entry in new_manifest.items()
+               if path not in old_manifest or old_manifest[path]["sha256"] != entry["sha256"]]
+    deleted = [path for path in old_manifest if path not in new_manifest]
+
+    return sorted(changed), sorted(deleted)
+
+
+def batches(items: List[str]):
+    for index in range(0, len(items), COMMAND_BATCH_SIZE):
+        yield items[index:index + COMMAND_BATCH_SIZE]
+
+
+def has_manifest(instance_name: str, project_path: str) -> bool:
+    return os.path.exists(os.path.join(get_crashtest_home(), manifest_file_name(instance_name, project_path)))
+
+
+def save_manifest(instance_name: str, project_path: str, rules: Optional[List[IgnoreRule]] = None) -> None:
+    """
+    Record the project files after a full transfer, so the next run can sync incrementally
+    :param rules: the ignore rules of the transfer, the ignored files are not in the instance
+    """
+    save_state(manifest_file_name(instance_name, project_path), scan_project(project_path, rules=rules))
+
+
+def forget_instance(instance_name: str) -> None:
+    """
+    Delete the sync manifests of a deleted instance
+    """
+    for manifest_path in glob.glob(os.path.join(glob.escape(get_crashtest_home()), f"sync-{instance_name}.*.json")):
+        os.remove(manifest_path)
+
+
+def sync_project(instance_name: str, project_path: str, project_name: str,
+                 rules: Optional[List[IgnoreRule]] = None) -> None:
+    """
+    Transfer only the added or changed files of the project to the instance and remove the deleted ones
+    :param instance_name: the name of the multipass instance
+    :param project_path: the path to the project
+    :param project_name: the name of the project folder in the instance
+    :param rules: the ignore rules of the transfer, every file is synced if None
+    """
+    old_manifest = load_state(manifest_file_name(instance_name, project_path))
+    new_manifest = scan_project(project_path, previous_manifest=old_manifest, rules=rules)
+    changed, deleted = diff_manifests(old_manifest, new_manifest)
+
+    changed_bytes = sum(new_manifest[path]["size"] for path in changed)
+    print(f"{Fore.GREEN}Syncing the project: {len(changed)} changed ({changed_bytes} bytes), {len(deleted)} deleted, "
+          f"{len(new_manifest) - len(changed)} unchanged\n{Style.RESET_ALL}")
+
+    for batch in batches([f"./{project_name}/{path}" for path in deleted]):
+        execute_multipass_command(["multipass", "exec", instance_name, "--", "rm", "-f", "--"] + batch)
+
+    files_by_directory: Dict[str, List[str]] = {}
+    for path in changed:
+        files_by_directory.setdefault(posixpath.dirname(path), []).append(path)
+
+    if files_by_directory:
+        directories = [f"./{project_name}/{directory}" for directory in files_by_directory]
+        for batch in batches(directories):
+            execute_multipass_command(["multipass", "exec", instance_name, "--", "mkdir", "-p", "--"] + batch)
+
+    for directory, paths in files_by_directory.items():
+        for batch in batches(paths):
+            sources = [os.path.join(project_path, *path.split("/")) for path in batch]
+            destination = posixpath.join(f"./{project_name}", directory, "")
+            execute_multipass_command(["multipass", "transfer"] + sources + [f"{instance_name}:{destination}"])
+
+    save_state(manifest_file_name(instance_name, project_path), new_manifest)
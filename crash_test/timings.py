@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import List, Optional
+
+from colorama import Fore, Style
+
+
+@dataclass
+class Timing:
+    name: str
+    category: str
+    start: float
+    end: float
+    returncode: Optional[int] = None
+    bytes_in: int = 0
+    bytes_out: int = 0
+    thread_id: int = 0
+    # The trace lane of a timing recorded by a concurrent matrix job (its instance name), the thread if None
+    lane: Optional[str] = None
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+class TimingRecorder:
+    """
+    Records the wall-clock time, exit code and byte counts of the multipass commands and of the provisioning steps
+    """
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.timings: List[Timing] = []
+        self.lock = threading.Lock()
+
+    def record(self, name: str, category: str, start: float, end: float, returncode: Optional[int] = None,
+               bytes_in: int = 0, bytes_out: int = 0, lane: Optional[str] = None) -> None:
+        """
+        Record a timing
+        :param name: the command or step name
+        :param category: "multipass" for the multipass commands, "step" for the provisioning steps
+        :param start: the time.perf_counter() value when the command or step started
+        :param end: the time.perf_counter() value when the command or step ended
+        :param returncode: the exit code of the command
+        :param bytes_in: the bytes sent to the command
+        :param bytes_out: the bytes of output of the command
+        :param lane: the trace lane of the command, the matrix jobs all run in the thread of the event loop
+        """
+        with self.lock:
+            self.timings.append(Timing(name=name, category=category, start=start, end=end, returncode=returncode,
+                                       bytes_in=bytes_in, bytes_out=bytes_out, thread_id=threading.get_ident(),
+                                       lane=lane))
+
+    def commands(self) -> List[Timing]:
+        return [timing for timing in self.timings if timing.category == "multipass"]
+
+    def print_summary(self) -> None:
+        commands = self.commands()
+        print(f"\n{Fore.GREEN}Timings:{Style.RESET_ALL}")
+        print(f"{'COMMAND':<60}{'EXIT':>6}{'DURATION':>11}{'BYTES IN':>12}{'BYTES OUT':>12}")
+        for timing in commands:
+            name = timing.name if len(timing.name) <= 58 else f"{timing.name[:55]}..."
+            print(f"{name:<60}{timing.returncode if timing.returncode is not None else '-':>6}"
+                  f"{timing.duration:>10.2f}s{timing.bytes_in:>12}{timing.bytes_out:>12}")
+
+        phases = {}
+        for timing in commands:
+            phase = timing.name.split()[1] if len(timing.name.split()) > 1 else timing.name
+            phases[phase] = phases.get(phase, 0.0) + timing.duration
+        print("\n" + "  ".join(f"{phase}: {duration:.2f}s" for phase, duration in phases.items()))
+        print(f"Total: {time.perf_counter() - self.origin:.2f}s\n")
+
+    def write_chrome_trace(self, path: str) -> None:
+        """
+        Write the timings as Chrome trace events, to be loaded in chrome://tracing or Perfetto. Every thread and
+        every matrix job gets its own track.
+        :param path: the path to the trace JSON file
+        """
+        threads = {}
+        events = []
+        for timing in self.timings:
+            lane = timing.lane or timing.thread_id
+            if lane not in threads:
+                threads[lane] = len(threads) + 1
+                if timing.lane:
+                    events.append({"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": threads[lane],
+                                   "args": {"name": timing.lane}})
+            events.append({
+                "name": timing.name,
+                "cat": timing.category,
+                "ph": "X",
+                "ts": round((timing.start - self.origin) * 1_000_000),
+                "dur": round(timing.duration * 1_000_000),
+                "pid": os.getpid(),
+                "tid": threads[lane],
+                "args": {"returncode": timing.returncode, "bytes_in": timing.bytes_in, "bytes_out": timing.bytes_out},
+            })
+
+        with open(path, "w") as trace_file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, trace_file, indent=1)
+
+
+# The recorder shared by all the crashtest modules
+recorder = TimingRecorder()
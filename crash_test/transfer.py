@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+import shlex
+import subprocess
+import tarfile
+from shutil import which
+from typing import BinaryIO, Callable, Final, List, Optional, Tuple
+
+from colorama import Fore, Style
+
+import crash_test.error_codes
+from crash_test.error_logger import log_error
+from crash_test.ignore import load_ignore_rules, walk_project
+from crash_test.multipass import run_multipass_command
+from crash_test.retry import get_policy
+
+COMPRESSIONS: Final[List[str]] = ["none", "gzip", "zstd"]
+
+# The tar options to extract the archive in the instance for each compression
+TAR_EXTRACT_OPTIONS: Final[dict] = {
+    "none": "",
+    "gzip": "-z",
+    "zstd": "--zstd",
+}
+
+
+class CountingWriter:
+    """
+    File-like wrapper that counts the bytes written to a stream
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.bytes_written = 0
+
+    def write(self, data) -> int:
+        self.stream.write(data)
+        self.bytes_written += len(data)
+        return len(data)
+
+    def flush(self) -> None:
+        self.stream.flush()
+
+
+def collect_files(project_path: str) -> List[Tuple[str, str, Optional[int]]]:
+    """
+    Collect the project files, symlinks and folders that are not ignored
+    :param project_path: the path to the project
+    :return: the list of (absolute path, relative posix path, size or None for folders) of the entries to transfer,
+    the symlinks have a size of 0
+    """
+    entries = []
+    for relative_path, entry in walk_project(project_path, rules=load_ignore_rules(project_path)):
+        if entry.is_symlink():
+            # Archived as a link, not as the file or the folder it points to
+            entries.append((entry.path, relative_path, 0))
+        elif entry.is_file(follow_symlinks=False):
+            entries.append((entry.path, relative_path, entry.stat(follow_symlinks=False).st_size))
+        elif entry.is_dir(follow_symlinks=False):
+            entries.append((entry.path, relative_path, None))
+
+    return entries
+
+
+def transfer_report(entries: List[Tuple[str, str, Optional[int]]]) -> str:
+    sizes = [size for _, _, size in entries if size is not None]
+    return f"{len(sizes)} files, {len(entries) - len(sizes)} folders, {sum(sizes) / 1024 ** 2:.2f} MiB"
+
+
+def archive_writer(entries: List[Tuple[str, str, Optional[int]]], compression: str) -> Callable[[BinaryIO], int]:
+    """
+    :return: a function writing the tar archive of the entries to a stream and returning the bytes of the archive
+    (before the zstd compression)
+    """
+    def write_archive(stream: BinaryIO) -> int:
+        compressor_process = None
+        archive_stream = stream
+        if compression == "zstd":
+            compressor_process = subprocess.Popen(["zstd", "-q", "-c", "-T0"], stdin=subprocess.PIPE, stdout=stream)
+            archive_stream = compressor_process.stdin
+
+        counting_writer = CountingWriter(archive_stream)
+        try:
+            with tarfile.open(fileobj=counting_writer, mode="w|gz" if compression == "gzip" else "w|") as archive:
+                for path, relative_path, _ in entries:
+                    archive.add(path, arcname=relative_path, recursive=False)
+        finally:
+            if compressor_process:
+                try:
+                    compressor_process.stdin.close()
+                except BrokenPipeError:
+                    pass
+                compressor_process.wait()
+
+        return counting_writer.bytes_written
+
+    return write_archive
+
+
+def stream_project(instance_name: str, project_path: str, project_name: str, compression: str = "gzip",
+                   entries: List[Tuple[str, str, Optional[int]]] = None) -> bool:
+    """
+    Stream the project as a single tar archive into tar -x in the instance, without a temporary archive on disk. The
+    stream has the timeout and the retries of the transfers.
+    :param instance_name: the name of the multipass instance
+    :param project_path: the path to the project
+    :param project_name: the name of the project folder in the instance
+    :param compression: none, gzip or zstd
+    :param entries: the entries returned by collect_files, collected now if None
+    :return: Bool: True if the project was transferred
+    """
+    if compression == "zstd" and which("zstd") is None:
+        print(f"{Fore.YELLOW}zstd is not installed, falling back to gzip.{Style.RESET_ALL}")
+        compression = "gzip"
+
+    if entries is None:
+        entries = collect_files(project_path)
+    print(f"{Fore.GREEN}Streaming {transfer_report(entries)} ({compression})...\n{Style.RESET_ALL}")
+
+    quoted_project_name = shlex.quote(f"./{project_name}")
+    extract_command = (f"mkdir -p {quoted_project_name} && "
+                       f"tar -x {TAR_EXTRACT_OPTIONS[compression]} -f - -C {quoted_project_name}")
+    policy = get_policy(["multipass", "transfer"])
+    result = run_multipass_command(["multipass", "exec", instance_name, "--", "bash", "-c", extract_command],
+                                   policy=policy, input_writer=archive_writer(entries, compression))
+    if not result.ok:
+        timeout_message = f"timed out after {policy.timeout:g}s\n" if result.timed_out else ""
+        print(f"{log_error(error_code=crash_test.error_codes.MULTIPASS_GENERIC_ERROR)}project stream transfer failed: "
+              f"{timeout_message}{''.join(result.output_tail)}{Style.RESET_ALL}")
+
+    return result.ok
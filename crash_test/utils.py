@@ -1,14 +1,26 @@
 #!/usr/bin/env python3
 
+import json
 import os
 import site
 import sys
+from contextlib import contextmanager
+from typing import Final, List
 
 from colorama import Fore, Style
 
 import crash_test.error_codes
 from crash_test.error_logger import log_error
 
+try:
+    import fcntl
+except ImportError:
+    # fcntl is not available on Windows
+    fcntl = None
+
+
+SCRIPT_RELATIVE_PATH: Final[str] = "crash_test/scripts"
+
 
 def get_scripts_absolute_path(relative_path):
     """
@@ -36,3 +48,154 @@ def check_script_path(script_path) -> bool:
         print(log_error(error_code=crash_test.error_codes.SCRIPT_FOLDER_NOT_FOUND_ERROR, script_path=script_path))
         print(f"{Fore.RED}𝙓 Can not install dependencies!{Style.RESET_ALL}\n")
         return False
+
+
+def get_crashtest_home() -> str:
+    """
+    Get the folder where crashtest keeps its state (pool, caches, history...)
+    :return: the absolute path to the crashtest home folder
+    """
+    crashtest_home = os.environ.get("CRASHTEST_HOME", os.path.join(os.path.expanduser("~"), ".crashtest"))
+    os.makedirs(crashtest_home, exist_ok=True)
+
+    return crashtest_home
+
+
+def load_state(file_name: str) -> dict:
+    """
+    Load a JSON state file from the crashtest home folder
+    :param file_name: the name of the state file
+    :return: the state or an empty dict if the file does not exist or is corrupted
+    """
+    state_path = os.path.join(get_crashtest_home(), file_name)
+    try:
+        with open(state_path, "r") as state_file:
+            return json.load(state_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(file_name: str, state: dict) -> None:
+    """
+    Atomically write a JSON state file to the crashtest home folder
+    :param file_name: the name of the state file
+    :param state: the state to save
+    """
+    state_path = os.path.join(get_crashtest_home(), file_name)
+    tmp_state_path = f"{state_path}.{os.getpid()}.tmp"
+    with open(tmp_state_path, "w") as state_file:
+        json.dump(state, state_file, indent=2)
+    os.replace(tmp_state_path, state_path)
+
+
+@contextmanager
+def state_lock(file_name: str):
+    """
+    Serialize the read-modify-write cycles on a state file between crashtest processes
+    :param file_name: the name of the state file to lock
+    """
+    lock_path = os.path.join(get_crashtest_home(), f"{file_name}.lock")
+    with open(lock_path, "w") as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def parse_size(size: str) -> int:
+    """
+    Convert a multipass size (e.g. 512M, 1G, 10G) to bytes
+    :param size: the size with an optional K, M or G suffix
+    :return: the size in bytes
+    """
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    size = str(size).strip().upper().removesuffix("B")
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+
+    return int(size)
+
+
+def get_host_memory() -> int:
+    """
+    Get the total physical memory of the host
+    :return: the memory in bytes or 0 if it can not be determined
+    """
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return 0
+
+
+def format_size(size: int) -> str:
+    """
+    Convert bytes to a multipass size, rounded down to the mebibyte
+    :param size: the size in bytes
+    :return: the size with a M or G suffix (e.g. 1536M, 4G)
+    """
+    mebibytes = size // 1024 ** 2
+    if mebibytes and mebibytes % 1024 == 0:
+        return f"{mebibytes // 1024}G"
+
+    return f"{mebibytes}M"
+
+
+def parse_duration(duration: str) -> float:
+    """
+    Convert a duration (e.g. 90, 30s, 15m, 12h, 7d) to seconds
+    :param duration: the duration with an optional s, m, h or d suffix
+    :return: the duration in seconds
+    """
+    units = {"S": 1, "M": 60, "H": 3600, "D": 86400}
+    duration = str(duration).strip().upper()
+    if duration and duration[-1] in units:
+        return float(duration[:-1]) * units[duration[-1]]
+
+    return float(duration)
+
+
+def format_duration(seconds: float) -> str:
+    """
+    Convert seconds to the largest whole unit (e.g. 45s, 12m, 3h, 2d)
+    """
+    for unit, unit_seconds in (("d", 86400), ("h", 3600), ("m", 60)):
+        if seconds >= unit_seconds:
+            return f"{int(seconds // unit_seconds)}{unit}"
+
+    return f"{int(seconds)}s"
+
+
+def percentile(values: List[float], rank: float) -> float:
+    """
+    Compute a percentile with a linear interpolation between the closest values
+    :param values: the values, in any order
+    :param rank: the percentile, between 0 and 100
+    :return: the percentile or 0 if there are no values
+    """
+    if not values:
+        return 0.0
+
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * rank / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def get_available_memory() -> int:
+    """
+    Get the memory of the host available to new processes, without swapping
+    :return: the memory in bytes, half of the physical memory if it can not be read from /proc/meminfo
+    """
+    try:
+        with open("/proc/meminfo") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    return get_host_memory() // 2
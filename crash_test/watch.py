@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+import shlex
+import subprocess
+import threading
+import time
+from typing import Callable, Dict, Final, List, Optional, Tuple
+
+from colorama import Fore, Style
+
+from crash_test.ignore import IgnoreRule, walk_project
+
+# The seconds between two scans of the project
+POLL_INTERVAL: Final[float] = 0.5
+DEFAULT_DEBOUNCE: Final[float] = 0.5
+# The file of the instance holding the process group of the running script, relative to the home folder
+WATCH_PID_FILE: Final[str] = ".crashtest-watch.pid"
+# The seconds between two attempts to stop a script that is not started yet
+CANCEL_RETRY_INTERVAL: Final[float] = 1.0
+
+
+def snapshot_project(project_path: str, rules: List[IgnoreRule]) -> Dict[str, Tuple[int, int]]:
+    """
+    Record the size and the mtime of every project file that is not ignored
+    :return: dict: {relative posix path: (size, mtime in nanoseconds)}
+    """
+    snapshot = {}
+    for relative_path, entry in walk_project(project_path, rules=rules):
+        if entry.is_file(follow_symlinks=False):
+            stat = entry.stat(follow_symlinks=False)
+            snapshot[relative_path] = (stat.st_size, stat.st_mtime_ns)
+
+    return snapshot
+
+
+def changed_paths(old_snapshot: Dict[str, Tuple[int, int]], new_snapshot: Dict[str, Tuple[int, int]]) -> List[str]:
+    """
+    :return: the added, changed and deleted files, sorted
+    """
+    return sorted(path for path in old_snapshot.keys() | new_snapshot.keys()
+                  if old_snapshot.get(path) != new_snapshot.get(path))
+
+
+class ProjectWatcher:
+    """
+    Poll the project for changes. The changes are batched until the project stays untouched for the debounce
+    window, so saving several files (or a formatter rewriting them) triggers a single run.
+    """
+
+    def __init__(self, project_path: str, rules: List[IgnoreRule], debounce: float = DEFAULT_DEBOUNCE,
+                 interval: float = POLL_INTERVAL):
+        self.project_path = project_path
+        self.rules = rules
+        self.debounce = debounce
+        self.interval = interval
+        self.snapshot = snapshot_project(project_path, rules=rules)
+
+    def poll(self) -> List[str]:
+        """
+        Scan the project once
+        :return: the files changed since the last scan
+        """
+        new_snapshot = snapshot_project(self.project_path, rules=self.rules)
+        changes = changed_paths(self.snapshot, new_snapshot)
+        self.snapshot = new_snapshot
+        return changes
+
+    def wait_for_changes(self, timeout: Optional[float] = None) -> List[str]:
+        """
+        Wait until the project changes, then until it stays untouched for the debounce window
+        :param timeout: the max seconds to wait for a first change, forever if None
+        :return: the files changed, empty if the timeout expired
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        changes = self.poll()
+        while not changes:
+            if deadline is not None and time.monotonic() >= deadline:
+                return []
+            time.sleep(self.interval)
+            changes = self.poll()
+
+        batch = set(changes)
+        while changes:
+            time.sleep(self.debounce)
+            changes = self.poll()
+            batch.update(changes)
+
+        return sorted(batch)
+
+
+def cancellable_command(arguments: List[str]) -> List[str]:
+    """
+    Wrap a command run with multipass exec so it runs in its own process group, recorded in the pid file, and can
+    be stopped with all its child processes
+    :param arguments: the command and its arguments
+    :return: the wrapped command, which exits with the exit code of the command
+    """
+    return ["bash", "-c", f"setsid {shlex.join(arguments)} & echo $! > {WATCH_PID_FILE}; wait $!"]
+
+
+def cancel_command(instance_name: str) -> List[str]:
+    return ["multipass", "exec", instance_name, "--", "bash", "-c",
+            f"[ -f {WATCH_PID_FILE} ] && kill -TERM -- -$(cat {WATCH_PID_FILE}) 2> /dev/null; rm -f {WATCH_PID_FILE}"]
+
+
+class WatchedRun:
+    """
+    Run of the custom script in the background, so the watcher can cancel it when the project changes again
+    """
+
+    def __init__(self, instance_name: str, target: Callable[[], None]):
+        self.instance_name = instance_name
+        self.returncode: Optional[int] = None
+        self.cancelled = False
+        self.start = time.perf_counter()
+        self.thread = threading.Thread(target=self.run_target, args=(target,), daemon=True)
+        self.thread.start()
+
+    def run_target(self, target: Callable[[], None]) -> None:
+        # The multipass commands exit on error
+        try:
+            target()
+            self.returncode = 0
+        except SystemExit as error:
+            self.returncode = error.code if isinstance(error.code, int) else 1
+
+        if not self.cancelled:
+            duration = time.perf_counter() - self.start
+            if self.returncode == 0:
+                print(f"{Fore.GREEN}✓ The script passed in {duration:.1f}s, watching for changes...{Style.RESET_ALL}")
+            else:
+                print(f"{Fore.RED}𝙓 The script failed with exit code {self.returncode} in {duration:.1f}s, watching "
+                      f"for changes...{Style.RESET_ALL}")
+
+    def running(self) -> bool:
+        return self.thread.is_alive()
+
+    def cancel(self) -> None:
+        """
+        Stop the script and its child processes in the instance and wait for the run to end
+        """
+        if not self.running():
+            return
+
+        self.cancelled = True
+        print(f"{Fore.YELLOW}Cancelling the running script...{Style.RESET_ALL}")
+        # The script may not have started yet (e.g. it is still transferred)
+        while self.running():
+            subprocess.run(cancel_command(self.instance_name), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            self.thread.join(timeout=CANCEL_RETRY_INTERVAL)
+
+    def wait(self) -> None:
+        self.thread.join()
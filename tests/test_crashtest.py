@@ -1,5 +1,14 @@
 import argparse
+import base64
+import io
+import json
+import os
+import socketserver
 import subprocess
+import sys
+import tarfile
+import threading
+import time
 from unittest.mock import patch
 
 import pytest
@@ -8,10 +17,43 @@ from colorama import Fore, Style
 import crash_test.error_codes
 from crash_test.args_checker import instance_name_check, project_check, arguments_check
 from crash_test.crashtest import CrashTest, args_parser
-from crash_test.dependencies_checker import check_dependencies, find_requirements_file
+from crash_test.cloud_init import build_user_data, split_boot_scripts, wait_for_provisioning, READY_MARKER, \
+    CLOUD_INIT_LOG
+from crash_test.bake import script_ecosystem, base_instance_name, base_expired, ensure_base, restore_base, \
+    toolchain_fingerprint, bake_main
+from crash_test.cache import get_cache_path, cache_environment, GUEST_CACHE_PATH
+from crash_test.collect import parse_artifacts, select_artifacts, extract_artifacts, Artifact
+from crash_test.daemon import AdmissionQueue, DaemonServer, admission
+from crash_test.dependencies_checker import check_dependencies, find_requirements_file, find_subprojects, \
+    check_subprojects_dependencies, Subproject
 from crash_test.error_logger import log_error
+from crash_test.mount import choose_transfer_mode, mount_project_commands
+from crash_test.multipass import execute_multipass_command, set_log_file, list_instances, instance_exists, \
+    invalidate_instances_cache, set_persistent_sessions, run_multipass_command, MultipassCommandError, CommandResult
+from crash_test.matrix import parse_profile, build_jobs, run_matrix, MatrixJob, Profile
+from crash_test.pool import claim_instance, release_instance, fill_pool, pool_instance_name, get_pool_state, \
+    expire_instances, replace_instance
+from crash_test.profiler import build_sample, summarize, bottleneck, write_profile, profile_guest, Sample
+from crash_test.retry import CommandPolicy, get_policy, phase_policy, set_policy, reset_policies, phase_value, \
+    backoff_delay, track_process_group, untrack_process_group, terminate_active_processes, active_process_groups
+from crash_test.registry import register_instance, expired_instances, collect_garbage, get_registry_state, gc_main
+from crash_test.scheduler import StepScheduler
 from crash_test.script_selector import script_selector
-from crash_test.utils import get_scripts_absolute_path, check_script_path
+from crash_test.session import InstanceSession, get_session, close_sessions, session_arguments, \
+    MAX_SESSION_FILE_SIZE, SESSION_LOST_EXIT_CODE
+from crash_test.sizing import profile_project, size_instance, resolve_instance_size, ProjectProfile
+from crash_test.snapshots import dependencies_fingerprint, find_snapshot, clean_project_command, evict_snapshots, \
+    SNAPSHOTS_STATE_FILE
+from crash_test.headless import should_teardown, run_status, build_result, INVALID_ARGUMENTS_EXIT_CODE
+from crash_test.history import record_run, phase_statistics, find_regressions, aggregate_phases, stats_main
+from crash_test.ignore import load_ignore_rules, is_ignored
+from crash_test.timings import recorder, TimingRecorder, Timing
+from crash_test.transfer import collect_files, stream_project
+from crash_test.sync import scan_project, diff_manifests, sync_project, save_manifest, has_manifest, \
+    forget_instance
+from crash_test.watch import ProjectWatcher, WatchedRun, cancellable_command
+from crash_test.utils import get_scripts_absolute_path, check_script_path, parse_size, save_state, format_size, \
+    parse_duration, format_duration, percentile, load_state
 
 
 @pytest.fixture
@@ -23,6 +65,43 @@ def mock_multipass_command_execution():
         yield mock_subprocess_run
 
 
+@pytest.fixture
+def crashtest_home(tmp_path, monkeypatch):
+    """
+    Points the crashtest state folder to a temporary folder
+    """
+    home = tmp_path / "crashtest_home"
+    monkeypatch.setenv("CRASHTEST_HOME", str(home))
+    yield home
+
+
+@pytest.fixture
+def fake_multipass(tmp_path, monkeypatch):
+    """
+    Puts on PATH a multipass stand-in that runs `multipass exec INSTANCE -- COMMAND` in a local guest folder
+    """
+    bin_path = tmp_path / "bin"
+    bin_path.mkdir()
+    guest_path = tmp_path / "guest"
+    guest_path.mkdir()
+
+    fake_multipass_path = bin_path / "multipass"
+    fake_multipass_path.write_text('#!/bin/sh\nshift 3\ncd "$FAKE_GUEST" && exec "$@"\n')
+    fake_multipass_path.chmod(0o755)
+
+    monkeypatch.setenv("PATH", f"{bin_path}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("FAKE_GUEST", str(guest_path))
+    yield guest_path
+
+
+def make_crashtest(*argv) -> CrashTest:
+    """
+    Creates a CrashTest from command-line arguments
+    """
+    with patch.object(sys, "argv", ["crashtest", *argv]):
+        return CrashTest(args=args_parser())
+
+
 class TestArgsCheck:
     def test_instance_name_check_valid(self):
         """
@@ -199,6 +278,55 @@ class TestDependenciesCheck:
         project_type = find_requirements_file(project_path="non_existent_project")
         assert project_type is None
 
+    def test_find_requirements_file_ignores_folders_named_like_manifests(self, tmp_path):
+        tmp_project_path = tmp_path / "test_project"
+        (tmp_project_path / "requirements.txt").mkdir(parents=True)
+
+        assert find_requirements_file(project_path=tmp_project_path) is None
+
+    def test_find_subprojects_in_monorepo(self, tmp_path):
+        tmp_project_path = tmp_path / "test_project"
+        for manifest in ["pyproject.toml", "poetry.lock", "services/api/requirements.txt",
+                         "services/web/package.json", "services/web/package-lock.json",
+                         "services/web/node_modules/left-pad/package.json", "docs/yarn.lock",
+                         "a/b/c/d/e/setup.py"]:
+            (tmp_project_path / manifest).parent.mkdir(parents=True, exist_ok=True)
+            (tmp_project_path / manifest).write_text("[project]\nname = 'test'\n")
+
+        subprojects = find_subprojects(str(tmp_project_path))
+
+        assert [(subproject.path, subproject.project_type) for subproject in subprojects] == [
+            (".", "python"), ("services/api", "python"), ("services/web", "npm")
+        ]
+        assert sorted(subprojects[0].manifests) == ["poetry.lock", "pyproject.toml"]
+        assert find_subprojects(str(tmp_project_path), max_depth=None)[1].path == "a/b/c/d/e"
+
+    def test_find_subprojects_ignores_tool_only_pyproject(self, tmp_path):
+        tmp_project_path = tmp_path / "test_project"
+        tmp_project_path.mkdir()
+        (tmp_project_path / "package.json").write_text("{}")
+        (tmp_project_path / "pyproject.toml").write_text("[tool.black]\nline-length = 120\n")
+
+        assert [(subproject.path, subproject.project_type)
+                for subproject in find_subprojects(str(tmp_project_path))] == [(".", "npm")]
+        assert find_requirements_file(project_path=tmp_project_path) == "npm"
+
+    def test_check_subprojects_dependencies_groups_by_script(self, tmp_path):
+        tmp_project_path = tmp_path / "test_project"
+        for manifest in ["api/requirements.txt", "worker/pyproject.toml", "web/package.json"]:
+            (tmp_project_path / manifest).parent.mkdir(parents=True, exist_ok=True)
+            (tmp_project_path / manifest).write_text("[build-system]\nrequires = ['setuptools']\n")
+        tmp_script_relative_path = tmp_path / "test_script_path"
+        tmp_script_relative_path.mkdir()
+
+        scripts = check_subprojects_dependencies(project_path=str(tmp_project_path),
+                                                 scripts_relative_path=tmp_script_relative_path)
+
+        assert {os.path.basename(script_path): [subproject.path for subproject in subprojects]
+                for script_path, subprojects in scripts.items()} == {
+            "python_dependencies.sh": ["api", "worker"], "npm_dependencies.sh": ["web"]
+        }
+
 
 class TestErrorLogger:
     def test_log_error_returns_error_message(self):
@@ -212,7 +340,9 @@ class TestErrorLogger:
                        crash_test.error_codes.MULTIPASS_NOT_INSTALLED_ERROR,
                        crash_test.error_codes.INVALID_INSTANCE_NAME_ERROR,
                        crash_test.error_codes.NO_SUPPORTED_REQUIREMENTS_FILE_FOUND_ERROR,
-                       crash_test.error_codes.SCRIPT_FOLDER_NOT_FOUND_ERROR
+                       crash_test.error_codes.SCRIPT_FOLDER_NOT_FOUND_ERROR,
+                       crash_test.error_codes.POOL_LIMIT_REACHED_ERROR,
+                       crash_test.error_codes.DAEMON_NOT_RUNNING_ERROR
                        ]
 
         test_path = "test/path"
@@ -251,6 +381,12 @@ class TestErrorLogger:
                                 script_path=test_path
                             ) == f"crashtest: error: cannot access {test_path}: No such file or directory."
                     )
+                case crash_test.error_codes.POOL_LIMIT_REACHED_ERROR:
+                    assert "cap reached" in log_error(error_code=crash_test.error_codes.POOL_LIMIT_REACHED_ERROR)
+                case crash_test.error_codes.DAEMON_NOT_RUNNING_ERROR:
+                    assert log_error(
+                        error_code=crash_test.error_codes.DAEMON_NOT_RUNNING_ERROR, socket_path=test_path
+                    ) == f"crashtest: error: cannot connect to the crashtest daemon at {test_path}."
 
 
 class TestUtils:
@@ -265,6 +401,198 @@ class TestUtils:
     def test_check_scripts_path_doesnt_exist(self):
         assert check_script_path(script_path="non_existent_path") is False
 
+    def test_parse_size(self):
+        assert parse_size("512M") == 512 * 1024 ** 2
+        assert parse_size("1G") == 1024 ** 3
+        assert parse_size("2048") == 2048
+
+    def test_parse_and_format_duration(self):
+        assert parse_duration("90") == 90
+        assert parse_duration("15m") == 900
+        assert parse_duration("2d") == 172800
+        assert format_duration(45) == "45s"
+        assert format_duration(7300) == "2h"
+
+    def test_percentile(self):
+        assert percentile([4, 1, 3, 2], 50) == 2.5
+        assert percentile([1, 2, 3, 4, 5], 95) == pytest.approx(4.8)
+        assert percentile([], 99) == 0
+
+
+class TestPool:
+    def test_pool_instance_name_is_valid(self):
+        assert instance_name_check(pool_instance_name("ubuntu:22.04")) is True
+
+    def test_claim_instance_empty_pool(self, crashtest_home):
+        assert claim_instance(image="default", alias="test-instance") is None
+
+    def test_claim_and_release_instance(self, crashtest_home):
+        save_state("pool.json", {"instances": [
+            {"name": "crashtest-pool-default-1", "image": "default", "cpus": 1, "memory": "1G", "disk": "5G",
+             "status": "ready", "alias": None}
+        ]})
+
+        with patch("crash_test.pool.list_instances", return_value={"crashtest-pool-default-1": {}}), \
+                patch("crash_test.pool.instance_exists", return_value=True):
+            assert claim_instance(image="22.04", alias="test-instance") is None
+            assert claim_instance(image="default", alias="test-instance") == "crashtest-pool-default-1"
+            assert claim_instance(image="default", alias="test-instance") is None
+        assert get_pool_state()["instances"][0]["alias"] == "test-instance"
+
+        assert release_instance("crashtest-pool-default-1") == "default"
+        assert get_pool_state()["instances"] == []
+
+    def test_claim_instance_skips_deleted_instances(self, crashtest_home):
+        save_state("pool.json", {"instances": [
+            {"name": f"crashtest-pool-default-{index}", "image": "default", "cpus": 1, "memory": "1G", "disk": "5G",
+             "status": "ready", "alias": None} for index in range(2)
+        ]})
+
+        with patch("crash_test.pool.list_instances", return_value=None):
+            assert claim_instance(image="default", alias="test-instance") is None
+        assert len(get_pool_state()["instances"]) == 2
+
+        with patch("crash_test.pool.list_instances", return_value={"crashtest-pool-default-1": {}}), \
+                patch("crash_test.pool.instance_exists", side_effect=lambda name: name.endswith("-1")):
+            assert claim_instance(image="default", alias="test-instance") == "crashtest-pool-default-1"
+        assert [instance["name"] for instance in get_pool_state()["instances"]] == ["crashtest-pool-default-1"]
+
+    def test_fill_pool_respects_host_cap(self, crashtest_home):
+        save_state("pool.json", {"config": {"default": {"size": 3, "cpus": 2, "memory": "1G"}},
+                                 "limits": {"max_cpus": 4, "max_memory": parse_size("16G")}})
+
+        with patch("crash_test.pool.list_instances", return_value={}), \
+                patch("crash_test.pool.execute_multipass_command") as mock_execute_multipass_command:
+            fill_pool(image="default")
+
+        instances = get_pool_state()["instances"]
+        assert len(instances) == 2
+        assert all(instance["status"] == "ready" for instance in instances)
+        assert mock_execute_multipass_command.call_count == 2
+
+    def test_fill_pool_forgets_failed_launches(self, crashtest_home):
+        save_state("pool.json", {"config": {"default": {"size": 1, "cpus": 1, "memory": "1G"}},
+                                 "limits": {"max_cpus": 4, "max_memory": parse_size("16G")}})
+        failed = MultipassCommandError(CommandResult(command=["multipass", "launch"], returncode=2))
+
+        with patch("crash_test.pool.list_instances", return_value={}), \
+                patch("crash_test.pool.execute_multipass_command", side_effect=failed):
+            fill_pool(image="default")
+
+        assert get_pool_state()["instances"] == []
+
+    def test_fill_pool_forgets_deleted_claimed_instances(self, crashtest_home):
+        save_state("pool.json", {"config": {"default": {"size": 1, "cpus": 2, "memory": "1G"}},
+                                 "limits": {"max_cpus": 2, "max_memory": parse_size("16G")},
+                                 "instances": [{"name": "crashtest-pool-default-1", "image": "default", "cpus": 2,
+                                                "memory": "1G", "disk": "5G", "status": "claimed",
+                                                "alias": "test-instance", "created": time.time()}]})
+
+        with patch("crash_test.pool.execute_multipass_command") as mock_execute_multipass_command:
+            with patch("crash_test.pool.list_instances", return_value=None):
+                fill_pool(image="default")
+            assert mock_execute_multipass_command.call_count == 0
+
+            with patch("crash_test.pool.list_instances", return_value={}):
+                fill_pool(image="default")
+
+        instances = get_pool_state()["instances"]
+        assert len(instances) == 1 and instances[0]["status"] == "ready"
+        assert instances[0]["name"] != "crashtest-pool-default-1"
+
+    def test_expire_instances(self):
+        now = time.time()
+        state = {"instances": [
+            {"name": "ready", "status": "ready", "created": now - 7200},
+            {"name": "deleted-ready", "status": "ready", "created": now - 7200},
+            {"name": "claimed", "status": "claimed", "created": now - 7200},
+            {"name": "deleted", "status": "claimed", "created": now - 7200},
+            {"name": "launching", "status": "launching", "created": now - 60},
+            {"name": "interrupted", "status": "launching", "created": now - 7200},
+        ]}
+
+        expire_instances(state, existing={"ready": {}, "claimed": {}})
+
+        assert [instance["name"] for instance in state["instances"]] == ["ready", "claimed", "launching"]
+
+    def test_replace_instance(self, crashtest_home):
+        save_state("pool.json", {"instances": [
+            {"name": "crashtest-pool-default-1", "image": "default", "cpus": 1, "memory": "1G", "disk": "5G",
+             "status": "claimed", "alias": "test-instance"}
+        ]})
+
+        with patch("crash_test.pool.refill_in_background") as refill:
+            replace_instance("test-instance")
+            refill.assert_not_called()
+            replace_instance("crashtest-pool-default-1")
+            refill.assert_called_once_with("default")
+
+        assert get_pool_state()["instances"] == []
+
+
+class TestRegistry:
+    def test_expired_instances(self, crashtest_home):
+        now = time.time()
+        save_state("instances.json", {"instances": {
+            "old-instance": {"created": now - 7200, "last_used": now - 7200},
+            "recent-instance": {"created": now - 7200, "last_used": now - 60},
+            "gone-instance": {"created": now - 7200, "last_used": now - 7200},
+        }})
+        existing = {"old-instance": {"state": "Running"}, "recent-instance": {"state": "Stopped"}}
+
+        with patch("crash_test.registry.list_instances", return_value=existing):
+            assert expired_instances(ttl=3600) == ["old-instance"]
+            assert expired_instances(ttl=0) == ["old-instance", "recent-instance"]
+            assert expired_instances(ttl=0, instance_names=["recent-instance"]) == ["recent-instance"]
+
+        assert set(get_registry_state()["instances"]) == {"old-instance", "recent-instance"}
+
+    def test_expired_instances_keeps_the_registry_when_the_list_fails(self, crashtest_home):
+        register_instance("test-instance")
+        registry = get_registry_state()
+
+        with patch("crash_test.registry.list_instances", return_value=None):
+            assert expired_instances(ttl=0) == ["test-instance"]
+
+        assert get_registry_state() == registry
+
+    def test_register_instance_not_launched_by_crashtest(self, crashtest_home):
+        register_instance("user-instance", launched=False)
+        assert get_registry_state()["instances"] == {}
+
+        register_instance("test-instance")
+        created = get_registry_state()["instances"]["test-instance"]["created"]
+        register_instance("test-instance", launched=False)
+        instance = get_registry_state()["instances"]["test-instance"]
+        assert instance["created"] == created and instance["last_used"] >= created
+
+    def test_collect_garbage_tears_down_expired_instances(self, crashtest_home):
+        register_instance("test-instance-0")
+        register_instance("test-instance-1")
+        existing = {"test-instance-0": {"state": "Running"}, "test-instance-1": {"state": "Running"}}
+
+        with patch("crash_test.registry.list_instances", return_value=existing), \
+                patch("crash_test.registry.run_multipass_command") as mock_run_multipass_command, \
+                patch("crash_test.registry.execute_multipass_command") as mock_execute_multipass_command:
+            collect_garbage(ttl=0)
+
+        commands = [call.args[0] for call in mock_run_multipass_command.call_args_list +
+                    mock_execute_multipass_command.call_args_list]
+        for instance_name in existing:
+            assert ["multipass", "stop", instance_name] in commands
+            assert ["multipass", "delete", "--purge", instance_name] in commands
+        assert get_registry_state()["instances"] == {}
+
+    def test_collect_garbage_detached(self, crashtest_home):
+        register_instance("test-instance")
+
+        with patch("crash_test.registry.list_instances", return_value={"test-instance": {"state": "Running"}}), \
+                patch("crash_test.registry.subprocess.Popen") as popen:
+            collect_garbage(ttl=0, detach=True)
+
+        assert popen.call_args.args[0][-4:] == ["gc", "--ttl", "0", "test-instance"]
+        assert popen.call_args.kwargs["start_new_session"] is True
+
 
 class TestCrashTest:
     def test_args_parser(self):
@@ -281,18 +609,1296 @@ class TestCrashTest:
         assert result.delete is True
         assert result.install_dependencies is True
 
-    def test_execute_multipass_command(self, mock_multipass_command_execution):
+    def test_execute_multipass_command(self):
         """
         Tests that the mock was called exactly once and that that call was
         with the specified arguments
-        :param mock_multipass_command_execution: function that mocks the execution of multipass commands
         """
-        mock_multipass_command_execution.return_value.returncode = 0
-        crashtest = CrashTest(None)
-        crashtest.execute_multipass_command(["multipass", "launch", "--name", "test-instance"])
-        mock_multipass_command_execution.assert_called_once_with(
-            ["multipass", "launch", "--name", "test-instance"],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
+        with patch('subprocess.Popen') as mock_popen:
+            mock_popen.return_value.stdout = io.StringIO()
+            mock_popen.return_value.stderr = io.StringIO()
+            mock_popen.return_value.wait.return_value = 0
+            crashtest = CrashTest(None)
+            crashtest.execute_multipass_command(["multipass", "launch", "--name", "test-instance"])
+            mock_popen.assert_called_once_with(
+                ["multipass", "launch", "--name", "test-instance"],
+                stdin=None,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                errors="replace",
+                bufsize=1,
+                start_new_session=True
+            )
+
+    def test_execute_multipass_command_streams_and_tees_output(self, tmp_path, capsys):
+        log_file = tmp_path / "crashtest.log"
+        set_log_file(str(log_file))
+        try:
+            execute_multipass_command([sys.executable, "-c", "import sys; print('out'); print('err', file=sys.stderr)"])
+        finally:
+            set_log_file(None)
+
+        captured = capsys.readouterr()
+        assert captured.out == "out\n"
+        assert captured.err == "err\n"
+        assert "out\n" in log_file.read_text() and "err\n" in log_file.read_text()
+
+    def test_execute_multipass_command_reports_error_tail(self, capsys):
+        with pytest.raises(SystemExit) as exit_info:
+            execute_multipass_command([sys.executable, "-c",
+                                       "import sys\nfor i in range(1000): print(i, file=sys.stderr)\nexit(4)"])
+
+        assert exit_info.value.code == 4
+        error_report = capsys.readouterr().out
+        assert "999" in error_report and "\n949\n" not in error_report
+
+
+class TestSnapshots:
+    def test_dependencies_fingerprint_changes_with_manifest(self, tmp_path):
+        tmp_project_path = tmp_path / "test_project"
+        tmp_project_path.mkdir()
+        requirements = tmp_project_path / "requirements.txt"
+        requirements.write_text("colorama")
+        script = tmp_path / "python_dependencies.sh"
+        script.write_text("pip3 install -r requirements.txt")
+
+        fingerprint = dependencies_fingerprint(str(tmp_project_path), script_paths=[str(script)], image="22.04")
+        assert fingerprint == dependencies_fingerprint(str(tmp_project_path), script_paths=[str(script)], image="22.04")
+        assert fingerprint != dependencies_fingerprint(str(tmp_project_path), script_paths=[str(script)], image="24.04")
+
+        requirements.write_text("colorama\npytest")
+        assert fingerprint != dependencies_fingerprint(str(tmp_project_path), script_paths=[str(script)], image="22.04")
+
+    def test_dependencies_fingerprint_no_manifest(self, tmp_path):
+        tmp_project_path = tmp_path / "test_project"
+        tmp_project_path.mkdir()
+        assert dependencies_fingerprint(str(tmp_project_path), script_paths=["script.sh"], image=None) is None
+
+    def test_dependencies_fingerprint_changes_with_project_name(self, tmp_path):
+        script = tmp_path / "python_dependencies.sh"
+        script.write_text("pip3 install -r requirements.txt")
+        fingerprints = set()
+        for project_name in ("project_a", "project_b"):
+            (tmp_path / project_name).mkdir()
+            (tmp_path / project_name / "requirements.txt").write_text("colorama")
+            fingerprints.add(dependencies_fingerprint(str(tmp_path / project_name), script_paths=[str(script)],
+                                                      image=None))
+
+        assert len(fingerprints) == 2
+
+    def test_dependencies_fingerprint_follows_the_manifest_depth(self, tmp_path):
+        tmp_project_path = tmp_path / "test_project"
+        (tmp_project_path / "services" / "api").mkdir(parents=True)
+        (tmp_project_path / "requirements.txt").write_text("colorama")
+        nested_requirements = tmp_project_path / "services" / "api" / "requirements.txt"
+        nested_requirements.write_text("flask")
+        script = tmp_path / "python_dependencies.sh"
+        script.write_text("pip3 install -r requirements.txt")
+
+        shallow = dependencies_fingerprint(str(tmp_project_path), script_paths=[str(script)], image=None, max_depth=1)
+        deep = dependencies_fingerprint(str(tmp_project_path), script_paths=[str(script)], image=None, max_depth=2)
+        assert shallow != deep
+
+        nested_requirements.write_text("flask\ngunicorn")
+        assert shallow == dependencies_fingerprint(str(tmp_project_path), script_paths=[str(script)], image=None,
+                                                   max_depth=1)
+        assert deep != dependencies_fingerprint(str(tmp_project_path), script_paths=[str(script)], image=None,
+                                                max_depth=2)
+
+    def test_find_snapshot_unknown_fingerprint(self, crashtest_home):
+        assert find_snapshot("0" * 64) is None
+
+    def test_clean_project_keeps_the_dependencies(self, fake_multipass):
+        (fake_multipass / "test_project" / "venv" / "bin").mkdir(parents=True)
+        (fake_multipass / "test_project" / "web" / "node_modules").mkdir(parents=True)
+        (fake_multipass / "test_project" / "venv" / "bin" / "python").write_text("")
+        (fake_multipass / "test_project" / "web" / "node_modules" / "module.js").write_text("")
+        (fake_multipass / "test_project" / "web" / "stale.js").write_text("")
+        (fake_multipass / "test_project" / "stale.py").write_text("")
+
+        execute_multipass_command(clean_project_command("test-instance", project_name="test_project"))
+
+        assert (fake_multipass / "test_project" / "venv" / "bin" / "python").exists()
+        assert (fake_multipass / "test_project" / "web" / "node_modules" / "module.js").exists()
+        assert not (fake_multipass / "test_project" / "web" / "stale.js").exists()
+        assert not (fake_multipass / "test_project" / "stale.py").exists()
+
+    def test_evict_least_recently_used_snapshots(self, crashtest_home):
+        save_state(SNAPSHOTS_STATE_FILE, {
+            "a": {"instance": "crashtest-deps-a", "image": None, "created": 1.0, "used": 5.0},
+            "b": {"instance": "crashtest-deps-b", "image": None, "created": 2.0},
+            "c": {"instance": "crashtest-deps-c", "image": None, "created": 3.0},
+        })
+        with patch("crash_test.snapshots.list_instances", return_value={}), \
+                patch("crash_test.snapshots.instance_exists", return_value=True), \
+                patch("crash_test.snapshots.subprocess.run") as mock_run:
+            assert evict_snapshots(max_snapshots=2) == ["crashtest-deps-b"]
+
+        mock_run.assert_called_once()
+        assert set(load_state(SNAPSHOTS_STATE_FILE)) == {"a", "c"}
+
+    def test_evict_snapshots_keeps_the_snapshots_when_the_list_fails(self, crashtest_home):
+        save_state(SNAPSHOTS_STATE_FILE, {"a": {"instance": "crashtest-deps-a", "image": None, "created": 1.0}})
+        with patch("crash_test.snapshots.list_instances", return_value=None), \
+                patch("crash_test.snapshots.instance_exists", return_value=False):
+            assert evict_snapshots(max_snapshots=2) == []
+
+        assert set(load_state(SNAPSHOTS_STATE_FILE)) == {"a"}
+
+
+class TestSync:
+    def test_scan_project_does_not_rehash_unchanged_files(self, tmp_path):
+        tmp_project_path = tmp_path / "test_project"
+        (tmp_project_path / "src").mkdir(parents=True)
+        (tmp_project_path / "main.py").write_text("print('main')")
+        (tmp_project_path / "src" / "module.py").write_text("print('module')")
+
+        manifest = scan_project(str(tmp_project_path))
+        assert set(manifest) == {"main.py", "src/module.py"}
+
+        with patch("crash_test.sync.hash_file") as mock_hash_file:
+            assert scan_project(str(tmp_project_path), previous_manifest=manifest) == manifest
+            mock_hash_file.assert_not_called()
+
+    def test_diff_manifests(self):
+        old_manifest = {"a.py": {"sha256": "1"}, "b.py": {"sha256": "2"}, "c.py": {"sha256": "3"}}
+        new_manifest = {"a.py": {"sha256": "1"}, "b.py": {"sha256": "4"}, "d.py": {"sha256": "5"}}
+        assert diff_manifests(old_manifest, new_manifest) == (["b.py", "d.py"], ["c.py"])
+
+    def test_sync_project_transfers_only_changes(self, tmp_path, crashtest_home):
+        tmp_project_path = tmp_path / "test_project"
+        tmp_project_path.mkdir()
+        (tmp_project_path / "unchanged.py").write_text("unchanged")
+        (tmp_project_path / "deleted.py").write_text("deleted")
+        save_manifest(instance_name="test-instance", project_path=str(tmp_project_path))
+
+        (tmp_project_path / "deleted.py").unlink()
+        (tmp_project_path / "added.py").write_text("added")
+        with patch("crash_test.sync.execute_multipass_command") as mock_execute_multipass_command:
+            sync_project(instance_name="test-instance", project_path=str(tmp_project_path),
+                         project_name="test_project")
+
+        commands = [call.args[0] for call in mock_execute_multipass_command.call_args_list]
+        assert ["multipass", "exec", "test-instance", "--", "rm", "-f", "--", "./test_project/deleted.py"] in commands
+        assert ["multipass", "transfer", str(tmp_project_path / "added.py"),
+                "test-instance:./test_project/"] in commands
+        assert not any(str(tmp_project_path / "unchanged.py") in command for command in commands)
+
+    def test_manifests_are_kept_per_project(self, tmp_path, crashtest_home):
+        projects = [tmp_path / "project_a", tmp_path / "project_b"]
+        for tmp_project_path in projects:
+            tmp_project_path.mkdir()
+            (tmp_project_path / "common.txt").write_text("common")
+            save_manifest(instance_name="test-instance", project_path=str(tmp_project_path))
+        save_manifest(instance_name="test-instance-2", project_path=str(projects[0]))
+
+        assert has_manifest("test-instance", str(projects[0])) and has_manifest("test-instance", str(projects[1]))
+        forget_instance("test-instance")
+        assert not any(has_manifest("test-instance", str(tmp_project_path)) for tmp_project_path in projects)
+        assert has_manifest("test-instance-2", str(projects[0]))
+
+    def test_manifest_skips_the_ignored_files(self, tmp_path, crashtest_home):
+        tmp_project_path = tmp_path / "test_project"
+        (tmp_project_path / "node_modules").mkdir(parents=True)
+        (tmp_project_path / "node_modules" / "module.js").write_text("module")
+        (tmp_project_path / "main.py").write_text("print('main')")
+        rules = load_ignore_rules(str(tmp_project_path))
+        save_manifest(instance_name="test-instance", project_path=str(tmp_project_path), rules=rules)
+
+        (tmp_project_path / "node_modules" / "module.js").write_text("changed")
+        with patch("crash_test.sync.execute_multipass_command") as mock_execute_multipass_command:
+            sync_project(instance_name="test-instance", project_path=str(tmp_project_path),
+                         project_name="test_project", rules=rules)
+        mock_execute_multipass_command.assert_not_called()
+
+
+class TestTransfer:
+    def test_ignore_rules(self, tmp_path):
+        tmp_project_path = tmp_path / "test_project"
+        tmp_project_path.mkdir()
+        (tmp_project_path / ".gitignore").write_text("# comment\n*.log\n/build/\ndocs/*.tmp\n!keep.log\n")
+        rules = load_ignore_rules(str(tmp_project_path))
+
+        assert is_ignored(".git", is_dir=True, rules=rules) is True
+        assert is_ignored("sub/node_modules", is_dir=True, rules=rules) is True
+        assert is_ignored("sub/debug.log", is_dir=False, rules=rules) is True
+        assert is_ignored("keep.log", is_dir=False, rules=rules) is False
+        assert is_ignored("build", is_dir=True, rules=rules) is True
+        assert is_ignored("sub/build", is_dir=True, rules=rules) is False
+        assert is_ignored("docs/notes.tmp", is_dir=False, rules=rules) is True
+        assert is_ignored("main.py", is_dir=False, rules=rules) is False
+
+    def test_collect_files_skips_ignored_folders(self, tmp_path):
+        tmp_project_path = tmp_path / "test_project"
+        (tmp_project_path / "node_modules" / "package").mkdir(parents=True)
+        (tmp_project_path / "node_modules" / "package" / "index.js").write_text("ignored")
+        (tmp_project_path / "index.js").write_text("console.log('test')")
+
+        assert [relative_path for _, relative_path, _ in collect_files(str(tmp_project_path))] == ["index.js"]
+
+    @pytest.mark.skipif(sys.platform.startswith("win32"), reason="the multipass stand-in is a shell script")
+    @pytest.mark.parametrize("compression", ["none", "gzip", "zstd"])
+    def test_stream_project(self, tmp_path, fake_multipass, compression):
+        tmp_project_path = tmp_path / "test_project"
+        (tmp_project_path / "src").mkdir(parents=True)
+        (tmp_project_path / "src" / "main.py").write_text("print('test')")
+        (tmp_project_path / ".crashtestignore").write_text("secret.txt\n")
+        (tmp_project_path / "secret.txt").write_text("secret")
+        (tmp_project_path / "main.py").symlink_to("src/main.py")
+
+        assert stream_project(instance_name="test-instance", project_path=str(tmp_project_path),
+                              project_name="test_project", compression=compression) is True
+        assert (fake_multipass / "test_project" / "src" / "main.py").read_text() == "print('test')"
+        assert os.readlink(fake_multipass / "test_project" / "main.py") == "src/main.py"
+        assert not (fake_multipass / "test_project" / "secret.txt").exists()
+
+    @pytest.mark.skipif(sys.platform.startswith("win32"), reason="the multipass stand-in is a shell script")
+    def test_stream_project_failure(self, tmp_path, fake_multipass, capsys):
+        tmp_project_path = tmp_path / "test_project"
+        tmp_project_path.mkdir()
+        (tmp_project_path / "main.py").write_text("print('test')")
+        (fake_multipass / "test_project").write_text("not a folder")
+
+        with patch("crash_test.multipass.time.sleep") as sleep:
+            assert stream_project(instance_name="test-instance", project_path=str(tmp_project_path),
+                                  project_name="test_project", compression="gzip") is False
+        # Retried like a transfer
+        assert sleep.call_count == get_policy(["multipass", "transfer"]).retries
+        assert "project stream transfer failed" in capsys.readouterr().out
+
+
+class TestMatrix:
+    def test_parse_profile(self):
+        assert parse_profile("2:4G:20G") == Profile(cpus=2, memory="4G", disk="20G")
+        assert parse_profile(":4G") == Profile(cpus=None, memory="4G", disk=None)
+
+    def test_build_jobs(self):
+        jobs = build_jobs(instance_name="test-instance", images=["22.04", "24.04"],
+                          profiles=[Profile(cpus=2)], count=2)
+
+        assert [job.instance_name for job in jobs] == [f"test-instance-{index}" for index in range(1, 5)]
+        assert [job.image for job in jobs] == ["22.04", "22.04", "24.04", "24.04"]
+        assert jobs[0].steps[0] == ("launch", ["multipass", "launch", "--name", "test-instance-1", "--cpus", "2",
+                                               "22.04"])
+
+    def test_run_matrix_reports_exit_codes(self, capsys):
+        succeeding_job = MatrixJob(instance_name="test-instance-1", image=None, profile=Profile(),
+                                   steps=[("script", [sys.executable, "-c", "print('hello')"])])
+        failing_job = MatrixJob(instance_name="test-instance-2", image=None, profile=Profile(),
+                                steps=[("script", [sys.executable, "-c", "exit(3)"]),
+                                       ("never", [sys.executable, "-c", "print('never')"])],
+                                cleanup_steps=[("delete", [sys.executable, "-c", "print('deleted')"])])
+
+        assert run_matrix([succeeding_job, failing_job], concurrency=2) is False
+        assert succeeding_job.returncode == 0
+        assert (failing_job.returncode, failing_job.failed_step) == (3, "script")
+
+        output = capsys.readouterr().out
+        assert "[test-instance-1]\x1b[0m hello" in output
+        assert "deleted" in output
+        assert "never" not in output
+
+    def test_run_matrix_records_a_trace_lane_per_job(self, capsys):
+        jobs = [MatrixJob(instance_name=f"test-instance-{index}", image=None, profile=Profile(),
+                          steps=[("script", [sys.executable, "-c", "print('hello')"])]) for index in range(2)]
+        run_matrix(jobs, concurrency=2)
+
+        assert {timing.lane for timing in recorder.commands()[-2:]} == {"test-instance-0", "test-instance-1"}
+
+
+class TestSizing:
+    def test_profile_project(self, tmp_path):
+        tmp_project_path = tmp_path / "test_project"
+        (tmp_project_path / "web" / "node_modules").mkdir(parents=True)
+        (tmp_project_path / "requirements.txt").write_text("colorama")
+        (tmp_project_path / "web" / "package.json").write_text("{}")
+        (tmp_project_path / "web" / "package-lock.json").write_text("x" * 1000)
+        (tmp_project_path / "web" / "node_modules" / "index.js").write_text("x" * 5000)
+
+        profile = profile_project(str(tmp_project_path))
+
+        assert profile.files == 3
+        assert profile.size == len("colorama") + len("{}") + 1000
+        assert profile.ecosystems == {"python", "npm"}
+        assert profile.lock_files_size == 1000
+
+    def test_profile_project_skips_tool_only_pyproject(self, tmp_path):
+        tmp_project_path = tmp_path / "test_project"
+        (tmp_project_path / "api").mkdir(parents=True)
+        (tmp_project_path / "pyproject.toml").write_text("[tool.black]\nline-length = 120\n")
+        (tmp_project_path / "api" / "pyproject.toml").write_text("[project]\nname = \"api\"\n")
+
+        assert profile_project(str(tmp_project_path)).subprojects == {("api", "python")}
+
+    def test_size_instance(self):
+        profile = ProjectProfile(size=parse_size("1G"), files=1000, subprojects={("", "python"), ("web", "npm")},
+                                 lock_files_size=parse_size("512K"))
+        size = size_instance(profile, host_cpus=16, host_memory=parse_size("32G"), host_disk=parse_size("500G"))
+
+        assert size.cpus == 3
+        assert size.memory == "3584M"
+        assert size.disk == "12G"
+
+    def test_size_instance_is_capped_by_the_host(self):
+        profile = ProjectProfile(size=parse_size("10G"), subprojects={(str(index), "npm") for index in range(12)},
+                                 lock_files_size=parse_size("10M"))
+        size = size_instance(profile, host_cpus=4, host_memory=parse_size("4G"), host_disk=parse_size("20G"))
+
+        assert (size.cpus, size.memory, size.disk) == (3, "3G", "10G")
+
+        size = size_instance(ProjectProfile(), host_cpus=1, host_memory=parse_size("512M"), host_disk=0)
+        assert (size.cpus, size.memory, size.disk) == (1, "1G", "5G")
+
+    def test_resolve_instance_size_overrides(self, tmp_path):
+        tmp_project_path = tmp_path / "test_project"
+        tmp_project_path.mkdir()
+        (tmp_project_path / ".crashtest.json").write_text(json.dumps({"resources": {"cpus": 6, "memory": "12G"}}))
+
+        size = resolve_instance_size(str(tmp_project_path), memory="8G")
+        assert (size.cpus, size.memory, size.disk) == (6, "8G", "5G")
+
+        size = resolve_instance_size(str(tmp_project_path), auto_size=False)
+        assert (size.cpus, size.memory, size.disk) == (6, "12G", None)
+
+    def test_format_size(self):
+        assert format_size(parse_size("4G")) == "4G"
+        assert format_size(parse_size("1536M")) == "1536M"
+
+
+class TestCloudInit:
+    def test_build_user_data(self, tmp_path):
+        tmp_project_path = tmp_path / "test_project"
+        (tmp_project_path / "api").mkdir(parents=True)
+        (tmp_project_path / "api" / "requirements.txt").write_text("colorama")
+        script = tmp_path / "python_dependencies.sh"
+        script.write_text("pip3 install -r requirements.txt")
+        scripts = {str(script): [Subproject(path="api", project_type="python", manifests=["api/requirements.txt"])]}
+
+        user_data = build_user_data(str(tmp_project_path), "test_project", scripts=scripts,
+                                    environment=cache_environment())
+
+        assert user_data.startswith("#cloud-config\n")
+        config = json.loads(user_data.removeprefix("#cloud-config\n"))
+        files = {entry["path"]: base64.b64decode(entry["content"]).decode() for entry in config["write_files"]}
+        assert files["/home/ubuntu/test_project/api/requirements.txt"] == "colorama"
+        assert files["/home/ubuntu/.crashtest/install_python_dependencies.sh"] == "pip3 install -r requirements.txt"
+        assert all(entry["defer"] and entry["owner"] == "ubuntu:ubuntu" for entry in config["write_files"])
+
+        provisioning_script = files["/home/ubuntu/.crashtest/provision.sh"]
+        assert f"mountpoint -q {GUEST_CACHE_PATH}" in provisioning_script
+        assert (f"env CRASHTEST_CACHE={GUEST_CACHE_PATH} bash /home/ubuntu/.crashtest/install_python_dependencies.sh "
+                f"test_project api || STATUS=$?") in provisioning_script
+        assert provisioning_script.endswith(f"echo $STATUS > {READY_MARKER}\n")
+        assert "setsid nohup bash /home/ubuntu/.crashtest/provision.sh" in config["runcmd"][-1][-1]
+
+    def test_launch_instance_with_cloud_init(self, tmp_path, crashtest_home):
+        crashtest = make_crashtest("-i", "test-instance", "-p", str(tmp_path), "--install-dependencies",
+                                   "--cloud-init", "--no-auto-size")
+        script = tmp_path / "python_dependencies.sh"
+        script.write_text("pip3 install -r requirements.txt")
+        crashtest.dependencies_scripts = {str(script): [Subproject(path=".", project_type="python",
+                                                                   manifests=["requirements.txt"])]}
+        (tmp_path / "requirements.txt").write_text("colorama")
+
+        with patch("crash_test.crashtest.instance_state", return_value=None), \
+                patch.object(CrashTest, "execute_multipass_command") as execute:
+            crashtest.launch_instance()
+
+        launch = execute.call_args.args[0]
+        assert launch[:4] == ["multipass", "launch", "--name", "test-instance"]
+        assert launch[launch.index("--cloud-init") + 1].endswith("test-instance.yaml")
+        assert not os.path.exists(launch[launch.index("--cloud-init") + 1])
+        assert crashtest.cloud_init_provisioning is True
+
+    def test_split_boot_scripts_defers_editable_installs(self):
+        requirements = Subproject(path="api", project_type="python", manifests=["api/requirements.txt"])
+        editable = Subproject(path="lib", project_type="python", manifests=["lib/pyproject.toml"])
+        web = Subproject(path="web", project_type="npm", manifests=["web/package.json"])
+        scripts = {"python_dependencies.sh": [requirements, editable], "npm_dependencies.sh": [web]}
+
+        assert split_boot_scripts(scripts) == ({"python_dependencies.sh": [requirements],
+                                                "npm_dependencies.sh": [web]},
+                                               {"python_dependencies.sh": [editable]})
+
+    def test_wait_for_provisioning_times_out_with_the_cloud_init_log(self, fake_multipass, capsys):
+        set_policy("provisioning", timeout=0.5)
+        try:
+            with pytest.raises(MultipassCommandError) as error:
+                wait_for_provisioning("test-instance")
+        finally:
+            reset_policies()
+
+        assert error.value.result.timed_out
+        assert f"the end of {CLOUD_INIT_LOG}" in capsys.readouterr().out
+
+    def test_provisioning_wait_is_unbounded_by_default(self):
+        assert phase_policy("provisioning") == CommandPolicy()
+
+
+class TestMount:
+    def test_choose_transfer_mode_auto(self, tmp_path, monkeypatch):
+        tmp_project_path = tmp_path / "test_project"
+        tmp_project_path.mkdir()
+        for index in range(3):
+            (tmp_project_path / f"{index}.py").write_text("print('test')")
+
+        assert choose_transfer_mode("auto", str(tmp_project_path), rules=[]) == "copy"
+        monkeypatch.setattr("crash_test.mount.MOUNT_FILES_THRESHOLD", 3)
+        assert choose_transfer_mode("auto", str(tmp_project_path), rules=[]) == "mount"
+        assert choose_transfer_mode("copy", str(tmp_project_path), rules=[]) == "copy"
+
+    def test_mount_project_commands(self, tmp_path):
+        assert mount_project_commands("test-instance", str(tmp_path), "test_project", overlay=False) == [
+            ["multipass", "mount", str(tmp_path), "test-instance:/home/ubuntu/test_project"]
+        ]
+
+        mount_command, overlay_command = mount_project_commands("test-instance", str(tmp_path), "test_project",
+                                                                overlay=True)
+        assert mount_command[-1] == "test-instance:/home/ubuntu/.crashtest-lower/test_project"
+        assert overlay_command[:5] == ["multipass", "exec", "test-instance", "--", "bash"]
+        assert ("lowerdir=/home/ubuntu/.crashtest-lower/test_project,"
+                "upperdir=/var/lib/crashtest-overlay/test_project/upper") in overlay_command[-1]
+        assert overlay_command[-1].startswith("mountpoint -q /home/ubuntu/test_project || ")
+
+        assert mount_project_commands("test-instance", str(tmp_path), "test_project", overlay=True,
+                                      mounted={"/home/ubuntu/.crashtest-lower/test_project": {}}) == [overlay_command]
+
+
+class TestCache:
+    def test_get_cache_path_creates_ecosystem_folders(self, crashtest_home):
+        cache_path = get_cache_path()
+        assert sorted(os.listdir(cache_path)) == ["apt", "npm", "nvm", "pip"]
+
+    def test_cache_environment(self):
+        assert cache_environment() == ["env", f"CRASHTEST_CACHE={GUEST_CACHE_PATH}"]
+        assert cache_environment(offline=True)[-1] == "CRASHTEST_OFFLINE=1"
+
+    def test_install_dependencies_commands_use_cache(self, tmp_path):
+        crashtest = make_crashtest("-i", "test-instance", "-p", str(tmp_path / "test_project"), "--offline")
+        _, run_script_command = crashtest.install_dependencies_commands("test-instance", script_path="script.sh")
+
+        assert crashtest.args.cache is True
+        assert run_script_command == ["multipass", "exec", "test-instance", "--", "env",
+                                      f"CRASHTEST_CACHE={GUEST_CACHE_PATH}", "CRASHTEST_OFFLINE=1", "bash",
+                                      "./test_project/install_script.sh", "test_project"]
+
+    def test_install_dependencies_commands_pass_subprojects(self, tmp_path):
+        crashtest = make_crashtest("-i", "test-instance", "-p", str(tmp_path / "test_project"))
+        _, run_script_command = crashtest.install_dependencies_commands(
+            "test-instance", script_path="python_dependencies.sh",
+            subprojects=[Subproject(path="api", project_type="python"),
+                         Subproject(path="worker", project_type="python")]
         )
+
+        assert run_script_command[-4:] == ["./test_project/install_python_dependencies.sh", "test_project", "api",
+                                           "worker"]
+
+
+class TestScheduler:
+    def test_run_respects_dependencies_and_overlaps_independent_steps(self):
+        events = []
+        scheduler = StepScheduler()
+        scheduler.add_step("launch", lambda: (events.append("launch"), time.sleep(0.2)))
+        scheduler.add_step("scan", lambda: events.append("scan"))
+        scheduler.add_step("transfer", lambda: events.append("transfer"), dependencies=["launch", "scan"])
+        scheduler.run()
+
+        assert events.index("transfer") == 2
+        assert scheduler.steps["scan"].start < scheduler.steps["launch"].end
+        assert [step.name for step in scheduler.critical_path()] == ["launch", "transfer"]
+
+    def test_run_raises_step_failure(self):
+        scheduler = StepScheduler()
+        scheduler.add_step("launch", lambda: sys.exit(2))
+        scheduler.add_step("transfer", lambda: None, dependencies=["launch"])
+
+        with pytest.raises(SystemExit):
+            scheduler.run()
+        assert scheduler.steps["transfer"].start is None
+
+    def test_add_step_unknown_dependency(self):
+        with pytest.raises(ValueError):
+            StepScheduler().add_step("transfer", lambda: None, dependencies=["launch"])
+
+    def test_provisioning_steps(self, tmp_path):
+        crashtest = make_crashtest("-i", "test-instance", "-p", str(tmp_path), "--install-dependencies",
+                                   "--reuse-dependencies", "--stream", "--cache", "-s", "script.sh")
+        steps = crashtest.provisioning_steps().steps
+
+        assert steps["launch"].dependencies == ["resolve dependencies"]
+        assert steps["transfer"].dependencies == ["launch", "scan project"]
+        assert steps["install dependencies"].dependencies == ["transfer", "resolve dependencies", "mount cache"]
+        assert steps["custom script"].dependencies == ["transfer", "install dependencies"]
+
+    def test_provisioning_steps_mount_mode(self, tmp_path):
+        crashtest = make_crashtest("-i", "test-instance", "-p", str(tmp_path), "--install-dependencies",
+                                   "--stream", "--mode", "mount")
+        crashtest.transfer_mode = crashtest.resolve_transfer_mode()
+        steps = crashtest.provisioning_steps().steps
+
+        assert "transfer" not in steps and "scan project" not in steps
+        assert steps["mount project"].dependencies == ["launch"]
+        assert steps["install dependencies"].dependencies == ["mount project", "resolve dependencies"]
+
+
+class TestInstancesState:
+    def test_list_instances_is_queried_once(self, mock_multipass_command_execution):
+        mock_multipass_command_execution.return_value = subprocess.CompletedProcess(
+            args=[], returncode=0, stdout=json.dumps({"list": [{"name": "test-instance", "state": "Stopped"},
+                                                               {"name": "old-instance", "state": "Deleted"}]})
+        )
+        invalidate_instances_cache()
+
+        assert list_instances()["test-instance"]["state"] == "Stopped"
+        assert instance_exists("test-instance") is True
+        assert instance_exists("old-instance") is False
+        assert instance_exists("unknown-instance") is False
+        assert mock_multipass_command_execution.call_count == 1
+
+        invalidate_instances_cache()
+        list_instances()
+        assert mock_multipass_command_execution.call_count == 2
+        invalidate_instances_cache()
+
+    def test_failed_list_is_not_cached(self, mock_multipass_command_execution):
+        mock_multipass_command_execution.return_value = subprocess.CompletedProcess(args=[], returncode=1, stdout="")
+        invalidate_instances_cache()
+
+        assert list_instances() is None
+        assert instance_exists("test-instance") is False
+        assert list_instances() is None
+        assert mock_multipass_command_execution.call_count == 3
+        invalidate_instances_cache()
+
+    @pytest.mark.parametrize("state, expected_commands", [
+        ("Running", []),
+        ("Stopped", [["multipass", "start", "test-instance"]]),
+        ("Deleted", [["multipass", "recover", "test-instance"], ["multipass", "start", "test-instance"]]),
+    ])
+    def test_resume_instance(self, state, expected_commands):
+        crashtest = make_crashtest("-i", "test-instance", "-p", "test_project")
+        with patch("crash_test.crashtest.instance_state", return_value=state), \
+                patch.object(CrashTest, "execute_multipass_command") as execute:
+            assert crashtest.resume_instance() is True
+
+        assert [call.args[0] for call in execute.call_args_list] == expected_commands
+
+    def test_resume_instance_unknown(self):
+        with patch("crash_test.crashtest.instance_state", return_value=None):
+            assert make_crashtest("-i", "test-instance", "-p", "test_project").resume_instance() is False
+
+
+class TestTimings:
+    def test_execute_multipass_command_is_recorded(self, capsys):
+        command = [sys.executable, "-c", "print('12345')"]
+        execute_multipass_command(command)
+
+        timing = recorder.commands()[-1]
+        assert timing.name == " ".join(command)
+        assert timing.returncode == 0
+        assert timing.bytes_out == len("12345\n")
+        assert timing.duration > 0
+
+    def test_write_chrome_trace(self, tmp_path):
+        timing_recorder = TimingRecorder()
+        timing_recorder.record(name="multipass launch --name test-instance", category="multipass",
+                               start=timing_recorder.origin, end=timing_recorder.origin + 1.5, returncode=0)
+        timing_recorder.record(name="launch", category="step", start=timing_recorder.origin,
+                               end=timing_recorder.origin + 1.6)
+        trace_path = tmp_path / "trace.json"
+        timing_recorder.write_chrome_trace(str(trace_path))
+
+        events = json.loads(trace_path.read_text())["traceEvents"]
+        assert [(event["name"], event["cat"], event["ph"], event["dur"]) for event in events] == [
+            ("multipass launch --name test-instance", "multipass", "X", 1_500_000),
+            ("launch", "step", "X", 1_600_000),
+        ]
+        assert events[0]["args"]["returncode"] == 0
+
+    def test_write_chrome_trace_separates_the_matrix_jobs(self, tmp_path):
+        timing_recorder = TimingRecorder()
+        for instance_name in ("test-instance-0", "test-instance-1"):
+            timing_recorder.record(name=f"multipass launch --name {instance_name}", category="multipass",
+                                   start=timing_recorder.origin, end=timing_recorder.origin + 1, lane=instance_name)
+        trace_path = tmp_path / "trace.json"
+        timing_recorder.write_chrome_trace(str(trace_path))
+
+        events = json.loads(trace_path.read_text())["traceEvents"]
+        lanes = {event["args"]["name"]: event["tid"] for event in events if event["ph"] == "M"}
+        assert set(lanes) == {"test-instance-0", "test-instance-1"} and len(set(lanes.values())) == 2
+        assert {event["tid"] for event in events if event["ph"] == "X"} == set(lanes.values())
+
+
+@pytest.mark.skipif(sys.platform.startswith("win32"), reason="the multipass stand-in is started by a shell script")
+class TestSession:
+    def test_run_returns_exit_codes_and_output(self, fake_multipass):
+        session = InstanceSession("test-instance")
+        lines = []
+        try:
+            assert session.run(["echo", "first"], on_line=lines.append) == 0
+            assert session.run(["bash", "-c", "echo error >&2; printf partial; exit 3"], on_line=lines.append) == 3
+            # The command does not read the next commands from the session stdin
+            assert session.run(["cat"], on_line=lines.append) == 0
+        finally:
+            session.close()
+
+        assert lines == ["first\n", "error\n", "partial"]
+
+    def test_run_does_not_leak_state_between_commands(self, fake_multipass):
+        session = InstanceSession("test-instance")
+        try:
+            assert session.run(["bash", "-c", "mkdir folder && cd folder"], on_line=print) == 0
+            assert session.run(["touch", "file"], on_line=print) == 0
+        finally:
+            session.close()
+
+        assert (fake_multipass / "file").exists()
+
+    def test_session_is_killed_on_cancellation(self, fake_multipass):
+        session = InstanceSession("test-instance")
+        assert session.process.pid in active_process_groups
+
+        terminate_active_processes()
+        try:
+            assert session.process.wait(timeout=5) != 0
+            assert session.run(["echo", "lost"], on_line=print) == SESSION_LOST_EXIT_CODE
+        finally:
+            session.close()
+        assert session.process.pid not in active_process_groups
+
+    def test_get_session_replaces_ended_session(self, fake_multipass):
+        session = get_session("test-instance")
+        session.process.kill()
+        session.process.wait()
+
+        try:
+            assert get_session("test-instance") is not session
+            assert get_session("test-instance").run(["true"], on_line=print) == 0
+        finally:
+            close_sessions()
+
+    def test_session_arguments(self, tmp_path):
+        script = tmp_path / "check.sh"
+        script.write_text("echo check\n")
+
+        assert session_arguments(["multipass", "exec", "test-instance", "--", "ls", "-la"]) == \
+            ("test-instance", ["ls", "-la"])
+        assert session_arguments(["multipass", "launch", "--name", "test-instance"]) is None
+        assert session_arguments(["multipass", "transfer", "-r", str(tmp_path), "test-instance:."]) is None
+
+        instance_name, arguments = session_arguments(["multipass", "transfer", "-r", str(script),
+                                                      "test-instance:./test_project/"])
+        assert instance_name == "test-instance"
+        assert arguments[-1].endswith(" | base64 -d > ./test_project/check.sh")
+        assert base64.b64encode(b"echo check\n").decode() in arguments[-1]
+
+    def test_execute_multipass_command_through_session(self, fake_multipass, tmp_path):
+        script = tmp_path / "check.sh"
+        script.write_text("exit 4\n")
+        set_persistent_sessions(True)
+        try:
+            execute_multipass_command(["multipass", "transfer", str(script), "test-instance:./"])
+            with pytest.raises(SystemExit) as exit_info:
+                execute_multipass_command(["multipass", "exec", "test-instance", "--", "bash", "check.sh"])
+        finally:
+            set_persistent_sessions(False)
+            close_sessions()
+
+        assert (fake_multipass / "check.sh").read_text() == "exit 4\n"
+        assert exit_info.value.code == 4
+
+    def test_largest_session_file_fits_in_an_argument(self, fake_multipass, tmp_path):
+        data = tmp_path / "data.bin"
+        data.write_bytes(os.urandom(MAX_SESSION_FILE_SIZE))
+        set_persistent_sessions(True)
+        try:
+            execute_multipass_command(["multipass", "transfer", str(data), "test-instance:./"])
+        finally:
+            set_persistent_sessions(False)
+            close_sessions()
+
+        assert (fake_multipass / "data.bin").read_bytes() == data.read_bytes()
+        data.write_bytes(os.urandom(MAX_SESSION_FILE_SIZE + 1))
+        assert session_arguments(["multipass", "transfer", str(data), "test-instance:./"]) is None
+
+
+class TestWatch:
+    def test_wait_for_changes_batches_changes(self, tmp_path):
+        (tmp_path / "main.py").write_text("print('test')")
+        (tmp_path / "old.py").write_text("print('old')")
+        (tmp_path / ".git").mkdir()
+        watcher = ProjectWatcher(str(tmp_path), rules=load_ignore_rules(str(tmp_path)), debounce=0.05, interval=0.01)
+
+        (tmp_path / ".git" / "HEAD").write_text("ref: refs/heads/main")
+        assert watcher.wait_for_changes(timeout=0.1) == []
+
+        (tmp_path / "main.py").write_text("print('changed')")
+        (tmp_path / "old.py").unlink()
+        (tmp_path / "new.py").write_text("print('new')")
+        assert watcher.wait_for_changes(timeout=1) == ["main.py", "new.py", "old.py"]
+
+    @pytest.mark.skipif(sys.platform.startswith("win32"), reason="the multipass stand-in is started by a shell script")
+    def test_cancel_stops_the_script_and_its_children(self, fake_multipass):
+        command = ["multipass", "exec", "test-instance", "--"] + cancellable_command(
+            ["bash", "-c", "sleep 30 & wait; touch done"]
+        )
+        run = WatchedRun("test-instance", target=lambda: execute_multipass_command(command))
+        while not (fake_multipass / ".crashtest-watch.pid").exists():
+            time.sleep(0.01)
+
+        start = time.perf_counter()
+        run.cancel()
+
+        assert time.perf_counter() - start < 10
+        assert run.cancelled is True and run.returncode != 0
+        assert not (fake_multipass / "done").exists()
+        assert not (fake_multipass / ".crashtest-watch.pid").exists()
+
+
+def make_sample(cpu_percent: float = 10.0, iowait_percent: float = 0.0, memory_used: int = 1024 ** 3,
+                cpus: int = 2) -> Sample:
+    return Sample(time=0.0, cpu_percent=cpu_percent, iowait_percent=iowait_percent, memory_used=memory_used,
+                  memory_total=4 * 1024 ** 3, disk_read_rate=0.0, disk_write_rate=0.0, running_tasks=1, tasks=100,
+                  cpus=cpus)
+
+
+class TestProfiler:
+    def test_build_sample(self):
+        previous = (100.0, 1000, 800, 50, 2, 4 * 1024 ** 3, 3 * 1024 ** 3, 0, 1024 ** 2, 3, 120)
+        current = (102.0, 1200, 900, 100, 2, 4 * 1024 ** 3, 2 * 1024 ** 3, 4096, 3 * 1024 ** 2, 5, 130)
+
+        assert build_sample(previous, current, origin=99.0) == Sample(
+            time=3.0, cpu_percent=25.0, iowait_percent=25.0, memory_used=2 * 1024 ** 3, memory_total=4 * 1024 ** 3,
+            disk_read_rate=2048.0, disk_write_rate=1024 ** 2, running_tasks=5, tasks=130, cpus=2
+        )
+
+    def test_summarize(self):
+        summary = summarize([make_sample(cpu_percent=cpu_percent) for cpu_percent in (10, 20, 30, 40, 50)])
+
+        assert summary["cpu_percent"] == {"peak": 50, "mean": 30, "p50": 30, "p95": pytest.approx(48)}
+
+    @pytest.mark.parametrize("samples, expected", [
+        ([make_sample()], None),
+        ([make_sample(memory_used=4 * 1024 ** 3 - 1)], "memory"),
+        ([make_sample(iowait_percent=40)], "I/O"),
+        ([make_sample(cpu_percent=95)], "CPU"),
+        ([make_sample(cpu_percent=50, cpus=2)], "single-CPU"),
+        ([], None),
+    ])
+    def test_bottleneck(self, samples, expected):
+        assert bottleneck(samples) == expected
+
+    def test_write_profile(self, tmp_path):
+        samples = [make_sample(cpu_percent=10), make_sample(cpu_percent=20)]
+        write_profile(samples, str(tmp_path / "profile.csv"))
+        write_profile(samples, str(tmp_path / "profile.json"))
+
+        lines = (tmp_path / "profile.csv").read_text().splitlines()
+        assert lines[0].startswith("time,cpu_percent,iowait_percent")
+        assert len(lines) == 3
+        profile = json.loads((tmp_path / "profile.json").read_text())
+        assert [sample["cpu_percent"] for sample in profile["samples"]] == [10, 20]
+        assert profile["summary"]["cpu_percent"]["peak"] == 20
+
+    @pytest.mark.skipif(not sys.platform.startswith("linux"), reason="the samples are read from /proc")
+    def test_profile_guest(self, fake_multipass, tmp_path, capsys):
+        with profile_guest("test-instance", interval=0.05, output_path=str(tmp_path / "profile.csv")) as profiler:
+            time.sleep(0.5)
+
+        assert len(profiler.samples) >= 2
+        assert all(sample.memory_total > 0 and 0 <= sample.cpu_percent <= 100 for sample in profiler.samples)
+        assert "cpu_percent" in capsys.readouterr().out
+        assert len((tmp_path / "profile.csv").read_text().splitlines()) == len(profiler.samples) + 1
+
+
+class TestRetry:
+    def test_timeout_kills_the_command_and_its_children(self, tmp_path):
+        marker = tmp_path / "marker"
+        command = ["bash", "-c", f"(sleep 2; touch {marker}) & sleep 10"]
+        start = time.monotonic()
+        result = run_multipass_command(command, policy=CommandPolicy(timeout=0.3))
+        time.sleep(2.2)
+
+        assert (result.returncode, result.timed_out, result.attempts) == (124, True, 1)
+        assert time.monotonic() - start < 5
+        assert not marker.exists()
+
+    def test_failed_command_is_retried(self, tmp_path, monkeypatch, capsys):
+        monkeypatch.setattr("crash_test.retry.BACKOFF_BASE", 0)
+        counter = tmp_path / "counter"
+        command = [sys.executable, "-c", f"import pathlib, sys; counter = pathlib.Path({str(counter)!r}); "
+                                         f"attempts = len(counter.read_text()) if counter.exists() else 0; "
+                                         f"counter.write_text('x' * (attempts + 1)); sys.exit(attempts < 1)"]
+
+        result = run_multipass_command(command, policy=CommandPolicy(retries=2))
+
+        assert (result.ok, result.attempts) == (True, 2)
+        assert "retrying in 0.0s (1/2)" in capsys.readouterr().out
+
+    def test_failure_raises_a_typed_result(self):
+        with pytest.raises(SystemExit) as error:
+            execute_multipass_command([sys.executable, "-c", "import sys; print('boom', file=sys.stderr); sys.exit(3)"])
+
+        assert isinstance(error.value, MultipassCommandError)
+        assert error.value.code == 3
+        assert error.value.result.output_tail == ["boom\n"]
+
+    def test_policies(self):
+        try:
+            set_policy("launch", timeout=0)
+            set_policy("exec", retries=3)
+            assert get_policy(["multipass", "launch", "--name", "test-instance"]).timeout is None
+            assert get_policy(["multipass", "exec", "test-instance", "--", "ls"]).retries == 3
+            assert get_policy(["ls"]) == CommandPolicy()
+        finally:
+            reset_policies()
+        assert get_policy(["multipass", "launch"]) == CommandPolicy(retries=2)
+
+    def test_phase_value(self):
+        assert phase_value("transfer=60") == ("transfer", 60.0)
+        for value in ("transfer", "unknown=60", "transfer=soon"):
+            with pytest.raises(argparse.ArgumentTypeError):
+                phase_value(value)
+
+    def test_backoff_delay(self):
+        assert all(0 <= backoff_delay(retry) <= min(30, 2 * 2 ** retry) for retry in range(10))
+
+    def test_terminate_active_processes(self):
+        process = subprocess.Popen(["sleep", "10"], start_new_session=True)
+        track_process_group(process.pid)
+        try:
+            terminate_active_processes()
+            assert process.wait(timeout=5) != 0
+        finally:
+            untrack_process_group(process.pid)
+
+
+def record_launch(duration: float, exit_code: int = 0) -> int:
+    return record_run([Timing(name="launch", category="step", start=0, end=duration),
+                       Timing(name="multipass launch --name test-instance", category="multipass", start=0,
+                              end=duration, returncode=exit_code, bytes_out=100)],
+                      started=time.time(), duration=duration, exit_code=exit_code, project="/test_project")
+
+
+class TestHistory:
+    def test_aggregate_phases(self):
+        phases = aggregate_phases([
+            Timing(name="transfer", category="step", start=0, end=3),
+            Timing(name="multipass transfer a test-instance:a", category="multipass", start=0, end=1, bytes_in=10),
+            Timing(name="multipass transfer b test-instance:b", category="multipass", start=1, end=3, bytes_in=20),
+        ])
+
+        assert [(phase.name, phase.duration, phase.commands, phase.bytes_in) for phase in phases] == [
+            ("transfer", 3, 0, 0), ("multipass transfer", 3, 2, 30)
+        ]
+
+    def test_phase_statistics_of_successful_runs(self, crashtest_home):
+        for duration in range(1, 11):
+            record_launch(duration)
+        record_launch(100, exit_code=1)
+
+        statistics = phase_statistics()
+
+        assert statistics["launch"]["runs"] == 10
+        assert statistics["launch"]["p50"] == pytest.approx(5.5)
+        assert statistics["launch"]["p99"] == pytest.approx(9.91)
+        assert statistics["multipass launch"]["bytes_out"] == 100
+        assert phase_statistics(project="/other_project") == {}
+
+    def test_find_regressions(self, crashtest_home):
+        for duration in (10, 11, 10, 12, 11):
+            record_launch(duration)
+        assert find_regressions(run_ids=[record_launch(13)]) == []
+
+        slow_run = record_launch(30)
+        regressions = find_regressions()
+
+        assert {(regression.run_id, regression.phase) for regression in regressions} == {
+            (slow_run, "launch"), (slow_run, "multipass launch")
+        }
+        assert regressions[0].slowdown == pytest.approx(30 / 11)
+
+    def test_stats_main_prints_json(self, crashtest_home, capsys):
+        record_launch(10)
+        stats_main(["--json"])
+
+        stats = json.loads(capsys.readouterr().out)
+        assert stats["phases"]["launch"]["p95"] == 10
+        assert stats["regressions"] == []
+
+    def test_record_history_does_not_fail_the_run(self, crashtest_home, tmp_path, capsys):
+        crashtest = make_crashtest("--instance-name", "test-instance", "--project", str(tmp_path))
+
+        with patch("crash_test.crashtest.record_run", side_effect=PermissionError("read-only home")):
+            crashtest.record_history([], started=time.time(), exit_code=0)
+
+        assert "could not be recorded in the history: read-only home" in capsys.readouterr().out
+
+
+class TestCollect:
+    def test_parse_artifacts(self):
+        output = b"12\t1700000000.5\treports/a.txt\x0034\t1700000001.0\t./reports/a.txt\x00" \
+                 b"5\t1700000002.0\t/var/crash/core\x00"
+
+        assert parse_artifacts(output) == [Artifact(path="/var/crash/core", size=5, mtime="1700000002.0"),
+                                           Artifact(path="reports/a.txt", size=34, mtime="1700000001.0")]
+
+    def test_select_artifacts(self, tmp_path):
+        (tmp_path / "unchanged.txt").write_text("12345")
+        manifest = {"unchanged.txt": {"size": 5, "mtime": "1"}, "changed.txt": {"size": 5, "mtime": "1"}}
+        artifacts = [Artifact(path="unchanged.txt", size=5, mtime="1"), Artifact(path="changed.txt", size=5, mtime="2"),
+                     Artifact(path="large.bin", size=100, mtime="1"), Artifact(path="small.txt", size=5, mtime="1")]
+
+        selected, unchanged, oversized = select_artifacts(artifacts, manifest=manifest, output_path=str(tmp_path),
+                                                          max_size=50)
+
+        assert [artifact.path for artifact in selected] == ["changed.txt", "small.txt"]
+        assert [artifact.path for artifact in unchanged] == ["unchanged.txt"]
+        assert [artifact.path for artifact in oversized] == ["large.bin"]
+
+    def test_extract_artifacts_stays_in_the_output_folder(self, tmp_path):
+        archive_path = tmp_path / "artifacts.tar.gz"
+        with tarfile.open(archive_path, "w:gz") as archive:
+            for name in ("reports/a.txt", "../escaped.txt"):
+                data = name.encode()
+                member = tarfile.TarInfo(name)
+                member.size = len(data)
+                archive.addfile(member, io.BytesIO(data))
+
+        with open(archive_path, "rb") as archive_file:
+            assert extract_artifacts(archive_file, output_path=str(tmp_path / "output")) == ["reports/a.txt"]
+
+        assert (tmp_path / "output" / "reports" / "a.txt").read_text() == "reports/a.txt"
+        assert not (tmp_path / "escaped.txt").exists()
+
+
+class TestHeadless:
+    @pytest.mark.parametrize("policy, succeeded, expected", [
+        ("always", False, True),
+        ("on-success", True, True),
+        ("on-success", False, False),
+        ("never", True, False),
+    ])
+    def test_should_teardown(self, policy, succeeded, expected):
+        assert should_teardown(policy, succeeded=succeeded) is expected
+
+    def test_build_result(self):
+        job = MatrixJob(instance_name="test-instance-1", image="22.04", profile=Profile(cpus=2), returncode=3,
+                        failed_step="script", duration=1.5)
+        result = build_result(exit_code=3, started=time.time(), instance_name="test-instance", project="/test_project",
+                              image=None, failed_step="script", jobs=[job])
+
+        assert (result["status"], result["exit_code"], result["failed_step"]) == ("failed", 3, "script")
+        assert result["jobs"] == [{"instance": "test-instance-1", "image": "22.04", "profile": "2:-:-",
+                                   "exit_code": 3, "failed_step": "script", "duration": 1.5}]
+        assert run_status(0) == "passed" and run_status(130) == "cancelled"
+
+
+class TestBake:
+    def test_script_ecosystem(self):
+        assert script_ecosystem("/scripts/python_dependencies.sh") == "python"
+        assert script_ecosystem("npm_dependencies.sh") == "npm"
+
+    def test_base_instance_name(self):
+        assert base_instance_name(["python", "npm", "python"], "22.04", 3) == "crashtest-base-npm-python-22-04-v3"
+        assert base_instance_name(["python"], None, 1) == "crashtest-base-python-default-v1"
+
+    def test_base_expired(self):
+        base = {"created": time.time() - 3600, "fingerprint": "abc"}
+
+        assert base_expired(base, max_age=7200, fingerprint="abc") is False
+        assert base_expired(base, max_age=1800, fingerprint="abc") is True
+        assert base_expired(base, max_age=7200, fingerprint="def") is True
+
+    @pytest.mark.parametrize("argv", [[], ["--ecosystem", "cobol"]])
+    def test_bake_without_a_known_ecosystem_fails(self, argv, crashtest_home):
+        with patch("crash_test.bake.ecosystem_scripts", return_value={"python": "python_dependencies.sh"}), \
+                patch("crash_test.bake.ensure_base") as mock_ensure_base, pytest.raises(SystemExit) as error:
+            bake_main(argv)
+
+        assert error.value.code == 1
+        mock_ensure_base.assert_not_called()
+
+
+class TestDaemon:
+    def test_admission_queue_admits_in_order_within_budget(self):
+        admission_queue = AdmissionQueue(cpus=4, memory=4, disk=4)
+        jobs = [{"id": index, "name": f"job-{index}", "cpus": 2, "memory": 1, "disk": 1} for index in range(3)]
+        admitted = []
+
+        for job in jobs[:2]:
+            admission_queue.acquire(job)
+        waiting_job = threading.Thread(target=lambda: admitted.append(admission_queue.acquire(jobs[2])))
+        waiting_job.start()
+
+        time.sleep(0.1)
+        assert admitted == []
+        assert admission_queue.status()["queue_depth"] == 1
+
+        admission_queue.release(jobs[0])
+        waiting_job.join(timeout=5)
+        assert len(admitted) == 1
+        assert admission_queue.status()["used"] == {"cpus": 4, "memory": 2, "disk": 2}
+        assert admission_queue.status()["admitted_total"] == 3
+
+    @pytest.mark.skipif(not hasattr(socketserver, "UnixStreamServer"), reason="Unix sockets are not available")
+    def test_admission_through_the_daemon(self, tmp_path, capsys):
+        socket_path = str(tmp_path / "crashtest.sock")
+        server = DaemonServer(socket_path, AdmissionQueue(cpus=2, memory=2 ** 30, disk=2 ** 30))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        try:
+            with admission(socket_path, name="test-instance", cpus=2, memory=1, disk=1) as admitted:
+                assert admitted is True
+                time.sleep(0.1)
+                assert server.admission_queue.status()["used"]["cpus"] == 2
+
+            with admission(socket_path, name="test-instance", cpus=4, memory=1, disk=1) as admitted:
+                assert admitted is False
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        assert "rejected the job" in capsys.readouterr().out
+
+    def test_requested_resources_of_a_matrix(self):
+        crash_test = make_crashtest("-i", "test-instance", "-p", "test_project", "--matrix-image", "22.04",
+                                    "--matrix-profile", "2:2G:10G", "--matrix-count", "2", "--concurrency", "3")
+
+        assert crash_test.requested_resources() == {"cpus": 4, "memory": 2 * parse_size("2G"),
+                                                    "disk": 2 * parse_size("10G")}
+
+    def test_matrix_rejects_the_options_it_does_not_support(self, tmp_path, capsys):
+        crash_test = make_crashtest("-i", "test-instance", "-p", str(tmp_path), "--matrix-count", "2", "--pool",
+                                    "--stream", "--headless")
+
+        with patch("crash_test.crashtest.run_matrix") as mock_run_matrix, pytest.raises(SystemExit) as error:
+            crash_test.run_matrix()
+
+        assert error.value.code == INVALID_ARGUMENTS_EXIT_CODE
+        mock_run_matrix.assert_not_called()
+        assert "the matrix instances do not support --pool, --stream." in capsys.readouterr().out
+
+
+@pytest.mark.skipif(sys.platform.startswith("win32"), reason="the multipass stand-in is started by a shell script")
+class TestEndToEnd:
+    @pytest.fixture
+    def benchmark_multipass(self, tmp_path, monkeypatch, crashtest_home):
+        """
+        Puts on PATH the fake multipass of the benchmarks
+        """
+        fake_multipass_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "benchmarks",
+                                           "fake_multipass.py")
+        bin_path = tmp_path / "bin"
+        bin_path.mkdir()
+        (bin_path / "multipass").write_text(f'#!/bin/sh\nexec "{sys.executable}" "{fake_multipass_path}" "$@"\n')
+        (bin_path / "multipass").chmod(0o755)
+
+        monkeypatch.setenv("PATH", f"{bin_path}{os.pathsep}{os.environ['PATH']}")
+        monkeypatch.setenv("FAKE_MULTIPASS_ROOT", str(tmp_path / "multipass"))
+        monkeypatch.setenv("FAKE_MULTIPASS_LAUNCH_LATENCY", "0")
+        yield tmp_path / "multipass" / "instances"
+
+    @pytest.mark.parametrize("transfer_arguments", [[], ["--stream"]])
+    def test_run_transfers_project_and_executes_script(self, tmp_path, benchmark_multipass, transfer_arguments):
+        tmp_project_path = tmp_path / "test_project"
+        tmp_project_path.mkdir()
+        (tmp_project_path / "main.py").write_text("print('test')")
+        script = tmp_path / "check.sh"
+        script.write_text("touch script_executed\n")
+
+        make_crashtest("-i", "test-instance", "-p", str(tmp_project_path), "-s", str(script),
+                       *transfer_arguments).run()
+
+        assert (benchmark_multipass / "test-instance" / "test_project" / "main.py").read_text() == "print('test')"
+        assert (benchmark_multipass / "test-instance" / "script_executed").exists()
+
+    def test_matrix_keeps_an_existing_instance(self, tmp_path, benchmark_multipass):
+        tmp_project_path = tmp_path / "test_project"
+        tmp_project_path.mkdir()
+        subprocess.run(["multipass", "launch", "--name", "test-instance-1"], check=True)
+        (benchmark_multipass / "test-instance-1" / "keep").write_text("")
+
+        with pytest.raises(SystemExit):
+            make_crashtest("-i", "test-instance", "-p", str(tmp_project_path), "--matrix-count", "2").run()
+
+        assert (benchmark_multipass / "test-instance-1" / "keep").exists()
+        assert (benchmark_multipass / "test-instance-2" / "test_project").exists()
+        assert set(get_registry_state()["instances"]) == {"test-instance-2"}
+
+    def test_resumed_instance_is_not_registered(self, tmp_path, benchmark_multipass):
+        tmp_project_path = tmp_path / "test_project"
+        tmp_project_path.mkdir()
+        subprocess.run(["multipass", "launch", "--name", "test-instance"], check=True)
+
+        make_crashtest("-i", "test-instance", "-p", str(tmp_project_path)).run()
+
+        assert (benchmark_multipass / "test-instance" / "test_project").exists()
+        assert "test-instance" not in get_registry_state()["instances"]
+
+    def test_run_is_recorded_in_the_history(self, tmp_path, benchmark_multipass):
+        tmp_project_path = tmp_path / "test_project"
+        tmp_project_path.mkdir()
+
+        make_crashtest("-i", "test-instance", "-p", str(tmp_project_path)).run()
+        make_crashtest("-i", "test-instance", "-p", str(tmp_project_path), "--no-history").run()
+
+        statistics = phase_statistics(project=str(tmp_project_path))
+        assert statistics["launch"]["runs"] == 1
+        assert statistics["multipass launch"]["runs"] == 1
+
+    def test_run_collects_the_artifacts(self, tmp_path, benchmark_multipass, capsys):
+        tmp_project_path = tmp_path / "test_project"
+        tmp_project_path.mkdir()
+        script = tmp_path / "check.sh"
+        # The artifacts are only written by the first run
+        script.write_text("[ -d reports ] || (mkdir -p reports/nested && echo a > reports/a.txt && "
+                          "echo b > reports/nested/b.txt)\n")
+        collect_path = tmp_path / "artifacts"
+        arguments = ["-i", "test-instance", "-p", str(tmp_project_path), "-s", str(script), "--collect", "reports/**",
+                     "--collect", "missing.txt", "--collect-dir", str(collect_path)]
+
+        make_crashtest(*arguments).run()
+
+        assert (collect_path / "reports" / "a.txt").read_text() == "a\n"
+        assert (collect_path / "reports" / "nested" / "b.txt").read_text() == "b\n"
+        assert "2 artifact(s) collected" in capsys.readouterr().out
+
+        make_crashtest(*arguments).run()
+        assert "No new artifact to collect (2 unchanged)" in capsys.readouterr().out
+
+    def test_headless_run_deletes_the_instance_and_prints_the_result(self, tmp_path, benchmark_multipass, capsys):
+        tmp_project_path = tmp_path / "test_project"
+        tmp_project_path.mkdir()
+        script = tmp_path / "check.sh"
+        script.write_text("touch script_executed\n")
+
+        with patch("builtins.input", side_effect=AssertionError("headless runs never prompt")):
+            make_crashtest("-i", "test-instance", "-p", str(tmp_project_path), "-s", str(script), "--headless").run()
+
+        result = json.loads(capsys.readouterr().out.splitlines()[-1])
+        assert (result["status"], result["exit_code"], result["teardown"]) == ("passed", 0, "deleted")
+        assert {"launch", "transfer", "custom script"} <= result["steps"].keys()
+        invalidate_instances_cache()
+        assert instance_exists("test-instance") is False
+
+    def test_headless_run_fails_when_the_daemon_is_unreachable(self, tmp_path, benchmark_multipass, capsys):
+        tmp_project_path = tmp_path / "test_project"
+        tmp_project_path.mkdir()
+
+        with pytest.raises(SystemExit) as error:
+            make_crashtest("-i", "test-instance", "-p", str(tmp_project_path), "--headless", "--daemon",
+                           "--daemon-socket", str(tmp_path / "missing.sock")).run()
+
+        assert error.value.code == 1
+        output = capsys.readouterr().out
+        assert "cannot connect to the crashtest daemon" in output
+        result = json.loads(output.splitlines()[-1])
+        assert (result["status"], result["failed_step"]) == ("failed", "admission")
+        assert not (benchmark_multipass / "test-instance").exists()
+
+    def test_headless_run_propagates_the_exit_code_of_the_script(self, tmp_path, benchmark_multipass):
+        tmp_project_path = tmp_path / "test_project"
+        tmp_project_path.mkdir()
+        script = tmp_path / "check.sh"
+        script.write_text("exit 3\n")
+        result_path = tmp_path / "result.json"
+
+        with pytest.raises(SystemExit) as error:
+            make_crashtest("-i", "test-instance", "-p", str(tmp_project_path), "-s", str(script), "--headless",
+                           "--teardown", "on-success", "--result-file", str(result_path)).run()
+
+        assert error.value.code == 3
+        result = json.loads(result_path.read_text())
+        assert (result["status"], result["failed_step"], result["teardown"]) == ("failed", "custom script", "kept")
+        assert (benchmark_multipass / "test-instance").exists()
+
+    def test_bake_and_clone_a_base(self, tmp_path, benchmark_multipass):
+        script = tmp_path / "python_dependencies.sh"
+        script.write_text('[ "$CRASHTEST_TOOLCHAIN_ONLY" = 1 ] && mkdir -p .crashtest-baked && '
+                          'touch .crashtest-baked/python\n')
+        ecosystems = {"python": str(script)}
+
+        base = ensure_base(ecosystems, image=None, max_age=3600)
+        assert base["instance"] == "crashtest-base-python-default-v1"
+        assert base["fingerprint"] == toolchain_fingerprint([str(script)])
+        assert (benchmark_multipass / base["instance"] / ".crashtest-baked" / "python").exists()
+        assert ensure_base(ecosystems, image=None, max_age=3600) == base
+
+        # Outdated
+        rebaked = ensure_base(ecosystems, image=None, max_age=0)
+        invalidate_instances_cache()
+        assert rebaked["version"] == 2
+        assert not instance_exists(base["instance"])
+
+        restore_base(rebaked["instance"], instance_name="test-instance", cpus=2, memory="2G")
+        instances = json.loads((benchmark_multipass.parent / "instances.json").read_text())
+        assert (instances["test-instance"]["state"], instances["test-instance"]["cpus"]) == ("Running", "2")
+        assert (benchmark_multipass / "test-instance" / ".crashtest-baked" / "python").exists()
+
+    def test_gc_deletes_instances_launched_by_crashtest(self, tmp_path, benchmark_multipass):
+        tmp_project_path = tmp_path / "test_project"
+        tmp_project_path.mkdir()
+
+        make_crashtest("-i", "test-instance", "-p", str(tmp_project_path)).run()
+        assert "test-instance" in get_registry_state()["instances"]
+
+        gc_main(["--ttl", "1h"])
+        assert (benchmark_multipass / "test-instance").exists()
+
+        gc_main(["--ttl", "0"])
+        invalidate_instances_cache()
+        assert not (benchmark_multipass / "test-instance").exists()
+        assert instance_exists("test-instance") is False
+
+    def test_watch_syncs_and_runs_the_script_again(self, tmp_path, benchmark_multipass):
+        tmp_project_path = tmp_path / "test_project"
+        tmp_project_path.mkdir()
+        (tmp_project_path / "main.py").write_text("print('test')\n")
+        script = tmp_path / "check.sh"
+        script.write_text("cat test_project/main.py >> runs\n")
+        runs_path = benchmark_multipass / "test-instance" / "runs"
+
+        def wait_for_changes():
+            if not runs_path.exists():
+                # The initial run
+                (tmp_project_path / "main.py").write_text("print('changed')\n")
+                while not runs_path.exists():
+                    time.sleep(0.01)
+                return ["main.py"]
+            while runs_path.read_text().count("\n") < 2:
+                time.sleep(0.01)
+            raise KeyboardInterrupt
+
+        with patch.object(ProjectWatcher, "wait_for_changes", side_effect=wait_for_changes):
+            make_crashtest("-i", "test-instance", "-p", str(tmp_project_path), "-s", str(script), "--watch").run()
+
+        assert runs_path.read_text() == "print('test')\nprint('changed')\n"
+
+    def test_run_with_persistent_session(self, tmp_path, benchmark_multipass):
+        tmp_project_path = tmp_path / "test_project"
+        tmp_project_path.mkdir()
+        (tmp_project_path / "main.py").write_text("print('test')")
+        script = tmp_path / "check.sh"
+        script.write_text("touch script_executed\n")
+
+        make_crashtest("-i", "test-instance", "-p", str(tmp_project_path), "-s", str(script),
+                       "--persistent-session").run()
+
+        assert (benchmark_multipass / "test-instance" / "test_project" / "check.sh").exists()
+        assert (benchmark_multipass / "test-instance" / "script_executed").exists()
+
+    def test_run_reuses_stopped_instance(self, tmp_path, benchmark_multipass):
+        tmp_project_path = tmp_path / "test_project"
+        tmp_project_path.mkdir()
+        (tmp_project_path / "main.py").write_text("print('test')")
+
+        make_crashtest("-i", "test-instance", "-p", str(tmp_project_path)).run()
+        execute_multipass_command(["multipass", "stop", "test-instance"])
+        (tmp_project_path / "main.py").write_text("print('test2')")
+        make_crashtest("-i", "test-instance", "-p", str(tmp_project_path)).run()
+
+        commands = [timing.name.split()[1] for timing in recorder.commands()[-5:]]
+        assert "launch" not in commands and "start" in commands
+        assert (benchmark_multipass / "test-instance" / "test_project" / "main.py").read_text() == "print('test2')"